@@ -1,9 +1,10 @@
-from .and_controller import execute_adb, AndroidController, traverse_tree
+from .and_controller import execute_adb, AndroidController, traverse_tree, extract_elements
 from .state import ControlState
 from .prompts import self_explore_task_template, self_explore_reflect_template
-from .model import Lang_Azure, Explore_rsp, Reflect_rsp, AppLaunch_rsp
+from .model import Lang_Azure, Explore_rsp, Explore_action_first_rsp, Explore_completion_rsp, Reflect_rsp, AppLaunch_rsp
 
-__all__ = ['execute_adb', 'traverse_tree', 'AndroidController',
+__all__ = ['execute_adb', 'traverse_tree', 'extract_elements', 'AndroidController',
            'ControlState',
            'self_explore_task_template', 'self_explore_reflect_template',
-           'Lang_Azure', 'Explore_rsp', 'Reflect_rsp', 'AppLaunch_rsp']
\ No newline at end of file
+           'Lang_Azure', 'Explore_rsp', 'Explore_action_first_rsp', 'Explore_completion_rsp', 'Reflect_rsp',
+           'AppLaunch_rsp']
\ No newline at end of file
@@ -0,0 +1,171 @@
+import os
+import socket
+import struct
+import threading
+import uuid
+
+
+class AdbError(Exception):
+    pass
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise AdbError("Connection closed by adb server")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def frame_command(command, marker):
+    """
+    Wraps a shell command so its output ends with `marker` followed by the exit code.
+
+    The command runs in a { ...; } group with stdin from /dev/null: a redirect after a bare command only
+    applies to the last command of a pipeline, and the others would read (and consume) the commands queued
+    on a persistent session's stdin.
+    """
+    return f"{{ {command}\n}} </dev/null 2>&1; echo {marker}$?"
+
+
+class AdbClient:
+    """
+    A minimal client for the adb host protocol, talking to the local adb server (default 127.0.0.1:5037).
+
+    Each shell/exec request opens a connection, switches it to the device with `host:transport:<serial>`
+    and reads the service stream until the server closes it. Connections in `sync:` mode stay usable across
+    transfers, so those are pooled and reused for every pull.
+    """
+
+    def __init__(self, serial, host="127.0.0.1", port=5037, timeout=None, sync_pool_size=2):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sync_pool_size = sync_pool_size
+        self.marker = f"__ADB_END_{uuid.uuid4().hex}__"
+        self._sync_pool = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise AdbError(f"Cannot connect to adb server at {self.host}:{self.port}: {e}")
+
+    @staticmethod
+    def _send_request(sock, payload):
+        data = payload.encode("utf-8")
+        sock.sendall(b"%04x" % len(data) + data)
+        status = _recv_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            length = int(_recv_exact(sock, 4), 16)
+            raise AdbError(_recv_exact(sock, length).decode("utf-8", errors="replace"))
+        raise AdbError(f"Unexpected adb server status: {status!r}")
+
+    def _open_service(self, service):
+        sock = self._connect()
+        try:
+            self._send_request(sock, f"host:transport:{self.serial}")
+            self._send_request(sock, service)
+        except (AdbError, OSError):
+            sock.close()
+            raise
+        return sock
+
+    def stream(self, service, chunk_size=65536):
+        """Yields the raw output of a device service such as `exec:screencap -p` as it arrives."""
+        sock = self._open_service(service)
+        try:
+            while True:
+                chunk = sock.recv(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            sock.close()
+
+    def exec_out(self, command):
+        return b"".join(self.stream(f"exec:{command}"))
+
+    def shell(self, command):
+        """
+        Runs a shell command on the device.
+
+        Returns:
+        - (exit_code, output): output holds stdout and stderr of the command, stripped.
+        """
+        raw = b"".join(self.stream("shell:" + frame_command(command, self.marker)))
+        text = raw.decode("utf-8", errors="replace")
+        index = text.rfind(self.marker)
+        if index < 0:
+            raise AdbError(f"Incomplete response for: {command}")
+        exit_code = text[index + len(self.marker):].strip()
+        return int(exit_code) if exit_code.isdigit() else 1, text[:index].strip()
+
+    def _acquire_sync(self):
+        with self._lock:
+            if self._sync_pool:
+                return self._sync_pool.pop()
+        return self._open_service("sync:")
+
+    def _release_sync(self, sock):
+        with self._lock:
+            if len(self._sync_pool) < self.sync_pool_size:
+                self._sync_pool.append(sock)
+                return
+        sock.close()
+
+    def pull_stream(self, remote_path):
+        """Yields the content of a device file using the sync protocol (RECV -> DATA... DONE)."""
+        sock = self._acquire_sync()
+        reusable = False
+        try:
+            path = remote_path.encode("utf-8")
+            sock.sendall(b"RECV" + struct.pack("<I", len(path)) + path)
+            while True:
+                header = _recv_exact(sock, 8)
+                kind, length = header[:4], struct.unpack("<I", header[4:])[0]
+                if kind == b"DATA":
+                    yield _recv_exact(sock, length)
+                elif kind == b"DONE":
+                    reusable = True
+                    return
+                elif kind == b"FAIL":
+                    # adbd结束了失败的RECV所在的sync服务，连接不能再放回池中
+                    raise AdbError(_recv_exact(sock, length).decode("utf-8", errors="replace"))
+                else:
+                    raise AdbError(f"Unexpected sync response: {kind!r}")
+        finally:
+            if reusable:
+                self._release_sync(sock)
+            else:
+                sock.close()
+
+    def pull(self, remote_path, local_path):
+        tmp_path = local_path + ".part"
+        with open(tmp_path, "wb") as f:
+            try:
+                for chunk in self.pull_stream(remote_path):
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                os.remove(tmp_path)
+                raise
+        os.replace(tmp_path, local_path)
+        return local_path
+
+    def close(self):
+        with self._lock:
+            pool, self._sync_pool = self._sync_pool, []
+        for sock in pool:
+            try:
+                sock.sendall(b"QUIT" + struct.pack("<I", 0))
+            except OSError:
+                pass
+            sock.close()
@@ -0,0 +1,279 @@
+import subprocess
+import threading
+import time
+import uuid
+
+from configs import load_config
+from utils import print_with_color, perf_stats
+from agents.adb_client import AdbClient, AdbError, frame_command
+
+
+configs = load_config()
+
+
+def execute_adb(adb_command):
+    # print(adb_command)
+    result = subprocess.run(adb_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode == 0:
+        return result.stdout.strip()
+    print_with_color(f"Command execution failed: {adb_command}", "red")
+    print_with_color(result.stderr, "red")
+    return "ERROR"
+
+
+def _command_name(command):
+    return command.split()[0] if command.strip() else "empty"
+
+
+class AdbShellSession:
+    """
+    A long-lived `adb -s <device> shell` process.
+
+    Commands are written to the shell's stdin one at a time and framed with a per-session end marker that
+    carries the exit code, so a single process and adb handshake serve any number of commands.
+    """
+
+    def __init__(self, device, timeout=None):
+        self.device = device
+        self.timeout = timeout
+        self.marker = f"__ADB_END_{uuid.uuid4().hex}__"
+        self.proc = None
+
+    def start(self):
+        self.proc = subprocess.Popen(["adb", "-s", self.device, "shell"], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        if self.alive():
+            try:
+                self.proc.stdin.write(b"exit\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+        self.proc = None
+
+    def run(self, command):
+        """
+        Runs one command in the session.
+
+        Returns:
+        - (exit_code, output): output holds stdout and stderr of the command, stripped.
+
+        Raises:
+        - ConnectionError: the shell process died or the command exceeded the timeout.
+        """
+        if not self.alive():
+            self.start()
+        proc = self.proc
+        watchdog = None
+        if self.timeout:
+            watchdog = threading.Timer(self.timeout, proc.kill)
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            proc.stdin.write((frame_command(command, self.marker) + "\n").encode("utf-8"))
+            proc.stdin.flush()
+            lines = []
+            while True:
+                line = proc.stdout.readline()
+                if not line:
+                    raise ConnectionError(f"adb shell session for {self.device} closed while running: {command}")
+                text = line.decode("utf-8", errors="replace")
+                index = text.find(self.marker)
+                if index < 0:
+                    lines.append(text)
+                    continue
+                lines.append(text[:index])
+                exit_code = text[index + len(self.marker):].strip()
+                return int(exit_code) if exit_code.isdigit() else 1, "".join(lines).strip()
+        except (OSError, ValueError) as e:
+            raise ConnectionError(str(e))
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+
+class SubprocessTransport:
+    """Runs every command as a separate `adb` process through `execute_adb`."""
+
+    name = "subprocess"
+
+    def __init__(self, device):
+        self.device = device
+
+    def shell(self, command):
+        with perf_stats.timer(f"adb.{self.name}.{_command_name(command)}"):
+            return execute_adb(f"adb -s {self.device} shell {command}")
+
+    def pull(self, remote_path, local_path):
+        with perf_stats.timer(f"adb.{self.name}.pull"):
+            return execute_adb(f"adb -s {self.device} pull {remote_path} {local_path}")
+
+    def exec_out(self, command):
+        """Runs a command with `adb exec-out` and returns its raw stdout bytes, or "ERROR"."""
+        with perf_stats.timer(f"adb.{self.name}.exec-out.{_command_name(command)}"):
+            result = subprocess.run(["adb", "-s", self.device, "exec-out", *command.split()],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode == 0:
+            return result.stdout
+        print_with_color(f"Command execution failed: exec-out {command}", "red")
+        print_with_color(result.stderr.decode("utf-8", errors="replace"), "red")
+        return "ERROR"
+
+    def exec_out_stream(self, command, chunk_size=65536):
+        """
+        Yields the raw stdout of `adb exec-out <command>` as it arrives.
+
+        Raises:
+        - ConnectionError: the command failed.
+        """
+        start_time = time.perf_counter()
+        proc = subprocess.Popen(["adb", "-s", self.device, "exec-out", *command.split()],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while True:
+                chunk = proc.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            if proc.wait() != 0:
+                raise ConnectionError(proc.stderr.read().decode("utf-8", errors="replace"))
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.stderr.close()
+            perf_stats.record(f"adb.{self.name}.exec-out.{_command_name(command)}", time.perf_counter() - start_time)
+
+    def close(self):
+        pass
+
+
+class ShellSessionTransport(SubprocessTransport):
+    """
+    Routes shell commands through a small pool of persistent `adb shell` sessions.
+
+    Each session runs one command at a time; concurrent callers check out separate sessions, up to
+    `pool_size`, and wait for a free one beyond that. Host-side commands such as `pull` and binary
+    `exec-out` output keep using a one-off `adb` process.
+    """
+
+    name = "session"
+
+    def __init__(self, device, pool_size=2, timeout=None):
+        super().__init__(device)
+        self.timeout = timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max(1, pool_size))
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return AdbShellSession(self.device, self.timeout)
+
+    def _release(self, session):
+        with self._lock:
+            self._idle.append(session)
+        self._slots.release()
+
+    def shell(self, command):
+        session = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            exit_code, output = session.run(command)
+        except ConnectionError as e:
+            session.close()
+            print_with_color(f"Command execution failed: {command}", "red")
+            print_with_color(str(e), "red")
+            return "ERROR"
+        finally:
+            perf_stats.record(f"adb.{self.name}.{_command_name(command)}", time.perf_counter() - start_time)
+            self._release(session)
+        if exit_code == 0:
+            return output
+        print_with_color(f"Command execution failed: {command}", "red")
+        print_with_color(output, "red")
+        return "ERROR"
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            session.close()
+
+
+class SocketTransport(SubprocessTransport):
+    """
+    Talks to the local adb server directly through `AdbClient` instead of running the `adb` binary, so a
+    command costs one TCP connection to the server and no process creation or `sh` parsing.
+    """
+
+    name = "socket"
+
+    def __init__(self, device, host="127.0.0.1", port=5037, timeout=None):
+        super().__init__(device)
+        self.client = AdbClient(device, host=host, port=port, timeout=timeout)
+
+    def shell(self, command):
+        try:
+            with perf_stats.timer(f"adb.{self.name}.{_command_name(command)}"):
+                exit_code, output = self.client.shell(command)
+        except (AdbError, OSError) as e:
+            print_with_color(f"Command execution failed: {command}", "red")
+            print_with_color(str(e), "red")
+            return "ERROR"
+        if exit_code == 0:
+            return output
+        print_with_color(f"Command execution failed: {command}", "red")
+        print_with_color(output, "red")
+        return "ERROR"
+
+    def pull(self, remote_path, local_path):
+        try:
+            with perf_stats.timer(f"adb.{self.name}.pull"):
+                return self.client.pull(remote_path, local_path)
+        except (AdbError, OSError) as e:
+            print_with_color(f"Pull failed: {remote_path}", "red")
+            print_with_color(str(e), "red")
+            return "ERROR"
+
+    def exec_out(self, command):
+        try:
+            with perf_stats.timer(f"adb.{self.name}.exec-out.{_command_name(command)}"):
+                return self.client.exec_out(command)
+        except (AdbError, OSError) as e:
+            print_with_color(f"Command execution failed: exec-out {command}", "red")
+            print_with_color(str(e), "red")
+            return "ERROR"
+
+    def exec_out_stream(self, command, chunk_size=65536):
+        start_time = time.perf_counter()
+        try:
+            yield from self.client.stream(f"exec:{command}", chunk_size)
+        except (AdbError, OSError) as e:
+            raise ConnectionError(str(e))
+        finally:
+            perf_stats.record(f"adb.{self.name}.exec-out.{_command_name(command)}", time.perf_counter() - start_time)
+
+    def close(self):
+        self.client.close()
+
+
+def create_transport(device, kind=None):
+    kind = kind or configs["ADB_TRANSPORT"]
+    if kind == "subprocess":
+        return SubprocessTransport(device)
+    if kind == "session":
+        return ShellSessionTransport(device, pool_size=configs["ADB_SESSION_POOL_SIZE"],
+                                     timeout=configs["ADB_COMMAND_TIMEOUT"])
+    if kind == "socket":
+        return SocketTransport(device, host=configs["ADB_SERVER_HOST"], port=configs["ADB_SERVER_PORT"],
+                               timeout=configs["ADB_COMMAND_TIMEOUT"])
+    raise ValueError(f"Unknown ADB transport: {kind}")
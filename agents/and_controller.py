@@ -1,29 +1,90 @@
+import asyncio
+import functools
+import hashlib
+import math
 import os
-import subprocess
+import re
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from configs import load_config
-from utils import print_with_color
+from utils import print_with_color, Frame, PathStore, frame_store, save_frame_async, perf_stats, parse_raw_screencap
+from agents.adb_transport import execute_adb, create_transport
 
 
 configs = load_config()
 
+# 按xml路径索引的内存中的UI层级，流式获取的xml不必落盘
+hierarchy_store = PathStore()
+
+
+ATTRIB_BITS = {"clickable": 1, "focusable": 2}
+ATTRIB_NAMES = {bit: name for name, bit in ATTRIB_BITS.items()}
+
+
+class ElementStore:
+    """
+    Columnar storage for extracted UI elements, one row per element.
+
+    Bounds are parsed once into an (n, 4) array of x1, y1, x2, y2; centers and areas are precomputed from
+    it, and the attribute each element was extracted for is kept as a bitmask column.
+    """
+
+    def __init__(self, uids, bboxes, attrib_mask):
+        self.uids = list(uids)
+        self.bboxes = np.asarray(bboxes, dtype=np.int32).reshape(-1, 4)
+        self.attrib_mask = np.asarray(attrib_mask, dtype=np.uint8)
+        self.centers = (self.bboxes[:, :2] + self.bboxes[:, 2:]) // 2
+        self.areas = (self.bboxes[:, 2] - self.bboxes[:, 0]) * (self.bboxes[:, 3] - self.bboxes[:, 1])
+        # 标注的位置与draw_bbox_multi一致：元素中心向右下偏移10像素
+        self.label_positions = self.centers + 10
+
+    def __len__(self):
+        return len(self.uids)
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.intp)
+        return ElementStore([self.uids[i] for i in rows], self.bboxes[rows], self.attrib_mask[rows])
+
+    def elements(self, rows=None):
+        rows = range(len(self)) if rows is None else rows
+        return [AndroidElement(self, int(row)) for row in rows]
+
 
 class AndroidElement:
-    def __init__(self, uid, bbox, attrib):
-        self.uid = uid
-        self.bbox = bbox
-        self.attrib = attrib
+    """A thin view over one row of an ElementStore."""
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
 
+    @classmethod
+    def create(cls, uid, bbox, attrib):
+        (x1, y1), (x2, y2) = bbox
+        return cls(ElementStore([uid], [x1, y1, x2, y2], [ATTRIB_BITS.get(attrib, 0)]), 0)
 
-def execute_adb(adb_command):
-    # print(adb_command)
-    result = subprocess.run(adb_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if result.returncode == 0:
-        return result.stdout.strip()
-    print_with_color(f"Command execution failed: {adb_command}", "red")
-    print_with_color(result.stderr, "red")
-    return "ERROR"
+    @property
+    def uid(self):
+        return self.store.uids[self.row]
+
+    @property
+    def bbox(self):
+        x1, y1, x2, y2 = self.store.bboxes[self.row].tolist()
+        return (x1, y1), (x2, y2)
+
+    @property
+    def attrib(self):
+        return ATTRIB_NAMES.get(int(self.store.attrib_mask[self.row]), "")
+
+    @property
+    def center(self):
+        x, y = self.store.centers[self.row].tolist()
+        return x, y
 
 
 def list_all_devices():
@@ -38,10 +99,103 @@ def list_all_devices():
     return device_list
 
 
-def get_id_from_element(elem):
-    bounds = elem.attrib["bounds"][1:-1].split("][")
+class HierarchyDump:
+    """A uiautomator hierarchy held in memory: the raw XML bytes and the element tree parsed from them."""
+
+    def __init__(self, data, root):
+        self.data = data
+        self.root = root
+
+
+def iter_streamed_xml(chunks, buffer):
+    """
+    Parses uiautomator output incrementally, yielding (event, elem) pairs while chunks are still arriving.
+
+    The raw XML is accumulated into `buffer` (a bytearray). Anything before the XML declaration and after
+    the closing </hierarchy> tag, such as "UI hierchary dumped to: /dev/tty", is dropped.
+    """
+    parser = ET.XMLPullParser(["start", "end"])
+    end_tag = b"</hierarchy>"
+    started = False
+    fed = 0
+    for chunk in chunks:
+        buffer.extend(chunk)
+        if not started:
+            begin = buffer.find(b"<")
+            if begin < 0:
+                buffer.clear()
+                continue
+            del buffer[:begin]
+            started = True
+        end = buffer.find(end_tag, max(0, fed - len(end_tag)))
+        limit = len(buffer) if end < 0 else end + len(end_tag)
+        parser.feed(bytes(buffer[fed:limit]))
+        fed = limit
+        yield from parser.read_events()
+        if end >= 0:
+            del buffer[limit:]
+            parser.close()
+            return
+    raise ValueError("The UI hierarchy dump ended before </hierarchy>")
+
+
+def iter_xml_events(xml_path):
+    """Yields ('start'|'end', elem) for the hierarchy at `xml_path`, from memory when it was streamed."""
+    dump = hierarchy_store.get(xml_path)
+    if dump is None:
+        yield from ET.iterparse(xml_path, ['start', 'end'])
+        return
+
+    def walk(elem):
+        yield 'start', elem
+        for child in elem:
+            yield from walk(child)
+        yield 'end', elem
+
+    yield from walk(dump.root)
+
+
+def parse_bounds(bounds):
+    bounds = bounds[1:-1].split("][")
     x1, y1 = map(int, bounds[0].split(","))
     x2, y2 = map(int, bounds[1].split(","))
+    return x1, y1, x2, y2
+
+
+# 影响元素提取结果的属性，其余属性（如text、focused）的变化不改变指纹
+_FINGERPRINT_TOKENS = re.compile(rb'<node|</node>|/>|(?<![\w-])(?:index|class|resource-id|content-desc|clickable|'
+                                 rb'focusable|bounds)="[^"]*"')
+# 另外包含节点状态的属性，开关切换、文本变化等改变画面很少的操作也会改变指纹
+_STATE_FINGERPRINT_TOKENS = re.compile(rb'<node|</node>|/>|(?<![\w-])(?:index|class|resource-id|content-desc|'
+                                       rb'clickable|focusable|bounds|text|checked|selected|focused)="[^"]*"')
+
+
+def load_hierarchy_bytes(xml_path):
+    dump = hierarchy_store.get(xml_path)
+    if dump is not None:
+        return dump.data
+    with open(xml_path, "rb") as f:
+        return f.read()
+
+
+def hierarchy_fingerprint(xml_path, include_state=False):
+    """
+    Hashes the parts of a hierarchy that element extraction depends on: the node structure and the
+    index, class, resource-id, content-desc, clickable, focusable and bounds attributes.
+
+    Screens that differ only in text, focus or selection state get the same fingerprint, unless
+    `include_state` adds the text, checked, selected and focused attributes.
+    """
+    pattern = _STATE_FINGERPRINT_TOKENS if include_state else _FINGERPRINT_TOKENS
+    digest = hashlib.blake2b(digest_size=16)
+    for token in pattern.findall(load_hierarchy_bytes(xml_path)):
+        digest.update(token)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_id_from_element(elem, bounds=None):
+    x1, y1, x2, y2 = bounds or parse_bounds(elem.attrib["bounds"])
     elem_w, elem_h = x2 - x1, y2 - y1
     if "resource-id" in elem.attrib and elem.attrib["resource-id"]:
         elem_id = elem.attrib["resource-id"].replace(":", ".").replace("/", "_")
@@ -55,7 +209,7 @@ def get_id_from_element(elem):
 
 def traverse_tree(xml_path, elem_list, attrib, add_index=False):
     path = []
-    for event, elem in ET.iterparse(xml_path, ['start', 'end']):
+    for event, elem in iter_xml_events(xml_path):
         if event == 'start':
             path.append(elem)
             if attrib in elem.attrib and elem.attrib[attrib] == "true":
@@ -80,91 +234,370 @@ def traverse_tree(xml_path, elem_list, attrib, add_index=False):
                         close = True
                         break
                 if not close:
-                    elem_list.append(AndroidElement(elem_id, ((x1, y1), (x2, y2)), attrib))
+                    elem_list.append(AndroidElement.create(elem_id, ((x1, y1), (x2, y2)), attrib))
 
         if event == 'end':
             path.pop()
 
 
+class SpatialGrid:
+    """
+    Buckets element centers into square cells of side `min_dist`, so finding a center within `min_dist`
+    only has to look at the 3x3 neighbouring cells instead of every kept element.
+    """
+
+    def __init__(self, min_dist):
+        self.min_dist = min_dist
+        self.cell = max(math.ceil(min_dist), 1)
+        self.cells = {}
+
+    def add(self, center):
+        key = center[0] // self.cell, center[1] // self.cell
+        self.cells.setdefault(key, []).append(center)
+
+    def has_close(self, center):
+        cx, cy = center[0] // self.cell, center[1] // self.cell
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for center_ in self.cells.get((gx, gy), ()):
+                    dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
+                    if dist <= self.min_dist:
+                        return True
+        return False
+
+
+def dedup_rows(centers, min_dist):
+    """
+    Greedy dedup in document order: a row is kept unless an earlier kept row is within `min_dist`.
+
+    Returns:
+    - (rows, grid): the indices of the kept rows and the SpatialGrid of their centers.
+    """
+    grid = SpatialGrid(min_dist)
+    rows = []
+    for row, center in enumerate(centers.tolist()):
+        if not grid.has_close(center):
+            grid.add(center)
+            rows.append(row)
+    return np.asarray(rows, dtype=np.intp), grid
+
+
+def build_element_store(xml_path, min_dist=None, screen_size=None, filter_invalid=None):
+    """
+    Parses a hierarchy once into an ElementStore of label candidates.
+
+    Rows are the deduplicated clickable elements followed by the deduplicated focusable elements that are
+    not within `min_dist` of any clickable one, exactly as the two traverse_tree passes produced them.
+    With `filter_invalid`, zero-area nodes and nodes entirely outside `screen_size` are dropped first.
+    """
+    if min_dist is None:
+        min_dist = configs["MIN_DIST"]
+    if filter_invalid is None:
+        filter_invalid = configs["FILTER_INVALID_BOUNDS"]
+    uids, bboxes, masks = [], [], []
+    path = []
+    for event, elem in iter_xml_events(xml_path):
+        if event == 'end':
+            path.pop()
+            continue
+        # 节点的bounds只解析一次，子节点计算id时复用父节点的结果
+        entry = [elem, None]
+        path.append(entry)
+        mask = 0
+        for attrib, bit in ATTRIB_BITS.items():
+            if elem.attrib.get(attrib) == "true":
+                mask |= bit
+        if not mask:
+            continue
+        entry[1] = bounds = parse_bounds(elem.attrib["bounds"])
+        elem_id = get_id_from_element(elem, bounds)
+        if len(path) > 1:
+            parent, parent_bounds = path[-2]
+            if parent_bounds is None:
+                path[-2][1] = parent_bounds = parse_bounds(parent.attrib["bounds"])
+            elem_id = get_id_from_element(parent, parent_bounds) + "_" + elem_id
+        uids.append(elem_id + f"_{elem.attrib['index']}")
+        bboxes.append(bounds)
+        masks.append(mask)
+
+    nodes = ElementStore(uids, bboxes, masks)
+    valid = np.ones(len(nodes), dtype=bool)
+    if filter_invalid:
+        valid &= nodes.areas > 0
+        if screen_size and all(screen_size):
+            width, height = screen_size
+            b = nodes.bboxes
+            valid &= (b[:, 2] > 0) & (b[:, 3] > 0) & (b[:, 0] < width) & (b[:, 1] < height)
+
+    kept, grids = {}, {}
+    for attrib, bit in ATTRIB_BITS.items():
+        rows = np.flatnonzero(valid & ((nodes.attrib_mask & bit) > 0))
+        dedup, grids[attrib] = dedup_rows(nodes.centers[rows], min_dist)
+        kept[attrib] = rows[dedup]
+    clickable, focusable = kept["clickable"], kept["focusable"]
+    # 与可点击元素距离过近的可聚焦元素同样通过网格查找
+    focusable = focusable[np.fromiter((not grids["clickable"].has_close(center)
+                                       for center in nodes.centers[focusable].tolist()),
+                                      dtype=bool, count=len(focusable))]
+    rows = np.concatenate([clickable, focusable])
+    store = nodes.take(rows)
+    store.attrib_mask[:] = np.repeat([ATTRIB_BITS["clickable"], ATTRIB_BITS["focusable"]],
+                                     [len(clickable), len(focusable)])
+    return store
+
+
+def select_elements(store, useless_list=()):
+    """Returns AndroidElement views over the rows of `store` whose uid is not in `useless_list`."""
+    return store.elements(row for row, uid in enumerate(store.uids) if uid not in useless_list)
+
+
+def extract_elements(xml_path, useless_list=(), min_dist=None, screen_size=None, filter_invalid=None):
+    """
+    Extracts the labeled elements of a hierarchy: the candidates of build_element_store, minus the uids in
+    `useless_list`, as AndroidElement views.
+    """
+    return select_elements(build_element_store(xml_path, min_dist, screen_size, filter_invalid), useless_list)
+
+
+class SettleTracker:
+    """
+    Decides when the screen has settled from a sequence of screen signatures (see AndroidController.screen_signature).
+
+    The screen counts as settled once `stable_samples` consecutive signatures equal the previous one.
+    """
+
+    def __init__(self, stable_samples=1):
+        self.stable_samples = stable_samples
+        self._last = None
+        self._stable = 0
+
+    def update(self, signature):
+        if signature == "ERROR":
+            self._last, self._stable = None, 0
+            return False
+        if signature == self._last:
+            self._stable += 1
+        else:
+            self._stable = 0
+        self._last = signature
+        return self._stable >= self.stable_samples
+
+
 class AndroidController:
-    def __init__(self, device):
+    def __init__(self, device, transport=None):
         self.device = device
+        self.transport = transport or create_transport(device)
         self.screenshot_dir = configs["ANDROID_SCREENSHOT_DIR"]
         self.xml_dir = configs["ANDROID_XML_DIR"]
         self.width, self.height = self.get_device_size()
         self.backslash = "\\"
+        self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="capture")
+        self._raw_layout = None
 
     def android_mkdir(self, path):
-        check_exist_command = f"adb -s {self.device} shell ls {path}"
-        if execute_adb(check_exist_command) == "ERROR":
-            mkdir_command = f"adb -s {self.device} shell mkdir {path}"
-            result = execute_adb(mkdir_command)
+        check_exist_command = f"ls {path}"
+        if self.transport.shell(check_exist_command) == "ERROR":
+            mkdir_command = f"mkdir {path}"
+            result = self.transport.shell(mkdir_command)
 
     def get_device_size(self):
-        adb_command = f"adb -s {self.device} shell wm size"
-        result = execute_adb(adb_command)
+        adb_command = "wm size"
+        result = self.transport.shell(adb_command)
         if result != "ERROR":
             return map(int, result.split(": ")[1].split("x"))
         return 0, 0
 
-    def get_screenshot(self, prefix, save_dir):
-        cap_command = f"adb -s {self.device} shell screencap -p " \
-                      f"{os.path.join(self.screenshot_dir, prefix + '.png').replace(self.backslash, '/')}"
-        pull_command = f"adb -s {self.device} pull " \
-                       f"{os.path.join(self.screenshot_dir, prefix + '.png').replace(self.backslash, '/')} " \
-                       f"{os.path.join(save_dir, prefix + '.png')}"
-        result = execute_adb(cap_command)
+    def capture_frame(self, raw=False):
+        """
+        Streams a screenshot straight into memory; returns a Frame, or "ERROR".
+
+        With `raw`, the uncompressed framebuffer is read instead, skipping PNG encoding on the device.
+        """
+        data = self.transport.exec_out("screencap" if raw else "screencap -p")
+        if data == "ERROR":
+            return data
+        if raw:
+            try:
+                return Frame.from_raw(data)
+            except ValueError as e:
+                print_with_color(f"ERROR: {e}", "red")
+                return "ERROR"
+        if not data.startswith(b"\x89PNG"):
+            print_with_color("ERROR: screencap did not return a PNG image", "red")
+            return "ERROR"
+        return Frame(data=data)
+
+    def get_screenshot(self, prefix, save_dir, capture=None):
+        capture = capture or configs["SCREENSHOT_CAPTURE"]
+        if capture in ("exec_out", "raw"):
+            frame = self.capture_frame(raw=capture == "raw")
+            if frame == "ERROR":
+                return frame
+            # 截图只保存在内存中，按路径索引；落盘为可选的异步操作
+            path = os.path.join(save_dir, prefix + ".png")
+            frame_store.put(path, frame)
+            if configs["SAVE_SCREENSHOTS"]:
+                save_frame_async(path, frame)
+            return path
+        remote_path = os.path.join(self.screenshot_dir, prefix + '.png').replace(self.backslash, '/')
+        cap_command = f"screencap -p {remote_path}"
+        result = self.transport.shell(cap_command)
         if result != "ERROR":
-            result = execute_adb(pull_command)
+            result = self.transport.pull(remote_path, os.path.join(save_dir, prefix + '.png'))
             if result != "ERROR":
                 return os.path.join(save_dir, prefix + ".png")
             return result
         return result
 
+    def dump_hierarchy(self):
+        """Streams `uiautomator dump` from stdout into an incremental parser; returns a HierarchyDump, or "ERROR"."""
+        buffer = bytearray()
+        root = None
+        chunks = self.transport.exec_out_stream("uiautomator dump /dev/tty")
+        try:
+            for event, elem in iter_streamed_xml(chunks, buffer):
+                if root is None:
+                    root = elem
+        except (ConnectionError, ValueError, ET.ParseError) as e:
+            print_with_color(f"ERROR: failed to dump the UI hierarchy: {e}", "red")
+            return "ERROR"
+        finally:
+            chunks.close()
+        return HierarchyDump(bytes(buffer), root)
+
     def get_xml(self, prefix, save_dir):
-        dump_command = f"adb -s {self.device} shell uiautomator dump " \
-                       f"{os.path.join(self.xml_dir, prefix + '.xml').replace(self.backslash, '/')}"
-        pull_command = f"adb -s {self.device} pull " \
-                       f"{os.path.join(self.xml_dir, prefix + '.xml').replace(self.backslash, '/')} " \
-                       f"{os.path.join(save_dir, prefix + '.xml')}"
-        result = execute_adb(dump_command)
+        if configs["XML_CAPTURE"] == "stream":
+            dump = self.dump_hierarchy()
+            if dump == "ERROR":
+                return dump
+            path = os.path.join(save_dir, prefix + ".xml")
+            hierarchy_store.put(path, dump)
+            if configs["SAVE_XML"]:
+                save_frame_async(path, dump)
+            return path
+        remote_path = os.path.join(self.xml_dir, prefix + '.xml').replace(self.backslash, '/')
+        dump_command = f"uiautomator dump {remote_path}"
+        result = self.transport.shell(dump_command)
         if result != "ERROR":
-            result = execute_adb(pull_command)
+            result = self.transport.pull(remote_path, os.path.join(save_dir, prefix + '.xml'))
             if result != "ERROR":
                 return os.path.join(save_dir, prefix + ".xml")
             return result
         return result
 
+    def raw_layout(self):
+        """
+        The (header_size, width, height, bytes_per_pixel) of raw screencap output, read from one raw capture
+        the first time and reused. The header is 12 bytes before Android 9 and 16 bytes after. Returns None
+        when the capture failed.
+        """
+        if self._raw_layout is None:
+            data = self.transport.exec_out("screencap")
+            if data == "ERROR":
+                return None
+            try:
+                pixels, _ = parse_raw_screencap(data)
+            except ValueError as e:
+                print_with_color(f"ERROR: {e}", "red")
+                return None
+            height, width, bpp = pixels.shape
+            self._raw_layout = (len(data) - pixels.nbytes, width, height, bpp)
+        return self._raw_layout
+
+    def screen_signature(self, ignore_top=0.05):
+        """
+        A hash of the raw framebuffer computed on the device, so a sample moves a few bytes instead of the
+        whole frame. The top `ignore_top` of the screen (the status bar with the clock and notification icons)
+        is left out. Returns "ERROR" when the command failed.
+        """
+        layout = self.raw_layout()
+        if layout is None:
+            return "ERROR"
+        # 跳过原始截图的头部和状态栏所在的行
+        header_size, width, height, bpp = layout
+        skip = header_size + int(height * ignore_top) * width * bpp
+        ret = self.transport.shell(f"screencap | tail -c +{skip + 1} | md5sum")
+        return ret.split()[0] if ret != "ERROR" and ret.strip() else "ERROR"
+
+    def wait_for_settle(self, timeout=3.0, interval=0.1, stable_samples=1, ignore_top=0.05):
+        """
+        Polls the screen signature until it stops changing.
+
+        Returns:
+        - (settled, elapsed): whether the screen settled before `timeout`, and the seconds spent waiting.
+        """
+        start_time = time.perf_counter()
+        tracker = SettleTracker(stable_samples)
+        while True:
+            with perf_stats.timer("settle.sample"):
+                signature = self.screen_signature(ignore_top)
+            if tracker.update(signature):
+                return True, time.perf_counter() - start_time
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= timeout:
+                return False, elapsed
+            time.sleep(min(interval, timeout - elapsed))
+
+    def capture_screen_and_xml(self, screenshot_prefix, xml_prefix, save_dir, max_retries=1, ignore_top=0.05):
+        """
+        Takes the screenshot and the UI hierarchy dump concurrently.
+
+        The screen signature is sampled alongside the two and again once both are done; if it changed, the
+        screenshot and the hierarchy may describe different frames and the capture is repeated, up to
+        `max_retries` times. A failed sample leaves the capture unchecked.
+
+        Returns:
+        - (screenshot_path, xml_path): either may be "ERROR".
+        """
+        for attempt in range(max_retries + 1):
+            with perf_stats.timer("capture.screen_and_xml"):
+                signature = self._executor.submit(self.screen_signature, ignore_top)
+                screenshot = self._executor.submit(self.get_screenshot, screenshot_prefix, save_dir)
+                xml = self._executor.submit(self.get_xml, xml_prefix, save_dir)
+                screenshot_path, xml_path = screenshot.result(), xml.result()
+                before = signature.result()
+                if before == "ERROR" or self.screen_signature(ignore_top) in (before, "ERROR"):
+                    break
+            if attempt < max_retries:
+                perf_stats.incr("capture.retries")
+                print_with_color("INFO: the screen changed while capturing, capturing again.", "yellow")
+        return screenshot_path, xml_path
+
+    def list_packages(self):
+        adb_command = "pm list packages"
+        ret = self.transport.shell(adb_command)
+        return ret
+
     def launch_app(self, app_activity):
-        adb_command = f"adb -s {self.device} shell monkey -p {app_activity} -c android.intent.category.LAUNCHER 1"
-        ret = execute_adb(adb_command)
+        adb_command = f"monkey -p {app_activity} -c android.intent.category.LAUNCHER 1"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def back(self):
-        adb_command = f"adb -s {self.device} shell input keyevent KEYCODE_BACK"
-        ret = execute_adb(adb_command)
+        adb_command = f"input keyevent KEYCODE_BACK"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def home(self):
-        adb_command = f"adb -s {self.device} shell input keyevent KEYCODE_HOME"
-        ret = execute_adb(adb_command)
+        adb_command = f"input keyevent KEYCODE_HOME"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def tap(self, x, y):
-        adb_command = f"adb -s {self.device} shell input tap {x} {y}"
-        ret = execute_adb(adb_command)
+        adb_command = f"input tap {x} {y}"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def text(self, input_str):
         input_str = input_str.replace(" ", "%s")
         input_str = input_str.replace("'", "")
-        adb_command = f"adb -s {self.device} shell input text {input_str}"
-        ret = execute_adb(adb_command)
+        adb_command = f"input text {input_str}"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def long_press(self, x, y, duration=1000):
-        adb_command = f"adb -s {self.device} shell input swipe {x} {y} {x} {y} {duration}"
-        ret = execute_adb(adb_command)
+        adb_command = f"input swipe {x} {y} {x} {y} {duration}"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def swipe(self, x, y, direction, dist="medium", quick=False):
@@ -184,13 +617,90 @@ class AndroidController:
         else:
             return "ERROR"
         duration = 100 if quick else 400
-        adb_command = f"adb -s {self.device} shell input swipe {x} {y} {x+offset[0]} {y+offset[1]} {duration}"
-        ret = execute_adb(adb_command)
+        adb_command = f"input swipe {x} {y} {x+offset[0]} {y+offset[1]} {duration}"
+        ret = self.transport.shell(adb_command)
         return ret
 
     def swipe_precise(self, start, end, duration=400):
         start_x, start_y = start
         end_x, end_y = end
-        adb_command = f"adb -s {self.device} shell input swipe {start_x} {start_x} {end_x} {end_y} {duration}"
-        ret = execute_adb(adb_command)
+        adb_command = f"input swipe {start_x} {start_x} {end_x} {end_y} {duration}"
+        ret = self.transport.shell(adb_command)
         return ret
+
+
+class AsyncAndroidController:
+    """
+    An asyncio facade over AndroidController.
+
+    The adb transports are blocking, so each device call runs on a small executor owned by the controller
+    (sized like the session pool) instead of one thread per call; waiting between calls, e.g. while the
+    screen settles, is done with asyncio.sleep on the event loop.
+    """
+
+    def __init__(self, controller, max_workers=None):
+        self.controller = controller
+        self.width, self.height = controller.width, controller.height
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or configs["ADB_SESSION_POOL_SIZE"] + 1,
+                                            thread_name_prefix="adb-async")
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def get_screenshot(self, prefix, save_dir, capture=None):
+        return await self._run(self.controller.get_screenshot, prefix, save_dir, capture)
+
+    async def get_xml(self, prefix, save_dir):
+        return await self._run(self.controller.get_xml, prefix, save_dir)
+
+    async def capture_frame(self, raw=False):
+        return await self._run(self.controller.capture_frame, raw)
+
+    async def capture_screen_and_xml(self, screenshot_prefix, xml_prefix, save_dir, max_retries=1, ignore_top=0.05):
+        return await self._run(self.controller.capture_screen_and_xml, screenshot_prefix, xml_prefix, save_dir,
+                               max_retries, ignore_top)
+
+    async def screen_signature(self, ignore_top=0.05):
+        return await self._run(self.controller.screen_signature, ignore_top)
+
+    async def wait_for_settle(self, timeout=3.0, interval=0.1, stable_samples=1, ignore_top=0.05):
+        """The asyncio counterpart of AndroidController.wait_for_settle."""
+        start_time = time.perf_counter()
+        tracker = SettleTracker(stable_samples)
+        while True:
+            with perf_stats.timer("settle.sample"):
+                signature = await self.screen_signature(ignore_top)
+            if tracker.update(signature):
+                return True, time.perf_counter() - start_time
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= timeout:
+                return False, elapsed
+            await asyncio.sleep(min(interval, timeout - elapsed))
+
+    async def list_packages(self):
+        return await self._run(self.controller.list_packages)
+
+    async def launch_app(self, app_activity):
+        return await self._run(self.controller.launch_app, app_activity)
+
+    async def back(self):
+        return await self._run(self.controller.back)
+
+    async def home(self):
+        return await self._run(self.controller.home)
+
+    async def tap(self, x, y):
+        return await self._run(self.controller.tap, x, y)
+
+    async def text(self, input_str):
+        return await self._run(self.controller.text, input_str)
+
+    async def long_press(self, x, y, duration=1000):
+        return await self._run(self.controller.long_press, x, y, duration)
+
+    async def swipe(self, x, y, direction, dist="medium", quick=False):
+        return await self._run(self.controller.swipe, x, y, direction, dist, quick)
+
+    async def swipe_precise(self, start, end, duration=400):
+        return await self._run(self.controller.swipe_precise, start, end, duration)
@@ -1,18 +1,27 @@
+import asyncio
 import sys
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 import os
 import yaml
 import json
 import time
-import ast
+import atexit
 from langchain_core.tools import tool
 from langchain.schema.messages import HumanMessage, SystemMessage, ToolMessage
 from langchain_openai import AzureChatOpenAI
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import create_react_agent
-from langchain_community.chat_message_histories import ChatMessageHistory
 
-from agents.and_controller import AndroidController, execute_adb, traverse_tree
-from utils import print_with_color, draw_bbox_multi, encode_image
+from agents.and_controller import AndroidController, AsyncAndroidController, execute_adb, traverse_tree, build_element_store, select_elements
+from agents.and_controller import hierarchy_fingerprint
+from agents.perception_cache import PerceptionCache
+from agents.change_detector import detect_no_change
+from agents.ui_diff import UiDiffer, format_diff, changed_region, crop_changed_region
+from agents.history import OperationHistory, estimate_tokens
+from agents.app_resolver import PackageIndex, AppResolver
+from agents.trajectory_cache import TrajectoryCache, step_matches
+from agents.doc_store import DocStore
+from utils import print_with_color, draw_bbox_multi, encode_image, perf_stats
 from agents.state import ControlState
 from utils import parse_explore_rsp, parse_reflect_rsp, AppLaunchOutputParser
 from agents import prompts
@@ -33,11 +42,42 @@ lang_mllm = Lang_Azure(base_url=configs["OPENAI_API_BASE"],
                        api_version=configs["OPENAI_API_VERSION"],
                        model=configs["MODEL"],
                        temperature=0,
-                       max_tokens=configs["MAX_TOKENS"])
-
-operation_history = ChatMessageHistory()
+                       max_tokens=configs["MAX_TOKENS"],
+                       image_budget={"image_format": configs["UPLOAD_IMAGE_FORMAT"],
+                                     "quality": configs["UPLOAD_IMAGE_QUALITY"],
+                                     "max_long_edge": configs["UPLOAD_MAX_LONG_EDGE"],
+                                     "max_pixels": configs["UPLOAD_MAX_PIXELS"],
+                                     "min_scale": configs["UPLOAD_MIN_SCALE"]},
+                       encode_cache_bytes=configs["UPLOAD_CACHE_MAX_BYTES"],
+                       explore_completion=configs["COMPLETION_MODE"] == "folded")
 
 controller = AndroidController(configs["DEVICE_IP"])
+async_controller = AsyncAndroidController(controller)
+
+ui_differ = UiDiffer()
+
+# deliberate_node中与reflect并行的explore调用；被放弃的请求仍会占用线程直到返回，因此保留多个线程
+explore_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="explore")
+
+# 已安装应用的索引与任务到应用的本地解析，常见任务无需调用大模型即可启动应用
+package_index = PackageIndex(configs["DEVICE_IP"], ttl=configs["APP_INDEX_TTL"])
+app_resolver = AppResolver(configs["APP_ALIAS_FILES"], max_decisions=configs["APP_DECISION_CACHE_SIZE"])
+with open(configs["APP_MAPPING_FILE"], "r", encoding="utf-8") as f:
+    app_mapping = yaml.safe_load(f)
+
+# 成功运行的动作序列，同一任务再次运行时在界面一致的前提下直接重放
+trajectory_cache = TrajectoryCache()
+
+# reflect生成的元素文档，按(应用包名, 元素uid, 动作)索引，explore时注入当前界面上元素的文档
+doc_store = DocStore(batch_size=configs["DOC_STORE_BATCH_SIZE"], max_items=configs["DOC_CACHE_SIZE"])
+# 进程退出前写入尚未落盘的文档
+atexit.register(doc_store.flush)
+
+# 上一次截图的时间，用于统计每一轮(截图到截图)的耗时
+step_clock = {"start": None}
+
+perception_cache = PerceptionCache(max_items=configs["PERCEPTION_CACHE_SIZE"],
+                                   use_phash=configs["PERCEPTION_CACHE_USE_PHASH"])
 
 def init_node(state: ControlState):
     """
@@ -66,10 +106,22 @@ def init_node(state: ControlState):
     # 新建工作文件夹
     controller.android_mkdir(configs["ANDROID_SCREENSHOT_DIR"])
     controller.android_mkdir(configs["ANDROID_XML_DIR"])
+    if configs["PERCEPTION_CACHE_DISK"]:
+        perception_cache.set_disk_dir(os.path.join(state["work_dir"], "perception_cache"))
+    if configs["APP_INDEX_DISK"]:
+        package_index.set_disk_dir(os.path.join(state["work_dir"], "app_index"))
+        app_resolver.set_disk_dir(os.path.join(state["work_dir"], "app_index"))
+    if configs["TRAJECTORY_CACHE"]:
+        trajectory_cache.set_disk_dir(os.path.join(state["work_dir"], "trajectories"))
+        state["replay_steps"] = trajectory_cache.get(state["task_desc"])
+    doc_store.set_path(os.path.join(state["docs_dir"], "docs.db"))
 
-
-    # 将用户的操作需求添加进历史记录
-    operation_history.add_user_message(state["task_desc"])
+    # 将用户的操作需求添加进历史记录，每次运行使用独立的操作历史
+    state["operation_history"] = OperationHistory(window=configs["HISTORY_WINDOW"],
+                                                  max_tokens=configs["HISTORY_MAX_TOKENS"],
+                                                  summary_tokens=configs["HISTORY_SUMMARY_TOKENS"])
+    state["operation_history"].add_user_message(state["task_desc"])
+    step_clock["start"] = None
 
     return state
 
@@ -92,44 +144,106 @@ def launch_app_node(state: ControlState):
     print("🚀 Launching application...")
 
     # controller.home() # 回桌面
-    # 获取所有已经安装的应用
-    adb_command = f"adb -s {state['device_ip']} shell pm list packages"
-    ret = execute_adb(adb_command)
-    installed_app = ret.split('\n')
+    # 获取所有已经安装的应用，索引过期时才重新执行pm list packages
+    packages = package_index.cached()
+    fresh = packages is None
+    if fresh:
+        packages = package_index.update(controller.list_packages())
+    app2package = load_app2package(packages)
+
+    # 先在本地根据应用名匹配任务，无法确定时再让大模型选择
+    response = resolve_app_locally(state["task_desc"], packages, app2package)
+    if response is None and not fresh:
+        # 索引可能早于新安装的应用，交给大模型前先刷新一次
+        packages = refresh_package_index(controller.list_packages(), packages)
+        app2package = load_app2package(packages)
+        response = resolve_app_locally(state["task_desc"], packages, app2package)
+    if response is None:
+        # prompt = prompts.launch_app_template
+        # chain = prompt | mllm | AppLaunchOutputParser()
+        # response = chain.invoke({"task_description": state["task_desc"],
+        #                          "app_list": str(app2package.keys())})
+        response = lang_mllm.get_app_launch_rsp(state["task_desc"], app2package.keys())
+
+    activity = record_app_launch(state, response, app2package)
+    if activity:
+        check_app_launch(state, controller.launch_app(activity))
+    return state
+
+async def alaunch_app_node(state: ControlState):
+    """The async variant of launch_app_node."""
+    print("🚀 Launching application...")
+    packages = package_index.cached()
+    fresh = packages is None
+    if fresh:
+        packages = package_index.update(await async_controller.list_packages())
+    app2package = load_app2package(packages)
+    response = resolve_app_locally(state["task_desc"], packages, app2package)
+    if response is None and not fresh:
+        packages = refresh_package_index(await async_controller.list_packages(), packages)
+        app2package = load_app2package(packages)
+        response = resolve_app_locally(state["task_desc"], packages, app2package)
+    if response is None:
+        response = await lang_mllm.aget_app_launch_rsp(state["task_desc"], app2package.keys())
+    activity = record_app_launch(state, response, app2package)
+    if activity:
+        check_app_launch(state, await async_controller.launch_app(activity))
+    return state
+
+def refresh_package_index(output, packages):
+    """
+    Rebuilds the cached package index from fresh `pm list packages` output, so apps installed since it was
+    built can be chosen. Keeps the cached `packages` when the call failed.
+    """
+    if output == "ERROR":
+        return packages
+    perf_stats.incr("app_index.refresh")
+    return package_index.update(output)
+
+def load_app2package(packages):
+    """Maps app names to the package to launch, from the installed packages and APP_MAPPING_FILE."""
     # 应用名与启动包对应的列表
-    app2package = {p.split(":")[-1].replace("com.", ""): p.split(":")[-1] for p in installed_app}
-    # 读取映射表
-    with open(configs["APP_MAPPING_FILE"], "r", encoding="utf-8") as f:
-        app_mapping = yaml.safe_load(f)
+    app2package = {p.replace("com.", ""): p for p in packages}
     # 删掉当前没有安装的app
+    installed = set(packages)
     for app, activity in app_mapping.items():
-        if activity in app2package.values():
+        if activity in installed:
             app2package[app] = activity
+    return app2package
 
-    # prompt = prompts.launch_app_template
-    # chain = prompt | mllm | AppLaunchOutputParser()
-    # response = chain.invoke({"task_description": state["task_desc"],
-    #                          "app_list": str(app2package.keys())})
-    response = lang_mllm.get_app_launch_rsp(state["task_desc"], app2package.keys())
+def resolve_app_locally(task_desc, packages, app2package):
+    """The launch decision made by app_resolver, or None when the model has to choose."""
+    if not configs["APP_RESOLVER"]:
+        return None
+    package = app_resolver.resolve(task_desc, packages)
+    if package is None:
+        return None
+    # 映射表中的名称排在后面，覆盖由包名生成的名称
+    app_name = {activity: app for app, activity in app2package.items()}[package]
+    print_with_color(f"Resolved the app {app_name} locally.", "yellow")
+    return AppLaunch_rsp(app_name=app_name, action=f"Open the {app_name} app to complete the task.")
 
+def check_app_launch(state: ControlState, ret):
+    """A failed launch means the package index is out of date: drop it and the cached decision."""
+    if ret == "ERROR" or "monkey aborted" in str(ret):
+        print_with_color("ERROR: Failed to launch the app, refreshing the package index next time.", "red")
+        package_index.invalidate()
+        app_resolver.forget(state["task_desc"])
+        state["app_launched"] = False
+
+def record_app_launch(state: ControlState, response: AppLaunch_rsp, app2package):
+    """Records the launch decision in the state and history; returns the package to launch, or None."""
+    state["operation_history"].add_ai_message(response.action)
+    state["last_act"] = response.action
     if response.app_name in app2package:
         print_with_color(f"Launching {response.app_name}...", "yellow")
-        controller.launch_app(app2package[response.app_name])
-        operation_history.add_ai_message(response.action)
         state["app_launched"] = True
-        state["last_act"] = response.action
-    elif "No application opened" in response.app_name:
-        print_with_color(f"ERROR: {response.app_name} is not installed!", "red")
-        operation_history.add_ai_message(response.action)
-        state["app_launched"] = False
-        state["last_act"] = response.action
-    else:
-        print_with_color(f"ERROR: {response.app_name} is not installed!", "red")
-        operation_history.add_ai_message(response.action)
-        state["app_launched"] = False
-        state["last_act"] = response.action
-
-    return state
+        state["app_package"] = app2package[response.app_name]
+        app_resolver.remember(state["task_desc"], app2package[response.app_name])
+        return app2package[response.app_name]
+    print_with_color(f"ERROR: {response.app_name} is not installed!", "red")
+    state["app_launched"] = False
+    return None
 
 def capture_screen_node(state: ControlState):
     """
@@ -138,19 +252,55 @@ def capture_screen_node(state: ControlState):
     This function performs the following tasks:
     1. Saves the previous screenshot (if any) as the last page screenshot.
     2. Captures a new screenshot of the current page.
+    3. With CONCURRENT_CAPTURE, dumps the UI hierarchy at the same time, so element_extract_node can skip it.
     
     Parameters:
     - state (ControlState): The current state of the control, including device IP and task description.
     
     Returns:
-    - output_state (dict): A dictionary containing the last and current page screenshots.
+    - output_state (dict): A dictionary containing the last and current page screenshots (and the xml path).
     """
+    record_step()
     output_state = dict()
     if state["current_page_screenshot"]:
         output_state["last_page_screenshot"] = state["current_page_screenshot"]
+    output_state["last_xml_path"] = state["xml_path"]
+    # 完成判断只对本轮的explore结果有效
+    output_state["completion_hint"] = {}
+    if configs["CONCURRENT_CAPTURE"]:
+        output_state["current_page_screenshot"], output_state["xml_path"] = controller.capture_screen_and_xml(
+            f"{state['round_count']}_before", f"{state['round_count']}", state["task_dir"],
+            max_retries=configs["CAPTURE_MAX_RETRIES"], ignore_top=configs["SETTLE_IGNORE_TOP"])
+        return output_state
     output_state["current_page_screenshot"] = controller.get_screenshot(f"{state['round_count']}_before", state["task_dir"])
     return output_state
 
+async def acapture_screen_node(state: ControlState):
+    """The async variant of capture_screen_node."""
+    record_step()
+    output_state = dict()
+    if state["current_page_screenshot"]:
+        output_state["last_page_screenshot"] = state["current_page_screenshot"]
+    output_state["last_xml_path"] = state["xml_path"]
+    # 完成判断只对本轮的explore结果有效
+    output_state["completion_hint"] = {}
+    if configs["CONCURRENT_CAPTURE"]:
+        output_state["current_page_screenshot"], output_state["xml_path"] = \
+            await async_controller.capture_screen_and_xml(f"{state['round_count']}_before", f"{state['round_count']}",
+                                                          state["task_dir"], max_retries=configs["CAPTURE_MAX_RETRIES"],
+                                                          ignore_top=configs["SETTLE_IGNORE_TOP"])
+        return output_state
+    output_state["current_page_screenshot"] = await async_controller.get_screenshot(f"{state['round_count']}_before",
+                                                                                    state["task_dir"])
+    return output_state
+
+def record_step():
+    """Records the time of a full round, from one screen capture to the next, as "step"."""
+    now = time.time()
+    if step_clock["start"] is not None:
+        perf_stats.record("step", now - step_clock["start"])
+    step_clock["start"] = now
+
 def element_extract_node(state: ControlState):
     """
     Extracts UI elements from the current page's XML and manages element labeling for interaction.
@@ -169,33 +319,25 @@ def element_extract_node(state: ControlState):
     Returns:
     - state (ControlState): Updated state with extracted UI elements and labeled screenshot paths.
     """
-    state["xml_path"] = controller.get_xml(f"{state['round_count']}", state["task_dir"])
+    if not configs["CONCURRENT_CAPTURE"]:
+        state["xml_path"] = controller.get_xml(f"{state['round_count']}", state["task_dir"])
+    return extract_and_label(state)
+
+def extract_and_label(state: ControlState):
+    """Extracts the elements of the captured screen and draws the labeled screenshots (no device I/O)."""
     if state["current_page_screenshot"] == "ERROR" or state["xml_path"] == "ERROR":
         raise Exception("截图或XML获取失败")
-    clickable_list = []
-    focusable_list = []
-    traverse_tree(state["xml_path"], clickable_list, "clickable", True)
-    traverse_tree(state["xml_path"], focusable_list, "focusable", True)
-    elem_list = []
-    for elem in clickable_list:
-        if elem.uid in state["useless_list"]:
-            continue
-        elem_list.append(elem)
-    for elem in focusable_list:
-        if elem.uid in state["useless_list"]:
-            continue
-        bbox = elem.bbox
-        center = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-        close = False
-        for e in clickable_list:
-            bbox = e.bbox
-            center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
-            dist = (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5
-            if dist <= configs["MIN_DIST"]:
-                close = True
-                break
-        if not close:
-            elem_list.append(elem)
+    # 相同的界面直接复用缓存的元素提取结果，未命中时单次解析同时提取clickable和focusable元素
+    with perf_stats.timer("extract.elements"):
+        screen_size = (state["screen_width"], state["screen_height"])
+        cache_key = perception_cache.key(state["xml_path"], state["current_page_screenshot"],
+                                         min_dist=configs["MIN_DIST"], screen_size=screen_size,
+                                         filter_invalid=configs["FILTER_INVALID_BOUNDS"])
+        store = perception_cache.get(cache_key)
+        if store is None:
+            store = build_element_store(state["xml_path"], configs["MIN_DIST"], screen_size)
+            perception_cache.put(cache_key, store)
+        elem_list = select_elements(store, state["useless_list"])
 
     # 历史处理
     # 上一次的元素图放到
@@ -207,44 +349,74 @@ def element_extract_node(state: ControlState):
                                                          f"{state['round_count']}_before_labeled.png")
     # 在当前截图上绘制当前element标注
     draw_bbox_multi(state["current_page_screenshot"], state["current_page_screenshot_draw"], state["current_elem_list"],
-                    dark_mode=configs["DARK_MODE"])
+                    dark_mode=configs["DARK_MODE"], save=configs["SAVE_LABELED_SCREENSHOTS"])
     # 在当前截图上绘制过往element标注
     if state["round_count"] != 1:
         state["last_page_screenshot_after_draw"] = os.path.join(state["task_dir"],
                                                             f"{state['round_count'] - 1}_after_labeled.png")
         draw_bbox_multi(state["current_page_screenshot"], state["last_page_screenshot_after_draw"],
                         state["last_elem_list"],
-                        dark_mode=configs["DARK_MODE"])
+                        dark_mode=configs["DARK_MODE"], save=configs["SAVE_LABELED_SCREENSHOTS"])
 
     return state
 
-def think_next_step_node(state: ControlState):
+async def ainit_node(state: ControlState):
+    """The async variant of init_node."""
+    return await asyncio.to_thread(init_node, state)
 
-    output_state = dict()
-    base64_img_before = state["current_page_screenshot_draw"]
+async def aelement_extract_node(state: ControlState):
+    """The async variant of element_extract_node; extraction and labeling are CPU work and run in a thread."""
+    if not configs["CONCURRENT_CAPTURE"]:
+        state["xml_path"] = await async_controller.get_xml(f"{state['round_count']}", state["task_dir"])
+    return await asyncio.to_thread(extract_and_label, state)
+
+def think_next_step_node(state: ControlState):
     print_with_color("Thinking about what to do in the next step...", "green")
     start_time = time.time()
+    completion = dict()
     try:
         # res的结构为[act_name, *act_params, last_act]
         res = lang_mllm.get_explor_rsp(task_desc=state["task_desc"], last_act=state["last_act"],
-                                        images=[base64_img_before])
+                                        images=[state["current_page_screenshot_draw"]],
+                                        on_completion=completion.update, ui_docs=element_docs(state))
+    except Exception as e:
+        print_with_color(f"大模型调用错误: {e}", "red")
+        return {"next_action": ["ERROR", "", f"ERROR: {e}"]}
+    return record_explore(state, res, start_time, completion)
 
+async def athink_next_step_node(state: ControlState):
+    """The async variant of think_next_step_node."""
+    print_with_color("Thinking about what to do in the next step...", "green")
+    start_time = time.time()
+    completion = dict()
+    try:
+        res = await lang_mllm.aget_explor_rsp(task_desc=state["task_desc"], last_act=state["last_act"],
+                                               images=[state["current_page_screenshot_draw"]],
+                                               on_completion=completion.update, ui_docs=element_docs(state))
     except Exception as e:
         print_with_color(f"大模型调用错误: {e}", "red")
-        output_state["next_action"] = ["ERROR", "", f"ERROR: {e}"]
-        return output_state
+        return {"next_action": ["ERROR", "", f"ERROR: {e}"]}
+    return await asyncio.to_thread(record_explore, state, res, start_time, completion)
 
+def record_explore(state: ControlState, res, start_time, completion=None):
+    """
+    Logs the explore response, adds it to the operation history and validates it against the screen.
+    `completion` is the completion verdict that came with the response, if any.
+    """
+    output_state = dict()
+    output_state["completion_hint"] = completion or {}
     end_time = time.time()
+    perf_stats.record("llm.explore", end_time - start_time)
     print_with_color(f"模型第一次推理耗时: {end_time - start_time:.2f}秒", "yellow")
 
     with open(state["explore_log_path"], "a") as logfile:
         log_item = {"step": state["round_count"], "prompt": "******************",
                     "image": f"{state['round_count']}_before_labeled.png",
-                    "response": str(res)}
+                    "response": str(res), "completion": completion}
         logfile.write(json.dumps(log_item) + "\n")
     # res的结构为[act_name, *act_params, last_act]
     # 加入操作历史中
-    operation_history.add_ai_message(res[-1])
+    state["operation_history"].add_ai_message(res[-1])
     # 如果大模型的输出超出当前屏幕上的UI元素的范围，则返回ERROR
     if res[0] != "text" and res[0] != "FINISH" and res[1] > len(state["current_elem_list"]):
         output_state["next_action"] = ["ERROR", "", f"ERROR: {res[0]} {res[1]} is out of the range of the current UI elements!"]
@@ -255,7 +427,113 @@ def think_next_step_node(state: ControlState):
 
     return output_state
 
+def replay_node(state: ControlState):
+    """
+    Takes the next step from the recorded trajectory of this task instead of asking the model.
+
+    The step is replayed only if the live screen has the recorded hierarchy fingerprint and target element;
+    on the first mismatch the rest of the trajectory is dropped and the run continues on the normal path.
+    """
+    output_state = {"replaying": False}
+    steps = state["replay_steps"]
+    if not steps:
+        return output_state
+    step = steps[0]
+    if not step_matches(step, hierarchy_fingerprint(state["xml_path"]), state["current_elem_list"]):
+        perf_stats.incr("trajectory.mismatch")
+        print_with_color(f"INFO: The screen differs from the recorded trajectory, {len(steps)} steps not replayed.",
+                         "yellow")
+        output_state["replay_steps"] = []
+        return output_state
+    print_with_color(f"Replaying the recorded step: {step['action']}", "green")
+    perf_stats.incr("trajectory.replayed")
+    # 省去了本步的explore，以及对上一步的reflect
+    last_res = state["action_history"][-1] if state["action_history"] else []
+    avoided = 2 if state["step_acted"] and last_res and last_res[0] != "text" else 1
+    perf_stats.incr("trajectory.calls_avoided", avoided)
+    state["operation_history"].add_ai_message(step["summary"])
+    output_state.update({"replaying": True, "replay_steps": steps[1:], "fallback_decision": "PASS",
+                         "next_action": step["action"] + [step["summary"]], "completion_hint": {},
+                         "dispatched_action": []})
+    return output_state
+
+async def areplay_node(state: ControlState):
+    """The async variant of replay_node."""
+    return await asyncio.to_thread(replay_node, state)
+
+def route_replay(state: ControlState):
+    """Goes straight to the action when a recorded step is replayed, otherwise to the explore node(s)."""
+    if state["replaying"]:
+        return ["action"]
+    return ["deliberate"] if configs["DELIBERATE_CANCEL"] else ["think_next_step", "reflect"]
+
+def record_trajectory_step(state: ControlState, plan):
+    """
+    Keeps the trajectory of this run in step with what was done: a step rejected by reflection (BACK or
+    INEFFECTIVE) is removed, and the action about to run is appended.
+    """
+    if not configs["TRAJECTORY_CACHE"]:
+        return
+    if state["fallback_decision"] in ("BACK", "INEFFECTIVE") and state["trajectory"]:
+        state["trajectory"].pop()
+    if plan is None or plan[0] == "back":
+        return
+    action = state["action_history"][-1]
+    uid = state["current_elem_list"][action[1] - 1].uid if action[0] != "text" else None
+    state["trajectory"].append({"fingerprint": hierarchy_fingerprint(state["xml_path"]), "uid": uid,
+                                "action": list(action), "summary": state["last_act"]})
+
+def save_trajectory(state: ControlState):
+    if configs["TRAJECTORY_CACHE"] and state["trajectory"]:
+        trajectory_cache.put(state["task_desc"], state["trajectory"])
+        print_with_color(f"Saved the trajectory of {len(state['trajectory'])} steps for this task.", "yellow")
+
 def reflect_previous_action_node(state: ControlState):
+    output_state, request = prepare_reflect(state)
+    if request is None:
+        return output_state
+
+    print_with_color("Reflecting on my previous action...", "green")
+    start_time = time.time()
+    try:
+        res = lang_mllm.get_reflect_rsp(request["last_res"], state["task_desc"], request["last_res"][-1],
+                                        request["images"], ui_diff=request["ui_diff"],
+                                        crop_region=request["crop_region"])
+        status = True
+    except Exception as e:
+        print_with_color(f"大模型调用错误: {e}", "red")
+        res = ['ERROR', e]
+        status = False
+    # status, rsp = mllm.get_model_response(prompt, [img_before_path, img_after_path])
+    return record_reflect(state, output_state, request, res, status, start_time)
+
+async def areflect_previous_action_node(state: ControlState):
+    """The async variant of reflect_previous_action_node."""
+    output_state, request = await asyncio.to_thread(prepare_reflect, state)
+    if request is None:
+        return output_state
+
+    print_with_color("Reflecting on my previous action...", "green")
+    start_time = time.time()
+    try:
+        res = await lang_mllm.aget_reflect_rsp(request["last_res"], state["task_desc"], request["last_res"][-1],
+                                               request["images"], ui_diff=request["ui_diff"],
+                                               crop_region=request["crop_region"])
+        status = True
+    except Exception as e:
+        print_with_color(f"大模型调用错误: {e}", "red")
+        res = ['ERROR', e]
+        status = False
+    return await asyncio.to_thread(record_reflect, state, output_state, request, res, status, start_time)
+
+def prepare_reflect(state: ControlState):
+    """
+    Runs the local checks before reflection.
+
+    Returns:
+    - (output_state, request): request holds the arguments of the reflection call, or is None when the
+      decision was already made without the model.
+    """
     output_state = dict()
     output_state["fallback_decision"] = state["fallback_decision"]
     output_state["useless_list"] = state["useless_list"]
@@ -264,7 +542,7 @@ def reflect_previous_action_node(state: ControlState):
     # 如果上一次没有操作或者，则跳过
     if state["step_acted"] is False:
         output_state["fallback_decision"] = "PASS"
-        return output_state
+        return output_state, None
 
     # 获取上一次的action
     last_res = state["action_history"][-1]
@@ -274,34 +552,83 @@ def reflect_previous_action_node(state: ControlState):
     # 如果上一次操作为输入文字，则跳过
     if act_name == "text":
         output_state["fallback_decision"] = "PASS"
-        return output_state
+        return output_state, None
 
     # 获取上一次的元素图
     img_before_path = state["last_page_screenshot_before_draw"]
     img_after_path = state["last_page_screenshot_after_draw"]
 
-    print_with_color("Reflecting on my previous action...", "green")
-    # print_with_color("Reflecting on my previous action...", "red")
+    # 本地比对操作前后的截图和UI树，"on"模式下界面无变化时直接判定为INEFFECTIVE，不再调用大模型
+    no_change = None
+    if configs["NO_CHANGE_DETECTOR"] != "off" and state["last_xml_path"] not in ("", "ERROR"):
+        try:
+            with perf_stats.timer("reflect.no_change"):
+                no_change = detect_no_change(state["last_page_screenshot"], state["current_page_screenshot"],
+                                             state["last_xml_path"], state["xml_path"],
+                                             max_hash_distance=configs["NO_CHANGE_MAX_HASH_DISTANCE"],
+                                             max_diff_ratio=configs["NO_CHANGE_MAX_DIFF_RATIO"],
+                                             pixel_delta=configs["NO_CHANGE_PIXEL_DELTA"])
+            print_with_color(f"No-change detector: {no_change}", "yellow")
+        except Exception as e:
+            print_with_color(f"ERROR: no-change detection failed: {e}", "red")
+    if no_change is not None and no_change["unchanged"] and configs["NO_CHANGE_DETECTOR"] == "on":
+        perf_stats.incr("reflect.no_change.skipped")
+        resource_id = state["last_elem_list"][int(area) - 1].uid
+        with open(state["reflect_log_path"], "a") as logfile:
+            log_item = {"step": state["round_count"] - 1, "prompt": "no-change detector",
+                        "image_before": f"{state['round_count'] - 1}_before_labeled.png",
+                        "image_after": f"{state['round_count'] - 1}_after.png",
+                        "response": ["INEFFECTIVE", "The screen did not change after the action."],
+                        "no_change": no_change}
+            logfile.write(json.dumps(log_item) + "\n")
+        output_state["fallback_decision"] = "INEFFECTIVE"
+        output_state["useless_list"].add(resource_id)
+        return output_state, None
 
-    start_time = time.time()
-    try:
-        res = lang_mllm.get_reflect_rsp(last_res, state["task_desc"], last_res[-1], [img_before_path, img_after_path])
-        status = True
-    except Exception as e:
-        print_with_color(f"大模型调用错误: {e}", "red")
-        res = ['ERROR', e]
-        status = False
-    # status, rsp = mllm.get_model_response(prompt, [img_before_path, img_after_path])
+    # 基于UI树的结构化差异，只上传截图中发生变化的区域
+    images = [img_before_path, img_after_path]
+    ui_diff, crop_region = None, None
+    if configs["REFLECT_UI_DIFF"] and state["last_xml_path"] not in ("", "ERROR"):
+        try:
+            with perf_stats.timer("reflect.ui_diff"):
+                diff = ui_differ.diff(state["last_xml_path"], state["xml_path"])
+                ui_diff = format_diff(diff, max_items=configs["REFLECT_UI_DIFF_MAX_ITEMS"])
+                region = changed_region(diff, (state["screen_width"], state["screen_height"]))
+                if region is not None:
+                    x1, y1, x2, y2 = region
+                    area_ratio = (x2 - x1) * (y2 - y1) / (state["screen_width"] * state["screen_height"])
+                    if area_ratio <= configs["REFLECT_CROP_MAX_AREA"]:
+                        crop_region = region
+                        images[1] = crop_changed_region(img_after_path, os.path.join(
+                            state["task_dir"], f"{state['round_count'] - 1}_after_changed.png"), region)
+                        perf_stats.incr("reflect.cropped")
+        except Exception as e:
+            print_with_color(f"ERROR: UI diff failed: {e}", "red")
+            images, ui_diff, crop_region = [img_before_path, img_after_path], None, None
+
+    request = {"last_res": last_res, "images": images, "ui_diff": ui_diff, "crop_region": crop_region,
+               "no_change": no_change}
+    return output_state, request
+
+def record_reflect(state: ControlState, output_state, request, res, status, start_time):
+    """Applies the reflection result: logs it, updates useless_list and writes the element documentation."""
     end_time = time.time()
     print_with_color(f"模型第二次推理耗时: {end_time - start_time:.2f}秒", "yellow")
+    last_res, no_change = request["last_res"], request["no_change"]
+    act_name, area = last_res[0], last_res[1]
     if status:
         resource_id = state["last_elem_list"][int(area) - 1].uid
         with open(state["reflect_log_path"], "a") as logfile:
             log_item = {"step": state["round_count"] - 1, "prompt": "******************",
                         "image_before": f"{state['round_count'] - 1}_before_labeled.png",
-                        "image_after": f"{state['round_count'] - 1}_after.png", "response": res}
+                        "image_after": f"{state['round_count'] - 1}_after.png", "response": res,
+                        "no_change": no_change}
             logfile.write(json.dumps(log_item) + "\n")
         decision = res[0]
+        if no_change is not None:
+            # shadow模式下记录检测结果与大模型判断是否一致，用于评估误判
+            agree = no_change["unchanged"] == (decision == "INEFFECTIVE")
+            perf_stats.incr("reflect.no_change.agree" if agree else "reflect.no_change.disagree")
         output_state["fallback_decision"] = decision
         if decision == "ERROR":
             return output_state
@@ -312,53 +639,316 @@ def reflect_previous_action_node(state: ControlState):
             if decision == "BACK" or decision == "CONTINUE":
                 output_state["useless_list"].add(resource_id)
             doc = res[-1]
-            doc_name = resource_id + ".txt"
-            doc_path = os.path.join(state["docs_dir"], doc_name)
-            if os.path.exists(doc_path):
-                doc_content = ast.literal_eval(open(doc_path).read())
-                if doc_content[act_name]:
-                    print_with_color(f"Documentation for the element {resource_id} already exists.", "yellow")
-            else:
-                doc_content = {
-                    "tap": "",
-                    "text": "",
-                    "v_swipe": "",
-                    "h_swipe": "",
-                    "long_press": ""
-                }
-            doc_content[act_name] = doc
-            with open(doc_path, "w") as outfile:
-                outfile.write(str(doc_content))
+            if doc_store.put(state["app_package"], resource_id, act_name, doc):
+                print_with_color(f"Documentation for the element {resource_id} already exists.", "yellow")
             output_state["doc_count"] += 1
-            print_with_color(f"Documentation generated and saved to {doc_path}", "yellow")
+            print_with_color(f"Documentation generated and saved for {resource_id} ({act_name})", "yellow")
             return output_state
         else:
             print_with_color(f"ERROR: Undefined decision! {decision}", "red")
             return output_state
 
     else:
-        print_with_color(res[-1], "red")
+        print_with_color(str(res[-1]), "red")
         output_state["fallback_decision"] = "ERROR"
         return output_state
 
+def element_docs(state: ControlState):
+    """
+    The documentation of the labeled elements on the screen for the explore prompt, one line per element, or
+    None. Elements are added in label order until EXPLORE_DOCS_MAX_TOKENS is reached.
+    """
+    if not configs["EXPLORE_DOCS"]:
+        return None
+    elem_list = state["current_elem_list"]
+    docs = doc_store.lookup(state["app_package"], [elem.uid for elem in elem_list])
+    lines, tokens = [], 0
+    for i, elem in enumerate(elem_list):
+        if elem.uid not in docs:
+            continue
+        line = f"Element {i + 1}: " + " ".join(f"{act_name}: {doc}" for act_name, doc in docs[elem.uid].items())
+        tokens += estimate_tokens(line)
+        if tokens > configs["EXPLORE_DOCS_MAX_TOKENS"]:
+            perf_stats.incr("docs.truncated")
+            break
+        lines.append(line)
+    if not lines:
+        return None
+    perf_stats.incr("docs.injected")
+    perf_stats.incr("docs.injected_elements", len(lines))
+    return "\n".join(lines)
+
+def explore_unneeded(reflect_output):
+    """Whether the reflection verdict makes the pending explore result useless (BACK discards the next action)."""
+    return reflect_output["fallback_decision"] == "BACK"
+
+def record_cancelled_explore(output_state, start_time, next_action=None):
+    """
+    Replaces the abandoned explore result with `next_action` (by default a CANCELLED placeholder) and counts the
+    time saved against the average explore latency.
+    """
+    timing = perf_stats.timing("llm.explore")
+    if timing is not None:
+        perf_stats.record("deliberate.saved", max(0.0, timing["avg"] - (time.time() - start_time)))
+    perf_stats.incr("deliberate.cancelled")
+    print_with_color("INFO: Cancelled the pending explore request.", "yellow")
+    output_state["next_action"] = next_action or ["CANCELLED", "None"]
+    return output_state
+
+def controller_call(elem_list, action):
+    """Maps a parsed action [act_name, *act_params] to the controller method and its arguments."""
+    act_name = action[0]
+    if act_name == "text":
+        return "text", (action[1],)
+    x, y = elem_list[action[1] - 1].center
+    if act_name == "swipe":
+        return "swipe", (x, y, action[2], action[3])
+    return act_name, (x, y)
+
+def early_action_plan(state: ControlState, reflect_output, action):
+    """
+    The controller call for a streamed action that may run before the explore response is complete, or None.
+
+    Only actions plan_action would execute unchanged qualify: the reflection verdict is known and is not
+    BACK/ERROR, the element exists, and an INEFFECTIVE verdict has not marked it useless.
+    """
+    decision = reflect_output["fallback_decision"]
+    if decision in ("BACK", "ERROR") or action[0] not in ("tap", "text", "long_press", "swipe"):
+        return None
+    if action[0] != "text" and not 0 < action[1] <= len(state["current_elem_list"]):
+        return None
+    if targets_useless(state, reflect_output, action):
+        return None
+    return controller_call(state["current_elem_list"], action)
+
+def targets_useless(state: ControlState, reflect_output, action):
+    """Whether plan_action will skip the streamed action: INEFFECTIVE marked its target element useless."""
+    if reflect_output["fallback_decision"] != "INEFFECTIVE" or action[0] not in ("tap", "long_press", "swipe"):
+        return False
+    if not 0 < action[1] <= len(state["current_elem_list"]):
+        return False
+    return state["current_elem_list"][action[1] - 1].uid in reflect_output["useless_list"]
+
+def skip_useless_action(state: ControlState, output_state, action, start_time):
+    """
+    Stops waiting for the explore response whose streamed action targets an element INEFFECTIVE marked useless;
+    plan_action skips the action and the screen is captured again.
+    """
+    print_with_color("INFO: The next action targets an ineffective element, not waiting for the rest.", "yellow")
+    return record_cancelled_explore(output_state, start_time, list(action) + [state["last_act"]])
+
+def record_dispatch(output_state, plan, ret):
+    """Keeps the early dispatched call in the state so action_next_step_node doesn't run it again."""
+    method, args = plan
+    perf_stats.incr("explore.dispatched")
+    print_with_color(f"INFO: Dispatched {method} before the explore response completed.", "yellow")
+    output_state["dispatched_action"] = [method, list(args), ret]
+
+def record_failed_explore(state: ControlState, output_state, action_ready, error, start_time, completion):
+    """
+    Handles an explore request that raised. An action already dispatched to the device still becomes the
+    next action, with a summary of its own in place of the lost rest of the response, so the history, the
+    trajectory and the next reflection see it; otherwise the next action is ERROR.
+    """
+    print_with_color(f"大模型调用错误: {error}", "red")
+    if not output_state["dispatched_action"]:
+        output_state["next_action"] = ["ERROR", "", f"ERROR: {error}"]
+        return output_state
+    action = list(action_ready.result())
+    print_with_color("INFO: Keeping the dispatched action, the rest of the explore response was lost.", "yellow")
+    if action[0] == "text":
+        summary = f'I typed "{action[1]}".'
+    else:
+        summary = f"I performed {action[0]} on element {action[1]}."
+    output_state.update(record_explore(state, action + [summary], start_time, completion))
+    return output_state
+
+def explore_call(state: ControlState, on_action, completion, use_async=False):
+    """The explore method of deliberate_node and its arguments: streamed with on_action when EXPLORE_STREAM is on."""
+    kwargs = {"task_desc": state["task_desc"], "last_act": state["last_act"],
+              "images": [state["current_page_screenshot_draw"]], "on_completion": completion.update,
+              "ui_docs": element_docs(state)}
+    if configs["EXPLORE_STREAM"]:
+        method = lang_mllm.astream_explor_rsp if use_async else lang_mllm.stream_explor_rsp
+        return method, dict(kwargs, on_action=on_action, action_first=configs["EXPLORE_ACTION_FIRST"])
+    return (lang_mllm.aget_explor_rsp if use_async else lang_mllm.get_explor_rsp), kwargs
+
+def deliberate_node(state: ControlState):
+    """
+    Runs think_next_step and reflect together and joins them.
+
+    The explore request runs on a worker thread while reflection runs here. When the verdict makes the
+    next action useless (BACK), the node returns without waiting for it; the late response is dropped
+    before it is logged or added to the operation history. With EXPLORE_STREAM the action is run on the
+    device as soon as its field has arrived, while the rest of the response is still streaming, and the
+    node stops waiting as well once the streamed action targets an element INEFFECTIVE marked useless.
+    """
+    print_with_color("Thinking about what to do in the next step...", "green")
+    start_time = time.time()
+    action_ready = Future()
+    completion = dict()
+    method, kwargs = explore_call(state, action_ready.set_result, completion)
+    explore_future = explore_executor.submit(method, **kwargs)
+    output_state = reflect_previous_action_node(state)
+    output_state["dispatched_action"] = []
+    if explore_unneeded(output_state):
+        explore_future.cancel()
+        return record_cancelled_explore(output_state, start_time)
+    dispatch_time = None
+    if configs["EXPLORE_STREAM"]:
+        # 等到Action字段完整或整个响应结束
+        wait([action_ready, explore_future], return_when=FIRST_COMPLETED)
+        if action_ready.done() and targets_useless(state, output_state, action_ready.result()):
+            explore_future.cancel()
+            return skip_useless_action(state, output_state, action_ready.result(), start_time)
+        plan = early_action_plan(state, output_state, action_ready.result()) if action_ready.done() else None
+        if plan is not None:
+            dispatch_time = time.time()
+            record_dispatch(output_state, plan, getattr(controller, plan[0])(*plan[1]))
+    try:
+        res = explore_future.result()
+    except Exception as e:
+        return record_failed_explore(state, output_state, action_ready, e, start_time, completion)
+    if dispatch_time is not None:
+        perf_stats.record("explore.dispatch_lead", time.time() - dispatch_time)
+    output_state.update(record_explore(state, res, start_time, completion))
+    return output_state
+
+async def adeliberate_node(state: ControlState):
+    """The async variant of deliberate_node; an unneeded explore request is cancelled in flight."""
+    print_with_color("Thinking about what to do in the next step...", "green")
+    start_time = time.time()
+    action_ready = asyncio.get_running_loop().create_future()
+    completion = dict()
+    method, kwargs = explore_call(state, action_ready.set_result, completion, use_async=True)
+    explore_task = asyncio.create_task(method(**kwargs))
+    try:
+        output_state = await areflect_previous_action_node(state)
+    except BaseException:
+        explore_task.cancel()
+        raise
+    output_state["dispatched_action"] = []
+    if explore_unneeded(output_state):
+        explore_task.cancel()
+        return record_cancelled_explore(output_state, start_time)
+    dispatch_time = None
+    if configs["EXPLORE_STREAM"]:
+        await asyncio.wait({action_ready, explore_task}, return_when=asyncio.FIRST_COMPLETED)
+        if action_ready.done() and targets_useless(state, output_state, action_ready.result()):
+            explore_task.cancel()
+            return skip_useless_action(state, output_state, action_ready.result(), start_time)
+        plan = early_action_plan(state, output_state, action_ready.result()) if action_ready.done() else None
+        if plan is not None:
+            dispatch_time = time.time()
+            record_dispatch(output_state, plan, await getattr(async_controller, plan[0])(*plan[1]))
+    try:
+        res = await explore_task
+    except Exception as e:
+        return await asyncio.to_thread(record_failed_explore, state, output_state, action_ready, e, start_time,
+                                       completion)
+    if dispatch_time is not None:
+        perf_stats.record("explore.dispatch_lead", time.time() - dispatch_time)
+    output_state.update(await asyncio.to_thread(record_explore, state, res, start_time, completion))
+    return output_state
+
+def completion_verdict(state: ControlState):
+    """
+    The FINISHED/CONTINUE verdict of this step without a model call, or None when the separate check has to run.
+
+    With COMPLETION_MODE "folded", a CONTINUE verdict given by explore with at least COMPLETION_MIN_CONFIDENCE is
+    trusted; FINISHED and low-confidence verdicts are confirmed by the check.
+    """
+    hint, state["completion_hint"] = state["completion_hint"], {}
+    # 重放的步骤之后还有记录的步骤时，任务显然还没有完成
+    if state["replaying"] and state["replay_steps"]:
+        perf_stats.incr("trajectory.calls_avoided")
+        return "CONTINUE"
+    if configs["COMPLETION_MODE"] != "folded" or not hint:
+        return None
+    if hint["verdict"] == "CONTINUE" and hint["confidence"] >= configs["COMPLETION_MIN_CONFIDENCE"]:
+        perf_stats.incr("completion.skipped")
+        return "CONTINUE"
+    return None
+
 def check_task_completion_node(state: ControlState):
-    # build message
-    messages = []
-    messages.extend(operation_history.messages)
-    messages.append(SystemMessage(
-            content=prompts.check_task_finished_template_str
-        ),)
-    res = lang_mllm.mllm.invoke(messages).content
+    res = completion_verdict(state)
+    if res is not None:
+        record_completion(state, res)
+        return state
+    perf_stats.incr("completion.prompt_tokens", state["operation_history"].token_count())
+    with perf_stats.timer("llm.completion"):
+        res = lang_mllm.check_task_completion(state["operation_history"])
+    record_completion(state, res)
+    return state
+
+async def acheck_task_completion_node(state: ControlState):
+    """The async variant of check_task_completion_node."""
+    res = completion_verdict(state)
+    if res is not None:
+        record_completion(state, res)
+        return state
+    perf_stats.incr("completion.prompt_tokens", state["operation_history"].token_count())
+    with perf_stats.timer("llm.completion"):
+        res = await lang_mllm.acheck_task_completion(state["operation_history"])
+    record_completion(state, res)
+    return state
+
+def record_completion(state: ControlState, res):
+    """Applies the FINISHED/CONTINUE verdict; returns True when the task continues."""
     if "FINISHED" in res:
         state["completed"] = True
+        record_finished(state)
     elif "CONTINUE" in res:
         state["completed"] = False
-        time.sleep(configs["REQUEST_INTERVAL"])
+        return True
     else:
         print_with_color(f"ERROR: Undefined task completion status! {res}", "red")
-    return state
+    return False
 
-def action_next_step_node(state: ControlState):
+def record_finished(state: ControlState):
+    """Saves what the finished run learned: its trajectory and the pending element docs."""
+    save_trajectory(state)
+    doc_store.flush()
+    # 完成任务所用的轮数，用于比较有无元素文档时的效果
+    perf_stats.incr("task.finished")
+    perf_stats.incr("task.rounds", state["round_count"])
+
+def record_settle(settled, elapsed):
+    perf_stats.record("action.settle", elapsed)
+    if not settled:
+        perf_stats.incr("action.settle.timeout")
+        print_with_color(f"WARNING: the screen did not settle within {elapsed:.2f}s", "yellow")
+
+def wait_for_ui_settle():
+    """
+    Waits until the screen is stable after an action, so the next capture doesn't catch an animation.
+    Without SETTLE_WAIT it sleeps REQUEST_INTERVAL instead.
+    """
+    if not configs["SETTLE_WAIT"]:
+        time.sleep(configs["REQUEST_INTERVAL"])
+        return
+    record_settle(*controller.wait_for_settle(timeout=configs["SETTLE_TIMEOUT"],
+                                              interval=configs["SETTLE_INTERVAL"],
+                                              stable_samples=configs["SETTLE_STABLE_SAMPLES"],
+                                              ignore_top=configs["SETTLE_IGNORE_TOP"]))
+
+async def await_ui_settle():
+    """The async variant of wait_for_ui_settle."""
+    if not configs["SETTLE_WAIT"]:
+        await asyncio.sleep(configs["REQUEST_INTERVAL"])
+        return
+    record_settle(*await async_controller.wait_for_settle(timeout=configs["SETTLE_TIMEOUT"],
+                                                          interval=configs["SETTLE_INTERVAL"],
+                                                          stable_samples=configs["SETTLE_STABLE_SAMPLES"],
+                                                          ignore_top=configs["SETTLE_IGNORE_TOP"]))
+
+def plan_action(state: ControlState):
+    """
+    Applies the bookkeeping of the next step to the state.
+
+    Returns:
+    - (method, args): the controller method to run and its arguments, or None when nothing is executed.
+    """
     state["round_count"] += 1
 
     # 执行下一步操作
@@ -370,11 +960,8 @@ def action_next_step_node(state: ControlState):
 
     if state["fallback_decision"] == "BACK":
         state["step_acted"] = False
-        ret = controller.back()
         state["last_act"] = "None"
-        if ret == "ERROR":
-            print_with_color("ERROR: back execution failed", "red")
-        return state
+        return "back", ()
 
     # TODO: 增加对于INEFFECTIVE状态的处理，比对要按的按钮的id
     if state["fallback_decision"] == "INEFFECTIVE" and act_name != "text":
@@ -384,48 +971,72 @@ def action_next_step_node(state: ControlState):
         if act_uid in state["useless_list"]:
             print_with_color("INFO: Skipping the current element.", "yellow")
             state["step_acted"] = False
-            return state
+            return None
 
     if act_name == "FINISH":
+        if configs["COMPLETION_MODE"] == "folded" and configs["COMPLETION_CONFIRM_FINISH"]:
+            # 交给完成检查确认，确认前不结束任务
+            state["step_acted"] = False
+            state["completion_hint"] = {}
+            return None
         state["completed"] = True
-        return state
+        record_finished(state)
+        return None
     if act_name == "ERROR":
         state["step_acted"] = False
-        return state
+        return None
 
-    if act_name == "tap":
-        _, area = res
-        tl, br = state["current_elem_list"][area - 1].bbox
-        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
-        ret = controller.tap(x, y)
-        state["step_acted"] = True
-        if ret == "ERROR":
-            print_with_color("ERROR: tap execution failed", "red")
-    elif act_name == "text":
-        _, input_str = res
-        ret = controller.text(input_str)
+    if act_name in ("tap", "text", "long_press", "swipe"):
         state["step_acted"] = True
-        if ret == "ERROR":
-            print_with_color("ERROR: text execution failed", "red")
-    elif act_name == "long_press":
-        _, area = res
-        tl, br = state["current_elem_list"][area - 1].bbox
-        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
-        ret = controller.long_press(x, y)
-        state["step_acted"] = True
-        if ret == "ERROR":
-            print_with_color("ERROR: long press execution failed", "red")
-    elif act_name == "swipe":
-        _, area, swipe_dir, dist = res
-        tl, br = state["current_elem_list"][area - 1].bbox
-        x, y = (tl[0] + br[0]) // 2, (tl[1] + br[1]) // 2
-        ret = controller.swipe(x, y, swipe_dir, dist)
-        state["step_acted"] = True
-        if ret == "ERROR":
-            print_with_color("ERROR: swipe execution failed", "red")
+        return controller_call(state["current_elem_list"], res)
     else:
         print_with_color("ERROR: Cann't run this action", "read")
+        return None
+
+def take_dispatched(state: ControlState, plan):
+    """
+    Pops the call deliberate_node already ran on the device for this step. Returns it when it matches the
+    plan, otherwise None and the planned action runs as usual.
+    """
+    dispatched, state["dispatched_action"] = state["dispatched_action"], []
+    if not dispatched:
+        return None
+    if plan is not None and [plan[0], list(plan[1])] == dispatched[:2]:
+        return dispatched
+    print_with_color(f"WARNING: The dispatched action {dispatched[:2]} differs from the planned one {plan}", "yellow")
+    return None
+
+def action_next_step_node(state: ControlState):
+    plan = plan_action(state)
+    dispatched = take_dispatched(state, plan)
+    if plan is None:
+        record_trajectory_step(state, plan)
+        return state
+    method, args = plan
+    ret = dispatched[2] if dispatched else getattr(controller, method)(*args)
+    if ret == "ERROR":
+        print_with_color(f"ERROR: {method.replace('_', ' ')} execution failed", "red")
+    else:
+        wait_for_ui_settle()
+    # 执行失败的动作不记入轨迹
+    record_trajectory_step(state, plan if ret != "ERROR" else None)
+    return state
 
+async def aaction_next_step_node(state: ControlState):
+    """The async variant of action_next_step_node."""
+    plan = plan_action(state)
+    dispatched = take_dispatched(state, plan)
+    if plan is None:
+        record_trajectory_step(state, plan)
+        return state
+    method, args = plan
+    ret = dispatched[2] if dispatched else await getattr(async_controller, method)(*args)
+    if ret == "ERROR":
+        print_with_color(f"ERROR: {method.replace('_', ' ')} execution failed", "red")
+    else:
+        await await_ui_settle()
+    # 执行失败的动作不记入轨迹
+    record_trajectory_step(state, plan if ret != "ERROR" else None)
     return state
 
 def is_task_completed(state: ControlState) -> str:
@@ -447,32 +1058,54 @@ def should_fallback(state: ControlState):
     else:
         return "continue"
 
-def build_workflow() -> StateGraph:
+def build_workflow(use_async=False) -> StateGraph:
     """
     builds the workflow
+    :param use_async: use the async nodes, for running the compiled graph with ainvoke
     :return:
     """
     workflow = StateGraph(ControlState)
 
     # add node
-    workflow.add_node("init", init_node)
-    workflow.add_node("launch_app", launch_app_node)
-    workflow.add_node("capture_screen", capture_screen_node)
-    workflow.add_node("element_extract", element_extract_node)
-    workflow.add_node("think_next_step", think_next_step_node)
-    workflow.add_node("reflect", reflect_previous_action_node)
-    workflow.add_node("action", action_next_step_node)
-    workflow.add_node("complete", check_task_completion_node)
+    if use_async:
+        workflow.add_node("init", ainit_node)
+        workflow.add_node("launch_app", alaunch_app_node)
+        workflow.add_node("capture_screen", acapture_screen_node)
+        workflow.add_node("element_extract", aelement_extract_node)
+        workflow.add_node("action", aaction_next_step_node)
+        workflow.add_node("complete", acheck_task_completion_node)
+    else:
+        workflow.add_node("init", init_node)
+        workflow.add_node("launch_app", launch_app_node)
+        workflow.add_node("capture_screen", capture_screen_node)
+        workflow.add_node("element_extract", element_extract_node)
+        workflow.add_node("action", action_next_step_node)
+        workflow.add_node("complete", check_task_completion_node)
 
     # add edge
     workflow.set_entry_point("init")
     workflow.add_edge("init", "launch_app")
     workflow.add_edge("launch_app", "capture_screen")
     workflow.add_edge("capture_screen", "element_extract")
-    workflow.add_edge("element_extract", "think_next_step")
-    workflow.add_edge("element_extract", "reflect")
-    workflow.add_edge("think_next_step", "action")
-    workflow.add_edge("reflect", "action")
+    if configs["DELIBERATE_CANCEL"]:
+        # think与reflect在同一个节点内并行，reflect判定BACK时不再等待explore
+        workflow.add_node("deliberate", adeliberate_node if use_async else deliberate_node)
+        workflow.add_edge("deliberate", "action")
+        explore_nodes = ["deliberate"]
+    else:
+        workflow.add_node("think_next_step", athink_next_step_node if use_async else think_next_step_node)
+        workflow.add_node("reflect", areflect_previous_action_node if use_async else reflect_previous_action_node)
+        workflow.add_edge("think_next_step", "action")
+        workflow.add_edge("reflect", "action")
+        explore_nodes = ["think_next_step", "reflect"]
+    if configs["TRAJECTORY_CACHE"]:
+        # 能重放记录的步骤时跳过explore和reflect
+        workflow.add_node("replay", areplay_node if use_async else replay_node)
+        workflow.add_edge("element_extract", "replay")
+        workflow.add_conditional_edges("replay", route_replay, ["action"] + explore_nodes)
+    else:
+        for node in explore_nodes:
+            workflow.add_edge("element_extract", node)
 
     # routing
     workflow.add_conditional_edges("action", should_fallback,
@@ -480,4 +1113,4 @@ def build_workflow() -> StateGraph:
     workflow.add_conditional_edges("complete", is_task_completed,
                                    {"continue": "capture_screen", "end": END})
 
-    return workflow
\ No newline at end of file
+    return workflow
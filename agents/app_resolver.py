@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, Counter
+
+import yaml
+
+from utils import print_with_color, perf_stats
+
+
+def normalize_task(text):
+    """Lowercases the text and drops whitespace and punctuation, so equivalent task texts share one key."""
+    return re.sub(r"[\W_]+", "", text.lower())
+
+
+def bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def parse_packages(output):
+    """Package names from `pm list packages` output."""
+    return sorted({line.split(":")[-1].strip() for line in output.split("\n") if line.strip()})
+
+
+def _save_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class PackageIndex:
+    """
+    The installed packages of one device, kept in memory and optionally on disk so runs don't have to call
+    `pm list packages`.
+
+    The index expires after `ttl` seconds. invalidate() drops it when the package manager signals a change,
+    e.g. a launch that finds no such package.
+    """
+
+    def __init__(self, device, ttl=3600, disk_dir=None):
+        self.device = device
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._packages = None
+        self._time = 0.0
+        self._lock = threading.Lock()
+
+    def set_disk_dir(self, disk_dir):
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.disk_dir = disk_dir
+
+    def _path(self):
+        return os.path.join(self.disk_dir, "packages_" + re.sub(r"[^\w.-]", "_", self.device) + ".json")
+
+    def cached(self):
+        """The package list if it is still fresh, otherwise None."""
+        with self._lock:
+            if self._packages is None and self.disk_dir and os.path.exists(self._path()):
+                try:
+                    with open(self._path(), "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    self._packages, self._time = data["packages"], data["time"]
+                except Exception as e:
+                    print_with_color(f"ERROR: failed to load the package index: {e}", "red")
+            if self._packages is not None and time.time() - self._time < self.ttl:
+                perf_stats.incr("app_index.hit")
+                return self._packages
+        perf_stats.incr("app_index.miss")
+        return None
+
+    def update(self, output):
+        """Stores the packages from `pm list packages` output and returns them."""
+        packages = parse_packages(output)
+        with self._lock:
+            self._packages, self._time = packages, time.time()
+            if self.disk_dir:
+                try:
+                    _save_json(self._path(), {"device": self.device, "time": self._time, "packages": packages})
+                except Exception as e:
+                    print_with_color(f"ERROR: failed to save the package index: {e}", "red")
+        return packages
+
+    def invalidate(self):
+        with self._lock:
+            self._packages, self._time = None, 0.0
+            if self.disk_dir and os.path.exists(self._path()):
+                os.remove(self._path())
+
+
+class AppResolver:
+    """
+    Resolves the app a task is about without the model.
+
+    App names from the mapping files (e.g. app2package_CN.yaml and app2package_EN.yaml) are aliases of their
+    package. Each normalized alias is indexed by its character bigrams; a task matches an alias when the
+    alias occurs in the normalized task text. Matches nested in a longer match are ignored, and the task
+    resolves only when exactly one installed package remains. Decisions are cached by normalized task text.
+    """
+
+    def __init__(self, mapping_files, max_decisions=256, disk_dir=None):
+        self.max_decisions = max_decisions
+        self.disk_dir = disk_dir
+        self.aliases = {}
+        for mapping_file in mapping_files:
+            with open(mapping_file, "r", encoding="utf-8") as f:
+                for name, package in (yaml.safe_load(f) or {}).items():
+                    alias = normalize_task(str(name))
+                    # 单字名称太容易误匹配，只交给大模型判断
+                    if len(alias) > 1:
+                        self.aliases.setdefault(alias, package)
+        self.alias_bigrams = {alias: bigrams(alias) for alias in self.aliases}
+        self.index = {}
+        for alias, grams in self.alias_bigrams.items():
+            for gram in grams:
+                self.index.setdefault(gram, set()).add(alias)
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_disk_dir(self, disk_dir):
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.disk_dir = disk_dir
+        if disk_dir and os.path.exists(self._path()):
+            try:
+                with open(self._path(), "r", encoding="utf-8") as f:
+                    decisions = json.load(f)
+                with self._lock:
+                    for task, package in decisions.items():
+                        self._decisions.setdefault(task, package)
+            except Exception as e:
+                print_with_color(f"ERROR: failed to load the app decisions: {e}", "red")
+
+    def _path(self):
+        return os.path.join(self.disk_dir, "app_decisions.json")
+
+    def match(self, task):
+        """The packages whose aliases occur in the task, after dropping matches nested in longer ones."""
+        text = normalize_task(task)
+        hits = Counter(alias for gram in bigrams(text) for alias in self.index.get(gram, ()))
+        spans = []
+        for alias, count in hits.items():
+            if count == len(self.alias_bigrams[alias]):
+                start = text.find(alias)
+                if start >= 0:
+                    spans.append((start, start + len(alias), self.aliases[alias]))
+        return {package for start, end, package in spans
+                if not any(s <= start and end <= e and e - s > end - start for s, e, _ in spans)}
+
+    def resolve(self, task, installed):
+        """
+        The package to launch for the task, or None when the model has to decide (no match, several apps,
+        or the matched app is not installed).
+        """
+        key = normalize_task(task)
+        with self._lock:
+            package = self._decisions.get(key)
+            if package is not None:
+                self._decisions.move_to_end(key)
+        if package is not None and package in installed:
+            perf_stats.incr("app_resolver.cached")
+            return package
+        packages = self.match(task) & set(installed)
+        if len(packages) == 1:
+            perf_stats.incr("app_resolver.local")
+            return packages.pop()
+        perf_stats.incr("app_resolver.ambiguous" if packages else "app_resolver.unmatched")
+        return None
+
+    def remember(self, task, package):
+        key = normalize_task(task)
+        with self._lock:
+            self._decisions[key] = package
+            self._decisions.move_to_end(key)
+            while len(self._decisions) > self.max_decisions:
+                self._decisions.popitem(last=False)
+        self._save()
+
+    def forget(self, task):
+        with self._lock:
+            self._decisions.pop(normalize_task(task), None)
+        self._save()
+
+    def _save(self):
+        if not self.disk_dir:
+            return
+        with self._lock:
+            decisions = dict(self._decisions)
+        try:
+            _save_json(self._path(), decisions)
+        except Exception as e:
+            print_with_color(f"ERROR: failed to save the app decisions: {e}", "red")
@@ -0,0 +1,35 @@
+from agents.and_controller import hierarchy_fingerprint
+from utils import load_image, dhash, small_gray, diff_ratio
+
+
+def compare_frames(before, after, long_edge=160, pixel_delta=16):
+    """
+    Compares two BGR frames on downscaled grayscale copies.
+
+    Returns:
+    - (hash_distance, diff_ratio): the Hamming distance of the dhashes and the fraction of pixels whose
+      intensity moved by more than pixel_delta.
+    """
+    hash_distance = bin(dhash(before) ^ dhash(after)).count("1")
+    return hash_distance, diff_ratio(small_gray(before, long_edge), small_gray(after, long_edge), pixel_delta)
+
+
+def detect_no_change(before_screenshot, after_screenshot, before_xml, after_xml, max_hash_distance=2,
+                     max_diff_ratio=0.002, pixel_delta=16):
+    """
+    Decides locally whether an action had no visible effect.
+
+    The screen counts as unchanged only if the UI hierarchy fingerprints, including text, checked, selected
+    and focused state, are equal and the frames are perceptually the same (dhash distance and pixel-diff
+    ratio within the thresholds).
+
+    Returns:
+    - result (dict): "unchanged" plus the measured signals, so every decision can be logged and audited.
+    """
+    same_hierarchy = hierarchy_fingerprint(before_xml, include_state=True) == \
+        hierarchy_fingerprint(after_xml, include_state=True)
+    hash_distance, ratio = compare_frames(load_image(before_screenshot), load_image(after_screenshot),
+                                          pixel_delta=pixel_delta)
+    unchanged = same_hierarchy and hash_distance <= max_hash_distance and ratio <= max_diff_ratio
+    return {"unchanged": unchanged, "same_hierarchy": same_hierarchy, "hash_distance": hash_distance,
+            "diff_ratio": round(ratio, 5)}
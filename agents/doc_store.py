@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils import print_with_color, perf_stats
+
+# 单条语句中IN的参数个数，低于SQLite的默认上限999
+LOOKUP_CHUNK = 500
+
+
+class DocStore:
+    """
+    The element documentation written by reflection, keyed by (app package, element uid, action).
+
+    Docs live in a SQLite database in WAL mode, so readers don't block the writer. Lookups go through an
+    in-memory LRU cache of (package, uid) -> {action: doc}, including elements without docs, so the labeled
+    elements of a screen cost at most one query. Writes update the cache at once and reach the database in
+    batches of `batch_size`; flush() writes the pending ones. Without a path the store is in memory only.
+    """
+
+    def __init__(self, path=None, batch_size=8, max_items=4096):
+        self.path = None
+        self.batch_size = batch_size
+        self.max_items = max_items
+        self._conn = None
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        if path:
+            self.set_path(path)
+
+    def set_path(self, path):
+        """Opens the database at `path`, writing pending docs of the previous one first."""
+        if path == self.path:
+            return
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._cache.clear()
+            self.path = path
+            if not path:
+                return
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                conn = sqlite3.connect(path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS docs (package TEXT NOT NULL, uid TEXT NOT NULL, "
+                             "action TEXT NOT NULL, doc TEXT NOT NULL, updated REAL NOT NULL, "
+                             "PRIMARY KEY (package, uid, action)) WITHOUT ROWID")
+                conn.commit()
+                self._conn = conn
+            except Exception as e:
+                print_with_color(f"ERROR: failed to open the documentation store {path}: {e}", "red")
+
+    def _remember(self, key, docs):
+        self._cache[key] = docs
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_items:
+            self._cache.popitem(last=False)
+
+    def lookup(self, package, uids):
+        """The docs of the given elements as {uid: {action: doc}}; elements without docs are left out."""
+        found, missing = {}, []
+        with self._lock:
+            for uid in dict.fromkeys(uids):
+                docs = self._cache.get((package, uid))
+                if docs is None:
+                    missing.append(uid)
+                    continue
+                self._cache.move_to_end((package, uid))
+                if docs:
+                    found[uid] = dict(docs)
+            perf_stats.incr("docs.cache_hit", len(uids) - len(missing))
+            if not missing:
+                return found
+            perf_stats.incr("docs.cache_miss", len(missing))
+            loaded = {uid: {} for uid in missing}
+            if self._conn is not None:
+                try:
+                    for i in range(0, len(missing), LOOKUP_CHUNK):
+                        chunk = missing[i:i + LOOKUP_CHUNK]
+                        rows = self._conn.execute(
+                            f"SELECT uid, action, doc FROM docs WHERE package = ? AND uid IN "
+                            f"({', '.join('?' * len(chunk))})", [package] + chunk)
+                        for uid, action, doc in rows:
+                            loaded[uid][action] = doc
+                except Exception as e:
+                    print_with_color(f"ERROR: failed to read the documentation store: {e}", "red")
+                    return found
+            for uid, docs in loaded.items():
+                # 写入尚未落盘的文档优先于数据库中的旧值
+                docs.update({action: doc for (p, u, action), doc in self._pending.items()
+                             if p == package and u == uid})
+                self._remember((package, uid), docs)
+                if docs:
+                    found[uid] = dict(docs)
+        return found
+
+    def get(self, package, uid, action):
+        return self.lookup(package, [uid]).get(uid, {}).get(action)
+
+    def put(self, package, uid, action, doc):
+        """Stores the doc of an action on an element; returns True when it replaced an existing one."""
+        existed = self.get(package, uid, action) is not None
+        with self._lock:
+            docs = self._cache.get((package, uid))
+            if docs is not None:
+                docs[action] = doc
+            self._pending[(package, uid, action)] = doc
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+        return existed
+
+    def flush(self):
+        """Writes the pending docs to the database in one transaction."""
+        with self._lock:
+            if not self._pending or self._conn is None:
+                return
+            rows = [(package, uid, action, doc, time.time())
+                    for (package, uid, action), doc in self._pending.items()]
+            try:
+                with perf_stats.timer("docs.flush"), self._conn:
+                    self._conn.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?, ?)", rows)
+                self._pending.clear()
+            except Exception as e:
+                print_with_color(f"ERROR: failed to write the documentation store: {e}", "red")
+
+    def close(self):
+        self.set_path(None)
@@ -0,0 +1,118 @@
+import threading
+from collections import deque
+
+from langchain.schema.messages import HumanMessage, AIMessage
+
+
+# 每条消息在聊天格式中的固定开销(角色、分隔符)
+MESSAGE_OVERHEAD_TOKENS = 4
+# 摘要超出预算时依次把步骤截短到的token数，最后一级为下限
+CONDENSE_LEVELS = (32, 16)
+
+
+def estimate_tokens(text):
+    """
+    A tokenizer-free estimate of the tokens in `text`: about four ASCII characters per token and one token
+    per other (e.g. CJK) character.
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def clip_tokens(text, limit, count_tokens=estimate_tokens):
+    """The longest prefix of `text`, cut at a word boundary where there is one, within `limit` tokens."""
+    if count_tokens(text) <= limit:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid] + "…") <= limit:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = text[:lo]
+    if " " in prefix.strip() and not text[lo:lo + 1].isspace():
+        prefix = prefix[:prefix.rstrip().rfind(" ")]
+    return prefix.rstrip() + "…"
+
+
+class OperationHistory:
+    """
+    The operation history of one run, as sent to the completion check.
+
+    It keeps the task, a rolling summary of evicted steps and a sliding window of the latest steps. A step
+    leaves the window when the window is full or the history is over max_tokens. The summary keeps every
+    step: beyond summary_tokens its oldest steps are shortened in turn to each of CONDENSE_LEVELS tokens,
+    so it only grows past the budget once all of them are at the last level. Exposes the
+    ChatMessageHistory interface the nodes use (add_user_message / add_ai_message / messages).
+    """
+
+    def __init__(self, window=8, max_tokens=1500, summary_tokens=400, count_tokens=estimate_tokens):
+        self.window_size = window
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.count_tokens = count_tokens
+        self._task = None
+        self._window = deque()
+        # [原文, 当前文本, 截短级别]，级别-1为原文
+        self._summary = []
+        self._lock = threading.Lock()
+
+    def add_user_message(self, message):
+        with self._lock:
+            self._task = message
+
+    def add_ai_message(self, message):
+        with self._lock:
+            self._window.append(message)
+            while len(self._window) > self.window_size or \
+                    (len(self._window) > 1 and self._token_count() > self.max_tokens):
+                self._summarize(self._window.popleft())
+
+    def _summarize(self, step):
+        self._summary.append([step, step, -1])
+        # 摘要超出预算时先截短级别最低的步骤中最早的一个，不丢弃任何步骤
+        while self._summary_tokens() > self.summary_tokens:
+            level = min(entry[2] for entry in self._summary)
+            if level == len(CONDENSE_LEVELS) - 1:
+                break
+            entry = next(entry for entry in self._summary if entry[2] == level)
+            entry[2] += 1
+            entry[1] = clip_tokens(entry[0], CONDENSE_LEVELS[entry[2]], self.count_tokens)
+
+    def _summary_text(self):
+        if not self._summary:
+            return None
+        return "Summary of earlier steps: " + " ".join(entry[1] for entry in self._summary)
+
+    def _summary_tokens(self):
+        return self.count_tokens(self._summary_text() or "")
+
+    def _messages(self):
+        messages = []
+        if self._task is not None:
+            messages.append(HumanMessage(content=self._task))
+        summary = self._summary_text()
+        if summary is not None:
+            messages.append(AIMessage(content=summary))
+        messages.extend(AIMessage(content=step) for step in self._window)
+        return messages
+
+    def _token_count(self):
+        return sum(self.count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS for message in self._messages())
+
+    @property
+    def messages(self):
+        with self._lock:
+            return self._messages()
+
+    def token_count(self):
+        """The estimated prompt tokens of `messages`."""
+        with self._lock:
+            return self._token_count()
+
+    def clear(self):
+        with self._lock:
+            self._task = None
+            self._window.clear()
+            self._summary.clear()
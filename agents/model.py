@@ -1,3 +1,4 @@
+import asyncio
 import re
 from abc import abstractmethod
 from typing import List
@@ -5,12 +6,13 @@ from http import HTTPStatus
 import requests
 from langchain_openai import AzureChatOpenAI
 from langchain.schema.messages import HumanMessage, SystemMessage
-from langchain_community.chat_message_histories import ChatMessageHistory
 
+from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
 
 from agents import prompts
-from utils import print_with_color, encode_image
+from agents.history import OperationHistory
+from utils import print_with_color, encode_image_url, EncodedImageCache, perf_stats
 
 class LLMBaseModel:
     def __init__(self):
@@ -26,6 +28,20 @@ class Explore_rsp(BaseModel):
     Action: str = Field(..., description="The action to take")
     Summary: str = Field(..., description="The summary of the thought process")
 
+class Explore_action_first_rsp(BaseModel):
+    Action: str = Field(..., description="The action to take")
+    Summary: str = Field(..., description="The summary of the thought process")
+    Observation: str = Field(..., description="The result of the observation")
+    Thought: str = Field(..., description="The thought process that led to the action")
+
+class Explore_completion_rsp(Explore_rsp):
+    Completion: str = Field(..., description="FINISHED or CONTINUE: whether the task is completed once the action is done")
+    Confidence: float = Field(..., description="How sure the model is about Completion, from 0 to 1")
+
+class Explore_action_first_completion_rsp(Explore_action_first_rsp):
+    Completion: str = Field(..., description="FINISHED or CONTINUE: whether the task is completed once the action is done")
+    Confidence: float = Field(..., description="How sure the model is about Completion, from 0 to 1")
+
 class Reflect_rsp(BaseModel):
     Decision: str = Field(..., description="The decision to take")
     Thought: str = Field(..., description="The thought process that led to the decision")
@@ -36,8 +52,15 @@ class AppLaunch_rsp(BaseModel):
     action: str = Field(description="Explanation of the action taken")
 
 
+# reflect提示词中各动作的描述方式，swipe按方向区分
+REFLECT_ACTION_VERBS = {"tap": "tapping", "text": "typing", "long_press": "long pressing"}
+SWIPE_DIRECTION_ACTIONS = {"up": "v_swipe", "down": "v_swipe", "left": "h_swipe", "right": "h_swipe"}
+
+
 class Lang_Azure(LLMBaseModel):
-    def __init__(self, base_url: str, api_key: str, api_version: str, model: str, temperature: float, max_tokens: int):
+    def __init__(self, base_url: str, api_key: str, api_version: str, model: str, temperature: float, max_tokens: int,
+                 image_budget: dict = None, encode_cache_bytes: int = 32 * 1024 * 1024,
+                 explore_completion: bool = False):
         super().__init__()
         self.base_url = base_url
         self.api_key = api_key
@@ -55,18 +78,59 @@ class Lang_Azure(LLMBaseModel):
             max_retries=3,
             max_tokens=self.max_tokens,
         )
+        # 上传前图像的缩放与编码参数，见utils.encode_for_upload
+        self.image_budget = image_budget or {}
+        # 同一帧在explore与下一轮reflect中各上传一次，编码结果只计算一次
+        self.encode_cache = EncodedImageCache(max_bytes=encode_cache_bytes)
+        # explore_completion时explore响应同时给出任务完成判断及其置信度，可省去单独的完成检查
+        self.explore_completion = explore_completion
+        self.explore_schema = Explore_completion_rsp if explore_completion else Explore_rsp
+        action_first_schema = Explore_action_first_completion_rsp if explore_completion else Explore_action_first_rsp
+        completion_format = prompts.self_explore_completion_format_str if explore_completion else ""
+        # 结构化输出的runnable只构建一次，避免每步重新绑定schema和输出解析器
+        self.explore_model = self.mllm.with_structured_output(self.explore_schema)
+        self.reflect_model = self.mllm.with_structured_output(Reflect_rsp)
+        # 流式explore绑定同样的输出schema，但用JsonOutputParser增量解析，未完成的JSON也能得到已收到的字段
+        self.explore_stream_model = self.explore_model.first | JsonOutputParser()
+        self.explore_action_first_model = (self.mllm.with_structured_output(action_first_schema).first |
+                                           JsonOutputParser())
+        self.app_launch_chain = prompts.launch_app_template | self.mllm.with_structured_output(AppLaunch_rsp)
+        # 提示词的静态部分作为逐字不变的首条消息，服务端的前缀缓存才能命中
+        self.explore_prefix = SystemMessage(content=prompts.self_explore_prefix_str + completion_format)
+        self.reflect_prefix = SystemMessage(content=prompts.self_explore_reflect_prefix_str)
+        self.explore_action_first_prefix = SystemMessage(content=prompts.self_explore_action_first_prefix_str +
+                                                         completion_format)
+
+    def build_content(self, prompt: str, images: List[str]) -> list:
+        content = [{"type": "text", "text": prompt}]
+        for img in images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": self.encode_cache.get_or_encode(img, encode_image_url, **self.image_budget)
+                }
+            })
+        return content
+
+    async def abuild_content(self, prompt: str, images: List[str]) -> list:
+        # 图像缩放和编码是CPU操作，放到线程中执行，不阻塞事件循环
+        return await asyncio.to_thread(self.build_content, prompt, images)
+
+    def build_messages(self, name: str, prefix: SystemMessage, prompt: str, images: List[str]) -> list:
+        """
+        Lays out a request as [static prefix, dynamic prompt + images].
+
+        The time spent here (mostly image encoding) is recorded as llm.<name>.setup.
+        """
+        with perf_stats.timer(f"llm.{name}.setup"):
+            return [prefix, HumanMessage(content=self.build_content(prompt, images))]
+
+    async def abuild_messages(self, name: str, prefix: SystemMessage, prompt: str, images: List[str]) -> list:
+        return await asyncio.to_thread(self.build_messages, name, prefix, prompt, images)
 
     def get_model_response(self, prompt: str, images: List[str]) -> (bool, str):
         try:
-            content = [{"type": "text", "text": prompt}]
-            for img in images:
-                base64_img = encode_image(img)
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_img}"
-                    }
-                })
+            content = self.build_content(prompt, images)
             message = HumanMessage(
                 content=content
             )
@@ -75,136 +139,215 @@ class Lang_Azure(LLMBaseModel):
         except Exception as e:
             return False, str(e)
 
+    async def aget_model_response(self, prompt: str, images: List[str]) -> (bool, str):
+        try:
+            message = HumanMessage(content=await self.abuild_content(prompt, images))
+            res = await self.mllm.ainvoke([message])
+            return True, res.content
+        except Exception as e:
+            return False, str(e)
+
     def get_app_launch_rsp(self, task_desc, app_list) -> AppLaunch_rsp:
         try:
-            prompt_temp = prompts.launch_app_template
-            app_launch_model = self.mllm.with_structured_output(AppLaunch_rsp)
-            chain = prompt_temp | app_launch_model
-            res: AppLaunch_rsp = chain.invoke({"task_description": task_desc,
-                                               "app_list": app_list})
+            res: AppLaunch_rsp = self.app_launch_chain.invoke({"task_description": task_desc,
+                                                               "app_list": app_list})
             return res
         except Exception as e:
             print_with_color(f"ERROR: {e}", "red")
             return AppLaunch_rsp(app_name="No application opened", action="ERROR")
 
-    def get_explor_rsp(self, task_desc, last_act, images: List[str]) -> (list):
+    async def aget_app_launch_rsp(self, task_desc, app_list) -> AppLaunch_rsp:
         try:
-            prompt = prompts.self_explore_task_template_str.format(task_description=task_desc,
-                                                                   last_act=last_act)
-            content = [{"type": "text", "text": prompt}]
-            for img in images:
-                base64_img = encode_image(img)
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_img}"
-                    }
-                })
-            message = HumanMessage(
-                content=content
-            )
-            # 基于langchain的结构化输出
-            exp_model = self.mllm.with_structured_output(Explore_rsp)
-            # parser = JsonOutputParser(pydantic_object=Explore_rsp)
-            res: Explore_rsp = exp_model.invoke([message])
-            # res_dict = parser.parse_result(res)
-
-            observation = res.Observation
-            think = res.Thought
-            act = res.Action
-            last_act = res.Summary
-
-            print_with_color("Action:", "yellow")
-            print_with_color(act, "magenta")
-
-            # 准备该函数的输出
-            if "FINISH" in act:
-                return ["FINISH"]
-            act_name = act.split("(")[0]
-            if act_name == "tap":
-                area = int(re.findall(r"tap\((.*?)\)", act)[0])
-                return [act_name, area, last_act]
-            elif act_name == "text":
-                input_str = re.findall(r"text\((.*?)\)", act)[0][1:-1]
-                return [act_name, input_str, last_act]
-            elif act_name == "long_press":
-                area = int(re.findall(r"long_press\((.*?)\)", act)[0])
-                return [act_name, area, last_act]
-            elif act_name == "swipe":
-                params = re.findall(r"swipe\((.*?)\)", act)[0]
-                area, swipe_dir, dist = params.split(",")
-                area = int(area)
-                swipe_dir = swipe_dir.strip()[1:-1]
-                dist = dist.strip()[1:-1]
-                return [act_name, area, swipe_dir, dist, last_act]
-            elif act_name == "grid":
-                return [act_name]
-            else:
-                print_with_color(f"ERROR: Undefined act {act_name}!", "red")
-                return ["ERROR"]
-        except  Exception as e:
-
-            return ["ERROR"]
+            return await self.app_launch_chain.ainvoke({"task_description": task_desc, "app_list": app_list})
+        except Exception as e:
+            print_with_color(f"ERROR: {e}", "red")
+            return AppLaunch_rsp(app_name="No application opened", action="ERROR")
 
-    def get_reflect_rsp(self, last_res, task_desc, last_act, images: List[str]):
-        act_name = last_res[0]
-        area = last_res[1]
+    @staticmethod
+    def explore_prompt(task_desc, last_act, ui_docs: str = None) -> str:
+        # 只包含每步变化的部分，可用函数与输出格式在explore_prefix中
+        prompt = prompts.self_explore_request_str.format(task_description=task_desc, last_act=last_act)
+        if ui_docs:
+            prompt += prompts.self_explore_docs_template_str.format(ui_docs=ui_docs)
+        return prompt
 
+    @staticmethod
+    def parse_action(act: str) -> list:
+        """Turns an Action field such as 'tap(3)' into [act_name, *act_params] (or ["FINISH"] / ["ERROR"])."""
+        if "FINISH" in act:
+            return ["FINISH"]
+        act_name = act.split("(")[0]
         if act_name == "tap":
-            # prompt = re.sub(r"<action>", "tapping", prompts.self_explore_reflect_template)
-            prompt = prompts.self_explore_reflect_template_str.format(action="tapping",
-                                                                      task_desc=task_desc,
-                                                                      last_act=last_act,
-                                                                      ui_element=str(area))
+            area = int(re.findall(r"tap\((.*?)\)", act)[0])
+            return [act_name, area]
         elif act_name == "text":
-            prompt = prompts.self_explore_reflect_template_str.format(action="typing",
-                                                                      task_desc=task_desc,
-                                                                      last_act=last_act,
-                                                                      ui_element=str(area))
+            input_str = re.findall(r"text\((.*?)\)", act)[0][1:-1]
+            return [act_name, input_str]
         elif act_name == "long_press":
-            # prompt = re.sub(r"<action>", "long pressing", prompts.self_explore_reflect_template)
-            prompt = prompts.self_explore_reflect_template_str.format(action="long pressing",
-                                                                      task_desc=task_desc,
-                                                                      last_act=last_act,
-                                                                      ui_element=str(area))
+            area = int(re.findall(r"long_press\((.*?)\)", act)[0])
+            return [act_name, area]
         elif act_name == "swipe":
-            swipe_dir = last_res[2]
-            if swipe_dir == "up" or swipe_dir == "down":
-                act_name = "v_swipe"
-            elif swipe_dir == "left" or swipe_dir == "right":
-                act_name = "h_swipe"
-            # prompt = re.sub(r"<action>", "swiping", prompts.self_explore_reflect_template)
-            prompt = prompts.self_explore_reflect_template_str.format(action=act_name,
-                                                                      task_desc=task_desc,
-                                                                      last_act=last_act,
-                                                                      ui_element=str(area))
+            params = re.findall(r"swipe\((.*?)\)", act)[0]
+            area, swipe_dir, dist = params.split(",")
+            area = int(area)
+            swipe_dir = swipe_dir.strip()[1:-1]
+            dist = dist.strip()[1:-1]
+            return [act_name, area, swipe_dir, dist]
+        elif act_name == "grid":
+            return [act_name]
         else:
-            print_with_color("ERROR: Undefined act!", "red")
-            raise ValueError("Undefined action encountered during fallback processing.")
+            print_with_color(f"ERROR: Undefined act {act_name}!", "red")
+            return ["ERROR"]
+
+    @staticmethod
+    def parse_explore_rsp(res: Explore_rsp) -> list:
+        """Turns an Explore_rsp into [act_name, *act_params, last_act] (or ["FINISH"] / ["ERROR"])."""
+        observation = res.Observation
+        think = res.Thought
+        act = res.Action
+        last_act = res.Summary
+
+        print_with_color("Action:", "yellow")
+        print_with_color(act, "magenta")
+
+        # 准备该函数的输出
+        action = Lang_Azure.parse_action(act)
+        if action[0] in ("FINISH", "grid", "ERROR"):
+            return action
+        return action + [last_act]
 
+    @staticmethod
+    def report_completion(res: Explore_rsp, on_completion) -> None:
+        """Hands {"verdict", "confidence"} to on_completion when the response carries a completion verdict."""
+        if on_completion is not None and hasattr(res, "Completion"):
+            on_completion({"verdict": res.Completion.strip().upper(), "confidence": res.Confidence})
+
+    def get_explor_rsp(self, task_desc, last_act, images: List[str], on_completion=None,
+                        ui_docs: str = None) -> (list):
         try:
-            content = [{"type": "text", "text": prompt}]
-            for img in images:
-                base64_img = encode_image(img)
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_img}"
-                    }
-                })
-            message = HumanMessage(
-                content=content
-            )
+            messages = self.build_messages("explore", self.explore_prefix,
+                                           self.explore_prompt(task_desc, last_act, ui_docs), images)
+            # 基于langchain的结构化输出
+            res: Explore_rsp = self.explore_model.invoke(messages)
+            self.report_completion(res, on_completion)
+            return self.parse_explore_rsp(res)
+        except  Exception as e:
+
+            return ["ERROR"]
+
+    async def aget_explor_rsp(self, task_desc, last_act, images: List[str], on_completion=None,
+                             ui_docs: str = None) -> (list):
+        try:
+            messages = await self.abuild_messages("explore", self.explore_prefix,
+                                                  self.explore_prompt(task_desc, last_act, ui_docs), images)
+            res: Explore_rsp = await self.explore_model.ainvoke(messages)
+            self.report_completion(res, on_completion)
+            return self.parse_explore_rsp(res)
+        except Exception as e:
+            return ["ERROR"]
+
+    @staticmethod
+    def completed_action(partial: dict, action, on_action) -> list:
+        """
+        Parses the Action field once a later field has started arriving, i.e. once it is complete, and hands it
+        to on_action. Returns the parsed action, or None while the field is still incomplete.
+        """
+        if action is not None or "Action" not in partial:
+            return action
+        keys = list(partial)
+        if keys.index("Action") == len(keys) - 1:
+            return None
+        action = Lang_Azure.parse_action(partial["Action"])
+        if on_action is not None:
+            on_action(action)
+        return action
+
+    def finish_explore_stream(self, partial: dict, action, error, on_completion=None) -> list:
+        """The explore result of a finished stream; when the stream broke after the action was handed out, the
+        action is kept because it may already have run on the device."""
+        if error is None:
+            res = self.explore_schema(**partial)
+            self.report_completion(res, on_completion)
+            return self.parse_explore_rsp(res)
+        print_with_color(f"ERROR: {error}", "red")
+        if action is None or action[0] in ("FINISH", "grid", "ERROR"):
+            return action or ["ERROR"]
+        return action + [partial.get("Summary") or partial["Action"]]
+
+    def stream_explor_rsp(self, task_desc, last_act, images: List[str], on_action=None,
+                          action_first=False, on_completion=None, ui_docs: str = None) -> list:
+        """
+        Streams the explore response and calls on_action([act_name, *act_params]) as soon as the Action field
+        is complete, while the remaining fields are still being generated. With action_first the model is asked
+        for Action and Summary before Observation and Thought.
 
-            ref_model = self.mllm.with_structured_output(Reflect_rsp)
-            res: Reflect_rsp = ref_model.invoke([message])
+        Returns:
+        - the same list as get_explor_rsp, once the whole response has arrived.
+        """
+        model, prefix = ((self.explore_action_first_model, self.explore_action_first_prefix) if action_first
+                         else (self.explore_stream_model, self.explore_prefix))
+        partial, action, error = {}, None, None
+        try:
+            messages = self.build_messages("explore", prefix, self.explore_prompt(task_desc, last_act, ui_docs),
+                                           images)
+            for partial in model.stream(messages):
+                action = self.completed_action(partial, action, on_action)
+        except Exception as e:
+            error = e
+        try:
+            return self.finish_explore_stream(partial, action, error, on_completion)
+        except Exception as e:
+            print_with_color(f"ERROR: {e}", "red")
+            return ["ERROR"]
 
-            decision = res.Decision
-            think = res.Thought
-            doc = res.Documentation
+    async def astream_explor_rsp(self, task_desc, last_act, images: List[str], on_action=None,
+                                 action_first=False, on_completion=None, ui_docs: str = None) -> list:
+        """The async variant of stream_explor_rsp; on_action is called on the event loop."""
+        model, prefix = ((self.explore_action_first_model, self.explore_action_first_prefix) if action_first
+                         else (self.explore_stream_model, self.explore_prefix))
+        partial, action, error = {}, None, None
+        try:
+            messages = await self.abuild_messages("explore", prefix,
+                                                  self.explore_prompt(task_desc, last_act, ui_docs), images)
+            async for partial in model.astream(messages):
+                action = self.completed_action(partial, action, on_action)
+        except Exception as e:
+            error = e
+        try:
+            return self.finish_explore_stream(partial, action, error, on_completion)
         except Exception as e:
             print_with_color(f"ERROR: {e}", "red")
-            raise e
+            return ["ERROR"]
+
+    @staticmethod
+    def reflect_prompt(last_res, task_desc, last_act, ui_diff: str = None, crop_region=None) -> str:
+        act_name = last_res[0]
+        area = last_res[1]
+
+        if act_name == "swipe":
+            action = SWIPE_DIRECTION_ACTIONS.get(last_res[2], act_name)
+        elif act_name in REFLECT_ACTION_VERBS:
+            action = REFLECT_ACTION_VERBS[act_name]
+        else:
+            print_with_color("ERROR: Undefined act!", "red")
+            raise ValueError("Undefined action encountered during fallback processing.")
+        # 只包含本次动作相关的部分，判定规则在reflect_prefix中
+        prompt = prompts.self_explore_reflect_request_str.format(action=action, task_desc=task_desc,
+                                                                 last_act=last_act, ui_element=str(area))
+        if ui_diff:
+            # 附加UI树的结构化差异，第二张截图可能只包含发生变化的区域
+            crop_note = ""
+            if crop_region is not None:
+                x1, y1, x2, y2 = crop_region
+                crop_note = prompts.reflect_crop_note_str.format(x1=x1, y1=y1, x2=x2, y2=y2)
+            prompt += prompts.reflect_ui_diff_template_str.format(ui_diff=ui_diff, crop_note=crop_note)
+        return prompt
+
+    @staticmethod
+    def parse_reflect_rsp(res: Reflect_rsp) -> list:
+        decision = res.Decision
+        think = res.Thought
+        doc = res.Documentation
 
         if decision == "INEFFECTIVE":
             return [decision, think]
@@ -217,13 +360,40 @@ class Lang_Azure(LLMBaseModel):
             print_with_color(f"ERROR: Undefined decision {decision}!", "red")
             return ["ERROR"]
 
-    def check_task_completion(self, operation_history: ChatMessageHistory):
+    def get_reflect_rsp(self, last_res, task_desc, last_act, images: List[str], ui_diff: str = None,
+                        crop_region=None):
+        prompt = self.reflect_prompt(last_res, task_desc, last_act, ui_diff, crop_region)
+        try:
+            messages = self.build_messages("reflect", self.reflect_prefix, prompt, images)
+            res: Reflect_rsp = self.reflect_model.invoke(messages)
+        except Exception as e:
+            print_with_color(f"ERROR: {e}", "red")
+            raise e
+        return self.parse_reflect_rsp(res)
+
+    async def aget_reflect_rsp(self, last_res, task_desc, last_act, images: List[str], ui_diff: str = None,
+                               crop_region=None):
+        prompt = self.reflect_prompt(last_res, task_desc, last_act, ui_diff, crop_region)
+        try:
+            messages = await self.abuild_messages("reflect", self.reflect_prefix, prompt, images)
+            res: Reflect_rsp = await self.reflect_model.ainvoke(messages)
+        except Exception as e:
+            print_with_color(f"ERROR: {e}", "red")
+            raise e
+        return self.parse_reflect_rsp(res)
+
+    @staticmethod
+    def completion_messages(operation_history: OperationHistory) -> list:
         # build message
         messages = []
         messages.extend(operation_history.messages)
         messages.append(SystemMessage(
             content=prompts.check_task_finished_template_str
         ), )
-        res = self.mllm.invoke(messages).content
+        return messages
+
+    def check_task_completion(self, operation_history: OperationHistory):
+        return self.mllm.invoke(self.completion_messages(operation_history)).content
 
-        return res
+    async def acheck_task_completion(self, operation_history: OperationHistory):
+        return (await self.mllm.ainvoke(self.completion_messages(operation_history))).content
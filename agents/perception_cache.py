@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from agents.and_controller import ElementStore, hierarchy_fingerprint
+from utils import print_with_color, perf_stats, load_image, dhash
+
+
+# 缓存格式或元素提取逻辑变化时递增，使旧的磁盘缓存失效
+CACHE_VERSION = 1
+
+
+class PerceptionCache:
+    """
+    Caches the element candidates (ElementStore, including the label layout) extracted from a screen.
+
+    Entries are keyed by the hierarchy fingerprint plus the extraction parameters, and optionally by a
+    perceptual hash of the screenshot. An in-memory LRU sits in front of an optional on-disk tier of .npz
+    files, so screens seen in earlier runs are also hits.
+    """
+
+    def __init__(self, max_items=64, disk_dir=None, use_phash=False):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.use_phash = use_phash
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_disk_dir(self, disk_dir):
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.disk_dir = disk_dir
+
+    def key(self, xml_path, screenshot_path=None, **params):
+        parts = [f"v{CACHE_VERSION}", hierarchy_fingerprint(xml_path)]
+        parts += [f"{name}={params[name]}" for name in sorted(params)]
+        if self.use_phash and screenshot_path:
+            parts.append(f"{dhash(load_image(screenshot_path)):016x}")
+        return hashlib.blake2b("|".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            store = self._items.get(key)
+            if store is not None:
+                self._items.move_to_end(key)
+                perf_stats.incr("perception_cache.hit")
+                return store
+        store = self._load(key)
+        if store is not None:
+            perf_stats.incr("perception_cache.disk_hit")
+            self._remember(key, store)
+            return store
+        perf_stats.incr("perception_cache.miss")
+        return None
+
+    def put(self, key, store):
+        self._remember(key, store)
+        self._save(key, store)
+
+    def _remember(self, key, store):
+        with self._lock:
+            self._items[key] = store
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".npz")
+
+    def _load(self, key):
+        if not self.disk_dir or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with np.load(self._path(key)) as data:
+                return ElementStore(data["uids"].tolist(), data["bboxes"], data["attrib_mask"])
+        except Exception as e:
+            print_with_color(f"ERROR: failed to load the perception cache entry {key}: {e}", "red")
+            return None
+
+    def _save(self, key, store):
+        if not self.disk_dir:
+            return
+        try:
+            tmp_path = self._path(key) + ".tmp.npz"
+            np.savez(tmp_path, uids=np.array(store.uids, dtype=str), bboxes=store.bboxes,
+                     attrib_mask=store.attrib_mask)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            print_with_color(f"ERROR: failed to save the perception cache entry {key}: {e}", "red")
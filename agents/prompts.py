@@ -1,7 +1,8 @@
 from langchain_core.prompts import PromptTemplate
 
 
-self_explore_task_template_str = """You are an agent that is trained to complete certain tasks on a smartphone. You will be 
+# explore提示词按静态部分(可用函数、输出格式)与每步变化的部分(任务、历史动作)拆分，静态部分作为固定前缀发送
+self_explore_functions_str = """You are an agent that is trained to complete certain tasks on a smartphone. You will be 
 given a screenshot of a smartphone app. The interactive UI elements on the screenshot are labeled with numeric tags 
 starting from 1. 
 
@@ -32,10 +33,20 @@ choose the appropriate distance option according to your need.
 A simple use case can be swipe(21, "up", "medium"), which swipes up the UI element labeled with the number 21 for a 
 medium distance.
 
-The task you need to complete is to {task_description}. Your past actions to proceed with this task are summarized as 
+"""
+
+self_explore_request_str = """The task you need to complete is to {task_description}. Your past actions to proceed with this task are summarized as 
 follows: {last_act}
 Now, given the following labeled screenshot, you need to think and call the function needed to proceed with the task. 
-Your output should include three parts in the given format:
+"""
+
+# 当前界面上已有文档的元素，附加在explore的请求之后
+self_explore_docs_template_str = """You also have access to the following documentation of the labeled UI elements on the screen, learned from earlier explorations.
+It describes what happens when you interact with these elements and helps you choose the target of your next action:
+{ui_docs}
+"""
+
+self_explore_output_format_str = """Your output should include three parts in the given format:
 Observation: <Describe what you observe in the image>
 Thought: <To complete the given task, what is the next step I should do>
 Action: <The function call with the correct parameters to proceed with the task. If you believe the task is completed or 
@@ -45,15 +56,41 @@ Summary: <Summarize your past actions along with your latest action in one or tw
 tag in your summary>
 You can only take one action at a time, so please directly call the function."""
 
+# 任务完成判断并入explore时附加在输出格式之后
+self_explore_completion_format_str = """
+In addition, your output should include two more parts:
+Completion: <FINISHED if the task will have been completed once your action is done (or already is and your action is FINISH), otherwise CONTINUE>
+Confidence: <A number between 0 and 1 telling how sure you are about Completion>"""
+
+self_explore_task_template_str = self_explore_functions_str + self_explore_request_str + self_explore_output_format_str
+
+self_explore_prefix_str = self_explore_functions_str + self_explore_output_format_str
+
+# 流式explore可要求先输出Action，使动作在Observation和Thought生成期间即可执行
+self_explore_output_format_action_first_str = """Your output should include four parts in the given format, in this order:
+Action: <The function call with the correct parameters to proceed with the task. If you believe the task is completed or 
+there is nothing to be done, you should output FINISH. You cannot output anything else except a function call or FINISH 
+in this field.>
+Summary: <Summarize your past actions along with your latest action in one or two sentences. Do not include the numeric 
+tag in your summary>
+Observation: <Describe what you observe in the image>
+Thought: <Explain why the action proceeds with the given task>
+You can only take one action at a time, so please directly call the function."""
+
+self_explore_action_first_prefix_str = self_explore_functions_str + self_explore_output_format_action_first_str
+
 self_explore_task_template = PromptTemplate(input_variables=["task_description", "last_act"],
                                             template=self_explore_task_template_str)
 
-self_explore_reflect_template_str = """I will give you screenshots of a mobile app before and after {action} the UI 
-element labeled with the number 'ui_element' on the first screenshot. The numeric tag of each element is located at 
+# reflect提示词同样拆分为固定的判定规则与每次变化的动作描述
+self_explore_reflect_request_str = """I will give you screenshots of a mobile app before and after {action} the UI 
+element labeled with the number {ui_element} on the first screenshot. The numeric tag of each element is located at 
 the center of the element. The action of {action} this UI element was described as follows:
 {last_act}
-The action was also an attempt to proceed with a larger task, which is to {task_desc}. Your job is to carefully analyze 
-the difference between the two screenshots to determine if the action is in accord with the description above and at 
+The action was also an attempt to proceed with a larger task, which is to {task_desc}. """
+
+self_explore_reflect_prefix_str = """Your job is to carefully analyze 
+the difference between the two screenshots to determine if the action is in accord with the action description and at 
 the same time effectively moved the task forward. Your output should be determined based on the following situations:
 1. BACK
 If you think the action navigated you to a page where you cannot proceed with the given task, you should go back to the 
@@ -71,14 +108,14 @@ changed between the two screenshots, then they are not identical. Your output sh
 Decision: INEFFECTIVE
 Thought: <explain why you made this decision>
 3. CONTINUE
-If you find the action changed something on the screen but does not reflect the action description above and did not 
+If you find the action changed something on the screen but does not reflect the action description and did not 
 move the given task forward, you should continue to interact with other elements on the screen. At the same time, 
 describe the functionality of the UI element concisely in one or two sentences by observing the difference between the 
 two screenshots. Notice that your description of the UI element should focus on the general function. Never include the 
 numeric tag of the UI element in your description. You can use pronouns such as "the UI element" to refer to the 
 element. Your output should be in the following format:
 Decision: CONTINUE
-Thought: <explain why you think the action does not reflect the action description above and did not move the given 
+Thought: <explain why you think the action does not reflect the action description and did not move the given 
 task forward>
 Documentation: <describe the function of the UI element>
 4. SUCCESS
@@ -91,9 +128,21 @@ Thought: <explain why you think the action successfully moved the task forward>
 Documentation: <describe the function of the UI element>
 """
 
+self_explore_reflect_template_str = self_explore_reflect_request_str + self_explore_reflect_prefix_str
+
 self_explore_reflect_template = PromptTemplate(input_variables=["action", "task_desc", "last_act", "ui_element"],
                                                template=self_explore_reflect_template_str)
 
+reflect_ui_diff_template_str = """
+To help you compare the screenshots, here are the changes detected in the UI hierarchy after the action.
+Bounds are [left, top, right, bottom] in screen pixels.
+{ui_diff}
+{crop_note}"""
+
+reflect_crop_note_str = """The second screenshot is cropped to the screen region [{x1}, {y1}, {x2}, {y2}], which contains all of these changes.
+There were no UI-tree changes outside this region, but content the UI hierarchy does not describe (such as images, web pages or videos) may still have changed there.
+"""
+
 check_task_finished_template_str = """You are an agent responsible for determining whether a given task on a smartphone has been completed.
 
 Carefully review the operation history and determine whether the task described above has been successfully completed.
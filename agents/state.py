@@ -27,6 +27,7 @@ class ControlState(TypedDict):
 
     # element related
     xml_path: str
+    last_xml_path: str
     current_elem_list: List
     last_elem_list: List
     useless_list: Set
@@ -37,8 +38,16 @@ class ControlState(TypedDict):
     human_in_the_loop_action: bool
     action_history: List[str]
     reflect_history: List[str]
+    operation_history: Any
     last_act: str
     step_acted: bool
+    dispatched_action: List
+    completion_hint: Dict
+
+    # trajectory related
+    trajectory: List[Dict]
+    replay_steps: List[Dict]
+    replaying: bool
 
     # decision_related
     fallback_decision: Literal["ERROR", "INEFFECTIVE", "BACK", "CONTINUE", "SUCCESS", "PASS"]
@@ -55,6 +64,7 @@ class ControlState(TypedDict):
 
     # 状态标志位
     app_launched: bool
+    app_package: str
     completed: bool
     round_count: int
     doc_count: int
@@ -67,13 +77,17 @@ def create_controlstate(device_ip:str, task:str):
                              "device_resolution": "", "screen_width": 0, "screen_height": 0,
                              "current_page_screenshot": "", "last_page_screenshot": "",
                              "current_page_screenshot_draw": "", "last_page_screenshot_before_draw": "",
-                             "last_page_screenshot_after_draw": "", "xml_path": "", "current_elem_list": [],
+                             "last_page_screenshot_after_draw": "", "xml_path": "", "last_xml_path": "",
+                             "current_elem_list": [],
                              "last_elem_list": [], "useless_list": set(),
                              "next_action": [], "reflect_action": "", "human_in_the_loop_action": False,
-                             "action_history": [], "reflect_history": [], "last_act": "",
-                             "step_acted": False, "fallback_decision": "PASS", "work_dir": "", "demo_dir": "",
+                             "action_history": [], "reflect_history": [], "operation_history": None, "last_act": "",
+                             "step_acted": False, "dispatched_action": [], "completion_hint": {},
+                             "trajectory": [], "replay_steps": [], "replaying": False,
+                             "fallback_decision": "PASS", "work_dir": "", "demo_dir": "",
                              "task_dir": "", "docs_dir": "", "explore_log_path": "", "reflect_log_path": "",
-                             "app_launched": False, "completed": False, "round_count": 1, "doc_count": 0}
+                             "app_launched": False, "app_package": "", "completed": False, "round_count": 1,
+                             "doc_count": 0}
 
     # 初始化一些目录
     work_dir = "./apps/robot"
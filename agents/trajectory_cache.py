@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import threading
+
+from agents.app_resolver import normalize_task
+from utils import print_with_color, perf_stats
+
+
+class TrajectoryCache:
+    """
+    Stores the steps of successful runs, keyed by the normalized task text, so a later run of the same task
+    can replay them without the model.
+
+    A step is {"fingerprint", "uid", "action", "summary"}: the hierarchy fingerprint of the screen the action
+    was taken on, the uid of the target element (None for text input), the parsed action
+    [act_name, *act_params] and the explore summary. Trajectories live in memory and, with a disk_dir, as
+    one JSON file per task.
+    """
+
+    def __init__(self, disk_dir=None):
+        self.disk_dir = disk_dir
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def set_disk_dir(self, disk_dir):
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.disk_dir = disk_dir
+
+    @staticmethod
+    def key(task):
+        return hashlib.blake2b(normalize_task(task).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def get(self, task):
+        """The recorded steps of the task (a copy), or an empty list."""
+        key = self.key(task)
+        with self._lock:
+            steps = self._items.get(key)
+        if steps is None and self.disk_dir and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    steps = json.load(f)["steps"]
+                with self._lock:
+                    self._items[key] = steps
+            except Exception as e:
+                print_with_color(f"ERROR: failed to load the trajectory of {task}: {e}", "red")
+        perf_stats.incr("trajectory.hit" if steps else "trajectory.miss")
+        return [dict(step) for step in steps or []]
+
+    def put(self, task, steps):
+        key = self.key(task)
+        with self._lock:
+            self._items[key] = [dict(step) for step in steps]
+        if not self.disk_dir:
+            return
+        try:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"task": task, "steps": steps}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            print_with_color(f"ERROR: failed to save the trajectory of {task}: {e}", "red")
+
+
+def step_matches(step, fingerprint, elem_list):
+    """Whether a recorded step applies to the live screen: same hierarchy fingerprint and target element."""
+    if step["fingerprint"] != fingerprint:
+        return False
+    action = step["action"]
+    if step["uid"] is None:
+        return True
+    area = action[1]
+    return 0 < area <= len(elem_list) and elem_list[area - 1].uid == step["uid"]
@@ -0,0 +1,127 @@
+import os
+import threading
+
+from agents.and_controller import iter_xml_events, parse_bounds, get_id_from_element, load_hierarchy_bytes
+from utils import load_image, Frame, frame_store
+
+
+def snapshot_hierarchy(xml_path):
+    """
+    Flattens a UI hierarchy into {uid: (bounds, text)} for every node with bounds.
+
+    Uids follow build_element_store (parent id + element id + index), so they match the uids of the labeled
+    elements; repeated uids get a "#n" suffix in document order.
+    """
+    nodes = {}
+    path = []
+    for event, elem in iter_xml_events(xml_path):
+        if event == 'end':
+            path.pop()
+            continue
+        bounds = parse_bounds(elem.attrib["bounds"]) if "bounds" in elem.attrib else None
+        path.append((elem, bounds))
+        if bounds is None:
+            continue
+        elem_id = get_id_from_element(elem, bounds)
+        if len(path) > 1 and path[-2][1] is not None:
+            elem_id = get_id_from_element(*path[-2]) + "_" + elem_id
+        uid = elem_id + f"_{elem.attrib.get('index', '')}"
+        if uid in nodes:
+            count = 2
+            while f"{uid}#{count}" in nodes:
+                count += 1
+            uid = f"{uid}#{count}"
+        text = elem.attrib.get("text") or elem.attrib.get("content-desc", "")
+        nodes[uid] = (bounds, text)
+    return nodes
+
+
+def diff_snapshots(before, after):
+    """
+    Returns the structural difference of two snapshots as a dict of lists:
+    added / removed: (uid, bounds, text), moved: (uid, old_bounds, new_bounds), text_changed: (uid, bounds, old, new).
+    """
+    diff = {"added": [], "removed": [], "moved": [], "text_changed": []}
+    for uid, (bounds, text) in after.items():
+        if uid not in before:
+            diff["added"].append((uid, bounds, text))
+            continue
+        old_bounds, old_text = before[uid]
+        if old_bounds != bounds:
+            diff["moved"].append((uid, old_bounds, bounds))
+        if old_text != text:
+            diff["text_changed"].append((uid, bounds, old_text, text))
+    for uid, (bounds, text) in before.items():
+        if uid not in after:
+            diff["removed"].append((uid, bounds, text))
+    return diff
+
+
+def changed_region(diff, screen_size, margin=20):
+    """The bounding box (x1, y1, x2, y2) of everything that changed, clipped to the screen; None if nothing did."""
+    boxes = [item[1] for item in diff["added"] + diff["removed"] + diff["text_changed"]]
+    for _, old_bounds, new_bounds in diff["moved"]:
+        boxes += [old_bounds, new_bounds]
+    if not boxes:
+        return None
+    width, height = screen_size
+    x1 = max(0, min(box[0] for box in boxes) - margin)
+    y1 = max(0, min(box[1] for box in boxes) - margin)
+    x2 = min(width, max(box[2] for box in boxes) + margin)
+    y2 = min(height, max(box[3] for box in boxes) + margin)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return x1, y1, x2, y2
+
+
+def format_diff(diff, max_items=20):
+    """A short textual diff for the reflection prompt, at most max_items lines."""
+    lines = []
+    for uid, bounds, text in diff["added"]:
+        lines.append(f"+ added {uid} at {list(bounds)}" + (f' "{text}"' if text else ""))
+    for uid, bounds, text in diff["removed"]:
+        lines.append(f"- removed {uid} at {list(bounds)}" + (f' "{text}"' if text else ""))
+    for uid, old_bounds, new_bounds in diff["moved"]:
+        lines.append(f"~ moved {uid} from {list(old_bounds)} to {list(new_bounds)}")
+    for uid, _, old_text, new_text in diff["text_changed"]:
+        lines.append(f'~ text of {uid}: "{old_text}" -> "{new_text}"')
+    if len(lines) > max_items:
+        lines = lines[:max_items] + [f"... and {len(lines) - max_items} more changes"]
+    return "\n".join(lines) if lines else "No structural change in the UI hierarchy."
+
+
+class UiDiffer:
+    """
+    Diffs consecutive UI hierarchies, keeping the snapshot of the last tree so each round only parses
+    the new one.
+    """
+
+    def __init__(self):
+        self._last = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, xml_path):
+        data = load_hierarchy_bytes(xml_path)
+        with self._lock:
+            if self._last is not None and self._last[0] == data:
+                return self._last[1]
+        nodes = snapshot_hierarchy(xml_path)
+        with self._lock:
+            self._last = (data, nodes)
+        return nodes
+
+    def diff(self, before_xml, after_xml):
+        with self._lock:
+            last = self._last
+        before = last[1] if last is not None and last[0] == load_hierarchy_bytes(before_xml) else \
+            snapshot_hierarchy(before_xml)
+        return diff_snapshots(before, self.snapshot(after_xml))
+
+
+def crop_changed_region(image_path, output_path, region):
+    """Crops `region` out of the image and keeps it as an in-memory frame under output_path."""
+    x1, y1, x2, y2 = region
+    image = load_image(image_path)
+    crop = image[y1:y2, x1:x2].copy()
+    frame_store.put(output_path, Frame(image=crop, ext=os.path.splitext(output_path)[1] or ".png"))
+    return output_path
@@ -0,0 +1,52 @@
+"""
+Compares the screenshot capture paths of AndroidController on a connected device.
+
+    python -m benchmarks.bench_capture --rounds 10
+
+For each mode ("pull", "exec_out", "raw") it reports the time until a decoded BGR image is available on
+the host, which is what draw_bbox_multi needs.
+"""
+import argparse
+import tempfile
+import time
+
+from agents.and_controller import AndroidController
+from configs import load_config
+from utils import load_image, frame_store
+
+
+def bench_mode(controller, mode, rounds, save_dir):
+    timings = []
+    for i in range(rounds):
+        frame_store.clear()
+        start_time = time.perf_counter()
+        path = controller.get_screenshot(f"bench_{mode}_{i}", save_dir, capture=mode)
+        if path == "ERROR":
+            raise RuntimeError(f"capture failed in mode {mode}")
+        image = load_image(path)
+        timings.append(time.perf_counter() - start_time)
+    timings.sort()
+    return {"median": timings[len(timings) // 2], "min": timings[0], "max": timings[-1],
+            "shape": image.shape}
+
+
+def main():
+    configs = load_config()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default=configs["DEVICE_IP"])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=["pull", "exec_out", "raw"])
+    args = parser.parse_args()
+
+    controller = AndroidController(args.device)
+    controller.android_mkdir(configs["ANDROID_SCREENSHOT_DIR"])
+    save_dir = tempfile.mkdtemp(prefix="bench_capture_")
+    for mode in args.modes:
+        result = bench_mode(controller, mode, args.rounds, save_dir)
+        print(f"{mode:>9}: median={result['median'] * 1000:.1f}ms min={result['min'] * 1000:.1f}ms "
+              f"max={result['max'] * 1000:.1f}ms shape={result['shape']}")
+    controller.transport.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares the rounds needed to complete tasks with and without the element docs in the explore prompt, on a
+connected device with the configured model.
+
+    python -m benchmarks.bench_docs --tasks "打开小红书搜索咖啡" "帮我给john发条手机短信，和他说hello" --repeat 2
+
+Each task runs first with EXPLORE_DOCS off and then on. Reflection writes docs to work_dir/auto_docs/docs.db
+in both modes, so the runs with docs use what the earlier runs learned. TRAJECTORY_CACHE is turned off, so
+no run replays another.
+"""
+import argparse
+import time
+
+from agents import android_agent
+from agents.state import create_controlstate
+from utils import perf_stats
+
+
+def run(task, device):
+    state = create_controlstate(device, task)
+    start_time = time.perf_counter()
+    result = android_agent.build_workflow().compile().invoke(state, {"recursion_limit": 1000})
+    return result["completed"], result["round_count"], time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", nargs="+", required=True)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per task and mode")
+    parser.add_argument("--device", default=android_agent.configs["DEVICE_IP"])
+    args = parser.parse_args()
+
+    configs = android_agent.configs
+    configs["TRAJECTORY_CACHE"] = False
+    results = {False: [], True: []}
+    for task in args.tasks:
+        for use_docs in (False, True):
+            configs["EXPLORE_DOCS"] = use_docs
+            for _ in range(args.repeat):
+                perf_stats.reset()
+                completed, rounds, elapsed = run(task, args.device)
+                results[use_docs].append((completed, rounds))
+                print(f"docs={'on' if use_docs else 'off':<3} completed={completed!s:<5} rounds={rounds:>3} "
+                      f"time={elapsed:.1f}s docs.injected={perf_stats.count('docs.injected')} {task}")
+                # create_controlstate按秒命名任务目录
+                time.sleep(1)
+
+    for use_docs, items in results.items():
+        finished = [rounds for completed, rounds in items if completed]
+        avg = f"{sum(finished) / len(finished):.1f}" if finished else "-"
+        print(f"docs {'on' if use_docs else 'off'}: completed {len(finished)}/{len(items)}, "
+              f"rounds to completion avg={avg}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares the prompt size of the completion check with the old process-wide ChatMessageHistory and with the
+per-run OperationHistory over a scripted run (no device or model needed).
+
+    python -m benchmarks.bench_history --steps 50 --runs 2
+
+Every step adds one explore summary to the history, as record_explore does. Tokens are estimated with
+agents.history.estimate_tokens and include the completion-check instruction.
+"""
+import argparse
+import random
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+
+from agents import prompts
+from agents.history import OperationHistory, estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+from configs import load_config
+
+ACTIONS = ["tapped the search box", "typed the contact name", "swiped up the contact list", "opened the chat",
+           "long pressed the message field", "tapped the send button", "went back to the previous page"]
+
+
+def step_summary(rng, step):
+    # explore的Summary是对过往动作的一两句概括，长度大致不变
+    actions = rng.sample(ACTIONS, 3)
+    return (f"So far I have {actions[0]} and {actions[1]}. In step {step} I {actions[2]} to get closer to sending "
+            f"the message.")
+
+
+def prompt_tokens(messages):
+    check = estimate_tokens(prompts.check_task_finished_template_str) + MESSAGE_OVERHEAD_TOKENS
+    return check + sum(estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def bench(steps, runs, configs, seed=0):
+    rng = random.Random(seed)
+    unbounded = ChatMessageHistory()
+    results = []
+    for run in range(runs):
+        bounded = OperationHistory(window=configs["HISTORY_WINDOW"], max_tokens=configs["HISTORY_MAX_TOKENS"],
+                                   summary_tokens=configs["HISTORY_SUMMARY_TOKENS"])
+        task = "send a message to john saying hello"
+        unbounded.add_user_message(task)
+        bounded.add_user_message(task)
+        for step in range(1, steps + 1):
+            summary = step_summary(rng, step)
+            unbounded.add_ai_message(summary)
+            bounded.add_ai_message(summary)
+            results.append((run + 1, step, prompt_tokens(unbounded.messages), prompt_tokens(bounded.messages)))
+    return results
+
+
+def main():
+    configs = load_config()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=2, help="back-to-back runs in one process")
+    args = parser.parse_args()
+
+    results = bench(args.steps, args.runs, configs)
+    print(f"{'run':>3} {'step':>4} {'unbounded':>9} {'bounded':>7}")
+    for run, step, old, new in results:
+        if step == 1 or step % 10 == 0:
+            print(f"{run:>3} {step:>4} {old:>9} {new:>7}")
+    total_old = sum(item[2] for item in results)
+    total_new = sum(item[3] for item in results)
+    print(f"total prompt tokens: unbounded={total_old} bounded={total_new} "
+          f"({total_new / total_old:.0%}), per step: {total_old / len(results):.0f} -> {total_new / len(results):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures the settle wait on a connected device, to compare with the fixed REQUEST_INTERVAL sleep it replaces
+when SETTLE_WAIT is on. Run it over the same connection the agent uses (e.g. Wi-Fi after `adb connect`).
+
+    python -m benchmarks.bench_settle --rounds 10 --scroll
+
+It reports the latency of one settle sample (the on-device hash), of one full raw screenshot for reference,
+and the time until the screen counts as settled, on the current screen or after scrolling it.
+"""
+import argparse
+import time
+
+from agents.and_controller import AndroidController
+from configs import load_config
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    configs = load_config()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--scroll", action="store_true", help="swipe up before each settle wait")
+    parser.add_argument("--device", default=configs["DEVICE_IP"])
+    args = parser.parse_args()
+
+    controller = AndroidController(args.device)
+    samples, frames, settles, timeouts = [], [], [], 0
+    for _ in range(args.rounds):
+        start_time = time.perf_counter()
+        if controller.screen_signature(configs["SETTLE_IGNORE_TOP"]) == "ERROR":
+            raise RuntimeError("the settle sample failed")
+        samples.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        if controller.capture_frame(raw=True) == "ERROR":
+            raise RuntimeError("the raw capture failed")
+        frames.append(time.perf_counter() - start_time)
+
+        if args.scroll:
+            controller.swipe(controller.width // 2, controller.height // 2, "up")
+        settled, elapsed = controller.wait_for_settle(timeout=configs["SETTLE_TIMEOUT"],
+                                                      interval=configs["SETTLE_INTERVAL"],
+                                                      stable_samples=configs["SETTLE_STABLE_SAMPLES"],
+                                                      ignore_top=configs["SETTLE_IGNORE_TOP"])
+        settles.append(elapsed)
+        timeouts += not settled
+
+    print(f"settle sample: median={median(samples) * 1000:.0f}ms max={max(samples) * 1000:.0f}ms")
+    print(f"raw screenshot: median={median(frames) * 1000:.0f}ms max={max(frames) * 1000:.0f}ms")
+    print(f"settle wait: median={median(settles):.2f}s max={max(settles):.2f}s timeouts={timeouts}/{args.rounds} "
+          f"(REQUEST_INTERVAL={configs['REQUEST_INTERVAL']}s)")
+
+
+if __name__ == "__main__":
+    main()
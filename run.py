@@ -1,7 +1,9 @@
 
+import asyncio
+
 from agents.android_agent import build_workflow
 from configs.config import load_config
-from utils import show_graph
+from utils import show_graph, perf_stats
 configs = load_config()
 
 def run_task(task: str, device: str) -> bool:
@@ -18,6 +20,24 @@ def run_task(task: str, device: str) -> bool:
         # show_graph(app)
 
         result = app.invoke(state, {"recursion_limit": 1000})
+        # 打印各阶段耗时统计
+        perf_stats.report()
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+async def arun_task(task: str, device: str) -> bool:
+    """Runs a task on the async graph; the think and reflect branches await their model calls concurrently."""
+    print(f"🚀 Starting task execution: {task}")
+
+    try:
+        from agents.state import create_controlstate
+
+        state = create_controlstate(device, task)
+        app = build_workflow(use_async=True).compile()
+        result = await app.ainvoke(state, {"recursion_limit": 1000})
+        perf_stats.report()
         return True
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -26,5 +46,8 @@ def run_task(task: str, device: str) -> bool:
 if __name__ == "__main__":
     task = "帮我给john发条手机短信，和他说hello" # 输入任务描述
     # device = "10.39.52.148:5555"
-    result = run_task(task, configs["DEVICE_IP"])
+    if configs["ASYNC_GRAPH"]:
+        result = asyncio.run(arun_task(task, configs["DEVICE_IP"]))
+    else:
+        result = run_task(task, configs["DEVICE_IP"])
     print(f"Task execution result: {result}")
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""UI hierarchy dumps shared by the tests."""
+
+DUMP = ('<?xml version="1.0"?><hierarchy><node index="0" class="android.widget.FrameLayout" resource-id="" '
+        'content-desc="" bounds="[0,0][1080,2400]"><node index="0" text="{text}" class="android.widget.Button" '
+        'resource-id="com.app:id/ok" content-desc="" clickable="true" checkable="true" checked="{checked}" focused="{focused}" '
+        'bounds="[{x},10][{x2},40]" /></node></hierarchy>')
+
+
+def write_dump(path, text="OK", focused="false", x=10, checked="false"):
+    """Writes a one-button screen; only the button's x position changes its structure."""
+    path.write_text(DUMP.format(text=text, focused=focused, x=x, x2=x + 50, checked=checked))
+    return str(path)
@@ -0,0 +1,113 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+from agents.adb_client import AdbClient, AdbError
+
+
+def request(payload):
+    return b"%04x" % len(payload) + payload
+
+
+class StubAdbServer:
+    """Replays recorded adb server frames: one list of (expected request, reply) pairs per connection."""
+
+    def __init__(self, conversations):
+        self.conversations = list(conversations)
+        self.received = []
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        for conversation in self.conversations:
+            conn, _ = self.sock.accept()
+            with conn:
+                for expected, reply in conversation:
+                    data = b""
+                    while len(data) < len(expected):
+                        chunk = conn.recv(len(expected) - len(data))
+                        if not chunk:
+                            break
+                        data += chunk
+                    self.received.append(data)
+                    conn.sendall(reply)
+        self.sock.close()
+
+
+def transport_frames(serial=b"emulator-5554"):
+    return (request(b"host:transport:" + serial), b"OKAY")
+
+
+def test_shell_returns_output_and_exit_code():
+    client = AdbClient("emulator-5554", timeout=5)
+    service = f"shell:{{ wm size\n}} </dev/null 2>&1; echo {client.marker}$?".encode()
+    reply = b"OKAY" + b"Physical size: 1080x2400\n" + client.marker.encode() + b"0\n"
+    server = StubAdbServer([[transport_frames(), (request(service), reply)]])
+    client.port = server.port
+
+    assert client.shell("wm size") == (0, "Physical size: 1080x2400")
+    assert server.received[0] == request(b"host:transport:emulator-5554")
+
+
+def test_exec_out_returns_raw_bytes():
+    png = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+    server = StubAdbServer([[transport_frames(), (request(b"exec:screencap -p"), b"OKAY" + png)]])
+    client = AdbClient("emulator-5554", port=server.port, timeout=5)
+
+    assert client.exec_out("screencap -p") == png
+
+
+def test_unknown_device_raises():
+    message = b"device 'missing' not found"
+    server = StubAdbServer([[(request(b"host:transport:missing"), b"FAIL" + b"%04x" % len(message) + message)]])
+    client = AdbClient("missing", port=server.port, timeout=5)
+
+    with pytest.raises(AdbError, match="not found"):
+        client.exec_out("screencap -p")
+
+
+def recv(path):
+    return b"RECV" + struct.pack("<I", len(path)) + path
+
+
+def data(payload):
+    return b"DATA" + struct.pack("<I", len(payload)) + payload
+
+
+done = b"DONE" + struct.pack("<I", 0)
+
+
+def test_pull_reuses_sync_connection(tmp_path):
+    server = StubAdbServer([[transport_frames(), (request(b"sync:"), b"OKAY"),
+                             (recv(b"/sdcard/1.xml"), data(b"<hierarchy>") + data(b"</hierarchy>") + done),
+                             (recv(b"/sdcard/2.xml"), data(b"<node/>") + done)]])
+    client = AdbClient("emulator-5554", port=server.port, timeout=5)
+
+    first = client.pull("/sdcard/1.xml", str(tmp_path / "1.xml"))
+    second = client.pull("/sdcard/2.xml", str(tmp_path / "2.xml"))
+
+    assert open(first, "rb").read() == b"<hierarchy></hierarchy>"
+    assert open(second, "rb").read() == b"<node/>"
+    client.close()
+
+
+def test_pull_after_fail_opens_new_connection(tmp_path):
+    message = b"remote object '/sdcard/missing.xml' does not exist"
+    server = StubAdbServer([[transport_frames(), (request(b"sync:"), b"OKAY"),
+                             (recv(b"/sdcard/missing.xml"), b"FAIL" + struct.pack("<I", len(message)) + message)],
+                            [transport_frames(), (request(b"sync:"), b"OKAY"),
+                             (recv(b"/sdcard/1.xml"), data(b"<hierarchy/>") + done)]])
+    client = AdbClient("emulator-5554", port=server.port, timeout=5)
+
+    with pytest.raises(AdbError, match="does not exist"):
+        client.pull("/sdcard/missing.xml", str(tmp_path / "missing.xml"))
+    assert not (tmp_path / "missing.xml.part").exists()
+    # 失败后的pull使用新的sync连接，而不是被adbd关闭的旧连接
+    assert open(client.pull("/sdcard/1.xml", str(tmp_path / "1.xml")), "rb").read() == b"<hierarchy/>"
+    client.close()
@@ -0,0 +1,31 @@
+import subprocess
+import threading
+
+from agents.adb_transport import AdbShellSession
+
+
+def local_session():
+    # 用本地sh代替`adb shell`，帧格式与设备上的shell相同
+    session = AdbShellSession("local")
+    session.proc = subprocess.Popen(["sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, bufsize=0, start_new_session=True)
+    return session
+
+
+def run_with_deadline(session, commands, timeout=5):
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(session.run(c) for c in commands), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return None if thread.is_alive() else results
+
+
+def test_piped_command_does_not_read_session_stdin():
+    session = local_session()
+    try:
+        # 管道中的cat若读取会话的stdin，会吞掉后续命令而一直等待
+        results = run_with_deadline(session, ["cat | wc -l", "echo hello | tr a-z A-Z",
+                                              "printf 'a\\nb\\n' | grep -c x"])
+        assert results == [(0, "0"), (0, "HELLO"), (1, "0")]
+    finally:
+        subprocess.run(["pkill", "-KILL", "-s", str(session.proc.pid)])
@@ -1,5 +1,6 @@
 import pytest
 from agents.android_agent import launch_app_node, back_to_human_node
+from agents.history import OperationHistory
 
 @pytest.mark.parametrize("task, expected", [("帮我打开12306买张高铁票", True),
                                             ("打开小红书", True),
@@ -21,6 +22,7 @@ def test_launch_app_node(task, expected):
         "action_history": [],
         "reflect_history": [],
         "reflect_action": "",
+        "operation_history": OperationHistory(),
     }
     result_state = launch_app_node(state)
     assert result_state["app_launched"] == expected
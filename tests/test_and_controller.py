@@ -0,0 +1,208 @@
+import asyncio
+import random
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+from agents.and_controller import AndroidController, AsyncAndroidController, iter_streamed_xml, traverse_tree, extract_elements
+
+DUMP = (b"<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>"
+        b'<hierarchy rotation="0">'
+        b'<node index="0" class="android.widget.FrameLayout" bounds="[0,0][1080,2400]">'
+        b'<node index="0" class="android.widget.Button" clickable="true" bounds="[10,10][60,40]" />'
+        b'</node></hierarchy>')
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_streamed_xml_is_parsed_across_chunks(chunk_size):
+    data = b"WARNING: linker noise\n" + DUMP + b"UI hierchary dumped to: /dev/tty\n"
+    buffer = bytearray()
+
+    events = list(iter_streamed_xml((data[i:i + chunk_size] for i in range(0, len(data), chunk_size)), buffer))
+
+    assert [event for event, _ in events] == ["start", "start", "start", "end", "end", "end"]
+    assert events[2][1].attrib["class"] == "android.widget.Button"
+    assert bytes(buffer) == DUMP
+
+
+def test_truncated_stream_raises():
+    with pytest.raises((ValueError, ET.ParseError)):
+        list(iter_streamed_xml([DUMP[:-20]], bytearray()))
+
+
+def random_hierarchy(path, n_nodes, seed):
+    rng = random.Random(seed)
+    root = ET.Element("hierarchy", rotation="0")
+    parents = [ET.SubElement(root, "node", index="0", **{"class": "android.widget.FrameLayout",
+                                                          "resource-id": "", "content-desc": "",
+                                                          "bounds": "[0,0][1080,2400]"})]
+    for i in range(n_nodes):
+        x1, y1 = rng.randrange(0, 1000, 5), rng.randrange(0, 2300, 5)
+        x2, y2 = x1 + rng.randrange(0, 80), y1 + rng.randrange(0, 100)
+        node = ET.SubElement(rng.choice(parents), "node", index=str(i % 7), **{
+            "class": rng.choice(["android.widget.TextView", "android.widget.Button", "android.view.View"]),
+            "resource-id": rng.choice(["", "com.app:id/item", "com.app:id/title"]),
+            "content-desc": rng.choice(["", "more", "a very long content description"]),
+            "clickable": rng.choice(["true", "false"]),
+            "focusable": rng.choice(["true", "false"]),
+            "bounds": f"[{x1},{y1}][{x2},{y2}]"})
+        if rng.random() < 0.2:
+            parents.append(node)
+    ET.ElementTree(root).write(path)
+
+
+def two_pass_extract(xml_path, useless_list, min_dist):
+    clickable_list = []
+    focusable_list = []
+    traverse_tree(xml_path, clickable_list, "clickable", True)
+    traverse_tree(xml_path, focusable_list, "focusable", True)
+    elem_list = [elem for elem in clickable_list if elem.uid not in useless_list]
+    for elem in focusable_list:
+        if elem.uid in useless_list:
+            continue
+        bbox = elem.bbox
+        center = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
+        close = False
+        for e in clickable_list:
+            bbox = e.bbox
+            center_ = (bbox[0][0] + bbox[1][0]) // 2, (bbox[0][1] + bbox[1][1]) // 2
+            if (abs(center[0] - center_[0]) ** 2 + abs(center[1] - center_[1]) ** 2) ** 0.5 <= min_dist:
+                close = True
+                break
+        if not close:
+            elem_list.append(elem)
+    return elem_list
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_single_pass_extraction_matches_two_pass(tmp_path, seed, monkeypatch):
+    xml_path = str(tmp_path / "dump.xml")
+    random_hierarchy(xml_path, 600, seed)
+    monkeypatch.setitem(traverse_tree.__globals__["configs"], "MIN_DIST", 30)
+    expected = two_pass_extract(xml_path, set(), 30)
+    useless_list = {elem.uid for elem in expected[::4]}
+    expected = two_pass_extract(xml_path, useless_list, 30)
+
+    result = extract_elements(xml_path, useless_list, 30, filter_invalid=False)
+
+    assert [(e.uid, e.bbox, e.attrib) for e in result] == [(e.uid, e.bbox, e.attrib) for e in expected]
+
+
+def test_invalid_bounds_are_filtered_before_dedup(tmp_path):
+    xml_path = str(tmp_path / "dump.xml")
+    root = ET.Element("hierarchy")
+    frame = ET.SubElement(root, "node", index="0", bounds="[0,0][1080,2400]",
+                          **{"class": "android.widget.FrameLayout", "resource-id": ""})
+    for index, bounds in enumerate(["[100,100][100,100]", "[90,90][110,110]", "[1200,100][1300,200]"]):
+        ET.SubElement(frame, "node", index=str(index), clickable="true", bounds=bounds,
+                      **{"class": "android.widget.Button", "resource-id": f"id/b{index}"})
+    ET.ElementTree(root).write(xml_path)
+
+    unfiltered = extract_elements(xml_path, min_dist=30, screen_size=(1080, 2400), filter_invalid=False)
+    filtered = extract_elements(xml_path, min_dist=30, screen_size=(1080, 2400), filter_invalid=True)
+
+    assert [e.bbox for e in unfiltered] == [((100, 100), (100, 100)), ((1200, 100), (1300, 200))]
+    assert [e.bbox for e in filtered] == [((90, 90), (110, 110))]
+    assert filtered[0].center == (100, 100)
+    assert filtered[0].attrib == "clickable"
+
+
+class ScriptedTransport:
+    """
+    Serves screen hashes from a list (repeating the last one). exec_out serves one raw 40x80 RGBA capture
+    with a `header_size` header, for reading the layout; it must not be used again while settling.
+    """
+
+    def __init__(self, hashes, header_size=16):
+        self.hashes = list(hashes)
+        self.header_size = header_size
+        self.commands = []
+        self.raw_captures = 0
+
+    def shell(self, command):
+        if command == "wm size":
+            return "Physical size: 40x80"
+        self.commands.append(command)
+        value = self.hashes[min(len(self.commands), len(self.hashes)) - 1]
+        return value if value == "ERROR" else f"{value}  -"
+
+    def exec_out(self, command):
+        assert command == "screencap" and not self.raw_captures, "settling must not transfer full screenshots"
+        self.raw_captures += 1
+        header = np.array([40, 80, 1, 0], dtype="<u4").tobytes()[:self.header_size]
+        return header + bytes(40 * 80 * 4)
+
+
+def test_wait_for_settle_returns_once_frames_stop_changing():
+    transport = ScriptedTransport(["a", "b", "c", "c"])
+    controller = AndroidController("emulator-5554", transport=transport)
+
+    settled, elapsed = controller.wait_for_settle(timeout=5, interval=0)
+
+    assert settled and len(transport.commands) == 4
+    # 状态栏(前5%的行，即4行)不参与哈希
+    assert transport.commands[0] == f"screencap | tail -c +{16 + 4 * 40 * 4 + 1} | md5sum"
+    assert transport.raw_captures == 1
+
+
+def test_screen_signature_skips_the_short_header_of_older_android():
+    transport = ScriptedTransport(["a"], header_size=12)
+    controller = AndroidController("emulator-5554", transport=transport)
+
+    controller.screen_signature()
+    controller.screen_signature()
+
+    assert transport.commands == [f"screencap | tail -c +{12 + 4 * 40 * 4 + 1} | md5sum"] * 2
+    assert transport.raw_captures == 1
+
+
+def test_wait_for_settle_times_out_on_animation():
+    transport = ScriptedTransport([str(i % 2) for i in range(1000)])
+    controller = AndroidController("emulator-5554", transport=transport)
+
+    settled, elapsed = controller.wait_for_settle(timeout=0.2, interval=0.01)
+
+    assert not settled and elapsed >= 0.2
+
+
+def test_wait_for_settle_ignores_failed_samples():
+    transport = ScriptedTransport(["a", "ERROR", "ERROR", "a", "a"])
+    controller = AndroidController("emulator-5554", transport=transport)
+
+    settled, elapsed = controller.wait_for_settle(timeout=5, interval=0)
+
+    assert settled and len(transport.commands) == 5
+
+
+def test_async_controller_waits_for_settle_on_the_event_loop():
+    transport = ScriptedTransport(["a", "b", "b"])
+    controller = AsyncAndroidController(AndroidController("emulator-5554", transport=transport))
+
+    settled, elapsed = asyncio.run(controller.wait_for_settle(timeout=5, interval=0))
+
+    assert settled and len(transport.commands) == 3
+
+def scripted_capture(monkeypatch, signatures):
+    controller = AndroidController("emulator-5554", transport=ScriptedTransport(["a"]))
+    signatures, captures = iter(signatures), []
+    monkeypatch.setattr(controller, "screen_signature", lambda ignore_top=0.05: next(signatures))
+    monkeypatch.setattr(controller, "get_screenshot", lambda prefix, save_dir: captures.append(prefix) or "shot.png")
+    monkeypatch.setattr(controller, "get_xml", lambda prefix, save_dir: "dump.xml")
+    return controller, captures
+
+
+def test_capture_is_repeated_when_the_screen_changed(monkeypatch):
+    controller, captures = scripted_capture(monkeypatch, ["a", "b", "b", "b"])
+
+    assert controller.capture_screen_and_xml("1_before", "1", "/tmp", max_retries=1) == ("shot.png", "dump.xml")
+    assert len(captures) == 2
+
+
+def test_capture_is_not_repeated_on_a_still_screen_or_failed_sample(monkeypatch):
+    for signatures in (["a", "a"], ["ERROR"], ["a", "ERROR"]):
+        controller, captures = scripted_capture(monkeypatch, signatures)
+
+        controller.capture_screen_and_xml("1_before", "1", "/tmp", max_retries=1)
+
+        assert len(captures) == 1
@@ -0,0 +1,54 @@
+import pytest
+
+from agents.app_resolver import AppResolver, PackageIndex, normalize_task, parse_packages
+
+INSTALLED = ["com.android.settings", "com.baidu.BaiduMap", "com.baidu.searchbox", "com.tencent.mm",
+             "com.xingin.xhs", "com.android.mms"]
+
+
+@pytest.fixture
+def resolver():
+    return AppResolver(["configs/app2package_CN.yaml", "configs/app2package_EN.yaml"])
+
+
+def test_normalize_task():
+    assert normalize_task("帮我打开 小红书！") == "帮我打开小红书"
+    assert normalize_task("Open WPS Office, please") == "openwpsofficeplease"
+
+
+@pytest.mark.parametrize("task, package", [("帮我打开百度地图", "com.baidu.BaiduMap"),
+                                           ("打开小红书", "com.xingin.xhs"),
+                                           ("Open the Settings app", "com.android.settings"),
+                                           ("帮我给john发条手机短信，和他说hello", "com.android.mms"),
+                                           ("打开百度贴吧", None),
+                                           ("帮我打开唯品会APP", None),
+                                           ("把小红书上的图片发到微信", None)])
+def test_resolve(resolver, task, package):
+    assert resolver.resolve(task, INSTALLED) == package
+
+
+def test_decision_cache(resolver, tmp_path):
+    resolver.set_disk_dir(str(tmp_path))
+    resolver.remember("打开 百度贴吧", "com.baidu.searchbox")
+    assert resolver.resolve("打开百度贴吧!", INSTALLED) == "com.baidu.searchbox"
+    # 缓存的应用已卸载时不再使用
+    assert resolver.resolve("打开百度贴吧", ["com.android.settings"]) is None
+    reloaded = AppResolver(["configs/app2package_CN.yaml"])
+    reloaded.set_disk_dir(str(tmp_path))
+    assert reloaded.resolve("打开百度贴吧", INSTALLED) == "com.baidu.searchbox"
+    reloaded.forget("打开百度贴吧")
+    assert reloaded.resolve("打开百度贴吧", INSTALLED) is None
+
+
+def test_package_index(tmp_path):
+    index = PackageIndex("10.0.0.1:5555", ttl=60, disk_dir=str(tmp_path))
+    assert index.cached() is None
+    assert index.update("package:com.tencent.mm\r\npackage:com.android.settings\n") == parse_packages(
+        "package:com.android.settings\npackage:com.tencent.mm")
+    assert PackageIndex("10.0.0.1:5555", ttl=60, disk_dir=str(tmp_path)).cached() == ["com.android.settings",
+                                                                                     "com.tencent.mm"]
+    index.invalidate()
+    assert PackageIndex("10.0.0.1:5555", ttl=60, disk_dir=str(tmp_path)).cached() is None
+    expired = PackageIndex("10.0.0.1:5555", ttl=0)
+    expired.update("package:com.tencent.mm")
+    assert expired.cached() is None
@@ -0,0 +1,47 @@
+import numpy as np
+
+from agents.change_detector import detect_no_change
+from tests.dumps import write_dump
+from utils import Frame, frame_store
+
+
+def put_frame(path, image):
+    frame_store.put(str(path), Frame(image=image))
+    return str(path)
+
+
+def screen(seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (400, 200, 3), dtype=np.uint8)
+    return np.ascontiguousarray(np.repeat(np.repeat(image[::8, ::8], 8, axis=0), 8, axis=1))
+
+
+def test_unchanged_screen_is_detected(tmp_path):
+    before = put_frame(tmp_path / "0_before.png", screen())
+    noisy = screen().astype(np.int16) + 3
+    after = put_frame(tmp_path / "1_before.png", noisy.clip(0, 255).astype(np.uint8))
+
+    result = detect_no_change(before, after, write_dump(tmp_path / "0.xml"), write_dump(tmp_path / "1.xml"))
+
+    assert result["unchanged"] and result["same_hierarchy"]
+
+
+def test_changed_pixels_or_hierarchy_count_as_change(tmp_path):
+    before = put_frame(tmp_path / "0_before.png", screen())
+    toggled = screen()
+    toggled[100:140, 40:160] = 255
+    after = put_frame(tmp_path / "1_before.png", toggled)
+    xml = write_dump(tmp_path / "0.xml")
+
+    assert not detect_no_change(before, after, xml, write_dump(tmp_path / "1.xml"))["unchanged"]
+    moved = detect_no_change(before, before, xml, write_dump(tmp_path / "2.xml", x=20))
+    assert not moved["unchanged"] and not moved["same_hierarchy"]
+
+
+def test_state_changes_count_as_change(tmp_path):
+    # 开关切换或计数变化只改变很少的像素，要靠层级中的状态属性识别
+    before = put_frame(tmp_path / "0_before.png", screen())
+    xml = write_dump(tmp_path / "0.xml")
+
+    for name, kwargs in (("checked", {"checked": "true"}), ("text", {"text": "OK 2"})):
+        result = detect_no_change(before, before, xml, write_dump(tmp_path / f"{name}.xml", **kwargs))
+        assert not result["unchanged"] and not result["same_hierarchy"]
@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from agents import android_agent
+from agents.history import OperationHistory
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_dispatched_action_survives_failed_explore(tmp_path, monkeypatch, use_async):
+    def stream(on_action=None, **kwargs):
+        on_action(["tap", 1])
+        raise RuntimeError("connection reset")
+
+    async def astream(on_action=None, **kwargs):
+        return stream(on_action=on_action, **kwargs)
+
+    taps = []
+    monkeypatch.setitem(android_agent.configs, "EXPLORE_STREAM", True)
+    monkeypatch.setattr(android_agent.lang_mllm, "stream_explor_rsp", stream)
+    monkeypatch.setattr(android_agent.lang_mllm, "astream_explor_rsp", astream)
+    monkeypatch.setattr(android_agent, "element_docs", lambda state: None)
+    monkeypatch.setattr(android_agent, "reflect_previous_action_node",
+                        lambda state: {"fallback_decision": "SUCCESS", "useless_list": set()})
+
+    async def areflect(state):
+        return {"fallback_decision": "SUCCESS", "useless_list": set()}
+
+    monkeypatch.setattr(android_agent, "areflect_previous_action_node", areflect)
+    monkeypatch.setattr(android_agent.controller, "tap", lambda x, y: taps.append((x, y)) or "")
+
+    async def atap(x, y):
+        return android_agent.controller.tap(x, y)
+
+    monkeypatch.setattr(android_agent.async_controller, "tap", atap)
+    history = OperationHistory()
+    state = {"task_desc": "open settings", "last_act": "None", "round_count": 1,
+             "current_page_screenshot_draw": "1_before_labeled.png",
+             "explore_log_path": str(tmp_path / "explore.log"), "operation_history": history,
+             "current_elem_list": [SimpleNamespace(uid="id/ok", center=(35, 25))]}
+
+    if use_async:
+        output_state = asyncio.run(android_agent.adeliberate_node(state))
+    else:
+        output_state = android_agent.deliberate_node(state)
+
+    assert taps == [(35, 25)]
+    assert output_state["next_action"] == ["tap", 1, "I performed tap on element 1."]
+    assert output_state["dispatched_action"][:2] == ["tap", [35, 25]]
+    assert history.messages[-1].content == "I performed tap on element 1."
@@ -0,0 +1,30 @@
+from agents.doc_store import DocStore
+
+
+def test_lookup_and_batched_writes(tmp_path):
+    path = str(tmp_path / "docs.db")
+    store = DocStore(path, batch_size=2)
+    assert store.lookup("com.android.mms", ["send_0", "back_1"]) == {}
+    assert store.put("com.android.mms", "send_0", "tap", "sends the message") is False
+    # 未满一批时只在内存中，读取仍能看到
+    assert store.get("com.android.mms", "send_0", "tap") == "sends the message"
+    assert DocStore(path).lookup("com.android.mms", ["send_0"]) == {}
+    assert store.put("com.android.mms", "send_0", "tap", "sends the typed message") is True
+    store.put("com.android.mms", "send_0", "long_press", "shows more options")
+    reopened = DocStore(path)
+    assert reopened.lookup("com.android.mms", ["send_0", "back_1"]) == {
+        "send_0": {"tap": "sends the typed message", "long_press": "shows more options"}}
+    # 不同应用中相同uid的文档互不影响
+    assert reopened.lookup("com.tencent.mm", ["send_0"]) == {}
+
+
+def test_flush_and_cache_miss(tmp_path):
+    path = str(tmp_path / "docs.db")
+    store = DocStore(path, batch_size=100)
+    store.put("com.android.mms", "send_0", "tap", "sends the message")
+    other = DocStore(path, max_items=1)
+    assert other.lookup("com.android.mms", ["send_0"]) == {}
+    store.flush()
+    # 已缓存的“无文档”结果被淘汰后重新从数据库读取
+    other.lookup("com.android.mms", ["back_1"])
+    assert other.lookup("com.android.mms", ["send_0"]) == {"send_0": {"tap": "sends the message"}}
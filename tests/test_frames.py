@@ -0,0 +1,96 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from utils.frames import Frame, frame_store, parse_raw_screencap, upload_scale, encode_for_upload, EncodedImageCache
+
+
+def raw_screencap(pixels, pixel_format=1, color_space=True):
+    height, width = pixels.shape[:2]
+    header = struct.pack("<III", width, height, pixel_format)
+    if color_space:
+        header += struct.pack("<I", 0)
+    return header + pixels.tobytes()
+
+
+@pytest.mark.parametrize("color_space", [True, False])
+def test_parse_raw_screencap_is_zero_copy(color_space):
+    rgba = np.zeros((4, 3, 4), dtype=np.uint8)
+    rgba[1, 2] = (255, 0, 0, 255)
+    data = raw_screencap(rgba, color_space=color_space)
+
+    pixels, _ = parse_raw_screencap(data)
+
+    assert pixels.shape == (4, 3, 4)
+    assert not pixels.flags.owndata
+    assert (pixels == rgba).all()
+
+
+def test_raw_frame_is_converted_to_bgr():
+    rgba = np.zeros((4, 3, 4), dtype=np.uint8)
+    rgba[1, 2] = (255, 0, 0, 255)
+
+    frame = Frame.from_raw(raw_screencap(rgba))
+
+    assert frame.image.shape == (4, 3, 3)
+    assert tuple(frame.image[1, 2]) == (0, 0, 255)
+    assert frame.data.startswith(b"\x89PNG")
+
+
+def test_parse_raw_screencap_rejects_truncated_data():
+    data = raw_screencap(np.zeros((4, 3, 4), dtype=np.uint8))
+
+    with pytest.raises(ValueError):
+        parse_raw_screencap(data[:-5])
+
+
+def test_upload_scale_respects_budgets_and_legibility_floor():
+    assert upload_scale(1440, 3200, max_long_edge=1600) == 0.5
+    assert upload_scale(1000, 1000, max_pixels=250000) == 0.5
+    assert upload_scale(1440, 3200, max_long_edge=640, min_scale=0.5) == 0.5
+    assert upload_scale(720, 1280, max_long_edge=1344) == 1.0
+
+
+def test_encode_for_upload_resizes_and_labels_mime(tmp_path):
+    path = str(tmp_path / "screen.png")
+    frame_store.put(path, Frame(image=np.random.default_rng(0).integers(0, 256, (800, 400, 3), dtype=np.uint8)))
+
+    data, mime_type = encode_for_upload(path, image_format="jpeg", quality=80, max_long_edge=400)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert mime_type == "image/jpeg" and data[:2] == b"\xff\xd8"
+    assert image.shape == (400, 200, 3)
+
+    data, mime_type = encode_for_upload(path, image_format="webp", min_scale=1.0, max_long_edge=400)
+    assert mime_type == "image/webp" and data[8:12] == b"WEBP"
+
+
+def test_encoded_image_cache_reuses_until_the_frame_changes(tmp_path):
+    path = str(tmp_path / "0_before_labeled.png")
+    calls = []
+
+    def encode(p, **params):
+        calls.append(p)
+        return b"x" * 40
+
+    cache = EncodedImageCache(max_bytes=100)
+    frame_store.put(path, Frame(image=np.zeros((4, 4, 3), dtype=np.uint8)))
+    cache.get_or_encode(path, encode, quality=80)
+    cache.get_or_encode(path, encode, quality=80)
+    assert len(calls) == 1
+    cache.get_or_encode(path, encode, quality=60)
+    frame_store.put(path, Frame(image=np.ones((4, 4, 3), dtype=np.uint8)))
+    cache.get_or_encode(path, encode, quality=80)
+
+    assert len(calls) == 3
+    assert cache.stats() == {"hits": 1, "misses": 3, "items": 2, "bytes": 80}
+
+
+def test_encoded_image_cache_misses_when_the_image_is_gone(tmp_path):
+    # 帧已从frame_store淘汰且从未落盘时，不应在计算缓存键时抛出异常
+    path = str(tmp_path / "1_before_labeled.png")
+    cache = EncodedImageCache(max_bytes=100)
+
+    assert cache.get_or_encode(path, lambda p, **params: b"y" * 10, quality=80) == b"y" * 10
+    assert cache.stats() == {"hits": 0, "misses": 1, "items": 0, "bytes": 0}
@@ -0,0 +1,60 @@
+from agents.history import OperationHistory, clip_tokens, estimate_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("打开设置") == 4
+
+
+def test_window_and_summary():
+    history = OperationHistory(window=3, max_tokens=10_000, summary_tokens=10_000)
+    history.add_user_message("send a message")
+    for i in range(5):
+        history.add_ai_message(f"step {i}")
+    contents = [message.content for message in history.messages]
+    assert contents[0] == "send a message"
+    assert contents[1] == "Summary of earlier steps: step 0 step 1"
+    assert contents[2:] == ["step 2", "step 3", "step 4"]
+
+
+def test_token_budget_is_bounded():
+    history = OperationHistory(window=8, max_tokens=400, summary_tokens=250)
+    history.add_user_message("send a message to john")
+    counts = []
+    for i in range(20):
+        history.add_ai_message(f"I tapped the button number {i} and then typed some text into the box. " * 2)
+        counts.append(history.token_count())
+    assert max(counts) <= 400
+    # 最新的一步始终原样保留
+    assert history.messages[-1].content.startswith("I tapped the button number 19")
+
+
+def test_summary_keeps_every_step():
+    history = OperationHistory(window=2, max_tokens=10_000, summary_tokens=150)
+    for i in range(30):
+        history.add_ai_message(f"I tapped the button number {i} and then typed some text into the box.")
+    summary = history.messages[0].content
+    assert estimate_tokens(summary) > 150
+    for i in range(28):
+        assert f"number {i} " in summary
+    # 最早的步骤先被截短
+    assert summary.count("…") == 28
+    assert history.messages[1].content.endswith("number 28 and then typed some text into the box.")
+
+
+def test_summary_condenses_oldest_steps_first():
+    history = OperationHistory(window=1, max_tokens=10_000, summary_tokens=70)
+    words = " ".join(["word"] * 20)
+    for i in range(4):
+        history.add_ai_message(f"step {i} {words}")
+    summary = history.messages[0].content
+    assert estimate_tokens(summary) <= 70
+    assert summary.count("…") == 2
+    assert summary.endswith(f"step 2 {words}")
+
+
+def test_clip_tokens():
+    assert clip_tokens("open the settings app", 100) == "open the settings app"
+    assert clip_tokens("open the settings app", 4) == "open the…"
+    assert estimate_tokens(clip_tokens("打开设置然后搜索咖啡", 5)) <= 5
@@ -1 +1,94 @@
+import pytest
+from langchain_core.runnables import RunnableGenerator
+
+from agents import prompts
 from agents.model import Lang_Azure
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Lang_Azure(base_url="http://127.0.0.1:9", api_key="dummy", api_version="2024-02-01", model="gpt-4o",
+                      temperature=0, max_tokens=16)
+
+
+@pytest.mark.parametrize("last_res, action", [(["tap", 3], "tapping"), (["text", 3], "typing"),
+                                              (["long_press", 3], "long pressing"),
+                                              (["swipe", 3, "up", "medium"], "v_swipe"),
+                                              (["swipe", 3, "left", "short"], "h_swipe")])
+def test_reflect_prompt_action(last_res, action):
+    prompt = Lang_Azure.reflect_prompt(last_res, "open settings", "tapped the icon")
+    assert f"before and after {action} the UI" in prompt
+    assert "labeled with the number 3 on" in prompt
+    # 判定规则只在静态前缀中出现
+    assert "Decision: INEFFECTIVE" not in prompt
+
+
+def test_reflect_prompt_undefined_action():
+    with pytest.raises(ValueError):
+        Lang_Azure.reflect_prompt(["grid", 0], "open settings", "")
+
+
+def test_prefix_is_stable(model):
+    first = model.build_messages("explore", model.explore_prefix, model.explore_prompt("task a", "None"), [])
+    second = model.build_messages("explore", model.explore_prefix, model.explore_prompt("task b", "tapped"), [])
+    assert first[0].content == second[0].content == prompts.self_explore_prefix_str
+    assert first[1].content != second[1].content
+    # 拆分后的各部分仍能拼回完整模板
+    assert prompts.self_explore_task_template_str.startswith(prompts.self_explore_functions_str)
+    assert prompts.self_explore_task_template_str.endswith(prompts.self_explore_output_format_str)
+
+
+def test_explore_prompt_docs():
+    assert Lang_Azure.explore_prompt("task", "None", None) == Lang_Azure.explore_prompt("task", "None")
+    prompt = Lang_Azure.explore_prompt("task", "None", "Element 3: tap: sends the message")
+    assert prompt.startswith(Lang_Azure.explore_prompt("task", "None"))
+    assert prompt.endswith("Element 3: tap: sends the message\n")
+
+
+
+def streamed(chunks, events, fail=False):
+    def gen(inp):
+        for _ in inp:
+            pass
+        for chunk in chunks:
+            events.append(("chunk", list(chunk)))
+            yield chunk
+        if fail:
+            raise ConnectionError("stream closed")
+    return RunnableGenerator(gen)
+
+
+ACTION_FIRST_CHUNKS = [{"Action": "tap("}, {"Action": "tap(12)"}, {"Action": "tap(12)", "Summary": "I tapped"},
+                       {"Action": "tap(12)", "Summary": "I tapped", "Observation": "o", "Thought": "t"}]
+
+
+def test_stream_dispatches_action_before_completion(model):
+    events = []
+    model.explore_action_first_model = streamed(ACTION_FIRST_CHUNKS, events)
+    res = model.stream_explor_rsp("task", "None", [], on_action=lambda action: events.append(("action", action)),
+                                  action_first=True)
+    assert res == ["tap", 12, "I tapped"]
+    # Action字段在后续字段出现后才完整，回调发生在最后一个分片之前
+    assert events.index(("action", ["tap", 12])) == 3
+
+
+def test_stream_keeps_dispatched_action_on_error(model):
+    events = []
+    model.explore_action_first_model = streamed(ACTION_FIRST_CHUNKS[:3], events, fail=True)
+    res = model.stream_explor_rsp("task", "None", [], on_action=lambda action: events.append(("action", action)),
+                                  action_first=True)
+    assert res == ["tap", 12, "I tapped"]
+    model.explore_stream_model = streamed([{"Observation": "o"}], [], fail=True)
+    assert model.stream_explor_rsp("task", "None", []) == ["ERROR"]
+
+
+def test_stream_reports_completion():
+    model = Lang_Azure(base_url="http://127.0.0.1:9", api_key="dummy", api_version="2024-02-01", model="gpt-4o",
+                       temperature=0, max_tokens=16, explore_completion=True)
+    assert model.explore_prefix.content.endswith(prompts.self_explore_completion_format_str)
+    chunk = {"Observation": "o", "Thought": "t", "Action": "FINISH", "Summary": "done", "Completion": " finished",
+             "Confidence": 0.9}
+    model.explore_stream_model = streamed([chunk], [])
+    completion = {}
+    assert model.stream_explor_rsp("task", "None", [], on_completion=completion.update) == ["FINISH"]
+    assert completion == {"verdict": "FINISHED", "confidence": 0.9}
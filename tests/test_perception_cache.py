@@ -0,0 +1,25 @@
+from agents.and_controller import build_element_store, hierarchy_fingerprint
+from agents.perception_cache import PerceptionCache
+from tests.dumps import write_dump
+
+
+def test_fingerprint_ignores_text_and_focus(tmp_path):
+    base = hierarchy_fingerprint(write_dump(tmp_path / "a.xml"))
+
+    assert hierarchy_fingerprint(write_dump(tmp_path / "b.xml", text="Cancel", focused="true")) == base
+    assert hierarchy_fingerprint(write_dump(tmp_path / "c.xml", x=20)) != base
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    xml_path = write_dump(tmp_path / "a.xml")
+    store = build_element_store(xml_path, min_dist=30)
+    cache = PerceptionCache(disk_dir=str(tmp_path / "cache"))
+    cache.set_disk_dir(str(tmp_path / "cache"))
+    key = cache.key(xml_path, min_dist=30)
+    cache.put(key, store)
+
+    restored = PerceptionCache(disk_dir=str(tmp_path / "cache")).get(key)
+
+    assert restored.uids == store.uids
+    assert (restored.bboxes == store.bboxes).all()
+    assert (restored.label_positions == store.label_positions).all()
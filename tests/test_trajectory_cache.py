@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from agents.trajectory_cache import TrajectoryCache, step_matches
+
+STEPS = [{"fingerprint": "a", "uid": "btn_send", "action": ["tap", 2], "summary": "tapped send"},
+         {"fingerprint": "b", "uid": None, "action": ["text", "hello"], "summary": "typed hello"}]
+
+
+def test_put_and_get(tmp_path):
+    cache = TrajectoryCache(disk_dir=str(tmp_path))
+    assert cache.get("send hello to john") == []
+    cache.put("send hello to john", STEPS)
+    # 任务文本按规范化后的形式匹配
+    assert TrajectoryCache(disk_dir=str(tmp_path)).get("Send hello to John.") == STEPS
+    steps = cache.get("send hello to john")
+    steps[0]["action"] = ["tap", 3]
+    # 返回的是副本，修改不影响缓存
+    assert cache.get("send hello to john") == STEPS
+
+
+def test_step_matches():
+    elems = [SimpleNamespace(uid="btn_back"), SimpleNamespace(uid="btn_send")]
+    assert step_matches(STEPS[0], "a", elems)
+    assert not step_matches(STEPS[0], "b", elems)
+    assert not step_matches(STEPS[0], "a", elems[:1])
+    assert not step_matches(STEPS[0], "a", elems[::-1])
+    assert step_matches(STEPS[1], "b", [])
@@ -0,0 +1,39 @@
+from agents.ui_diff import UiDiffer, changed_region, format_diff
+
+DUMP = ('<?xml version="1.0"?><hierarchy><node index="0" class="android.widget.FrameLayout" resource-id="" '
+        'text="" content-desc="" bounds="[0,0][1080,2400]">{children}</node></hierarchy>')
+NODE = ('<node index="{index}" class="android.widget.TextView" resource-id="com.app:id/{name}" text="{text}" '
+        'content-desc="" bounds="[{x1},{y1}][{x2},{y2}]" />')
+
+
+def write_dump(path, nodes):
+    children = "".join(NODE.format(index=i, name=name, text=text, x1=box[0], y1=box[1], x2=box[2], y2=box[3])
+                       for i, (name, text, box) in enumerate(nodes))
+    path.write_text(DUMP.format(children=children))
+    return str(path)
+
+
+def test_diff_reports_added_removed_moved_and_text(tmp_path):
+    before = write_dump(tmp_path / "0.xml", [("title", "Inbox", (0, 0, 1080, 100)),
+                                             ("badge", "3", (900, 10, 950, 60)),
+                                             ("fab", "", (900, 2000, 1000, 2100))])
+    after = write_dump(tmp_path / "1.xml", [("title", "Inbox", (0, 0, 1080, 100)),
+                                            ("badge", "4", (900, 10, 950, 60)),
+                                            ("snackbar", "Sent", (0, 2200, 1080, 2400))])
+
+    diff = UiDiffer().diff(before, after)
+
+    assert [item[0] for item in diff["added"]] == ["android.widget.FrameLayout_1080_2400_com.app.id_snackbar_2"]
+    assert [item[0] for item in diff["removed"]] == ["android.widget.FrameLayout_1080_2400_com.app.id_fab_2"]
+    assert [(item[2], item[3]) for item in diff["text_changed"]] == [("3", "4")]
+    assert changed_region(diff, (1080, 2400)) == (0, 0, 1080, 2400)
+    assert '"3" -> "4"' in format_diff(diff)
+
+
+def test_unchanged_tree_has_no_region(tmp_path):
+    nodes = [("title", "Inbox", (0, 0, 1080, 100))]
+    differ = UiDiffer()
+    diff = differ.diff(write_dump(tmp_path / "0.xml", nodes), write_dump(tmp_path / "1.xml", nodes))
+
+    assert changed_region(diff, (1080, 2400)) is None
+    assert format_diff(diff) == "No structural change in the UI hierarchy."
@@ -0,0 +1,35 @@
+import numpy as np
+
+from agents.and_controller import AndroidElement
+from utils import draw_bbox_multi
+
+
+def spaced_elements(count, step=120):
+    attribs = ["clickable", "focusable", ""]
+    elements = []
+    for i in range(count):
+        x, y = 20 + (i % 4) * step, 20 + (i // 4) * step
+        elements.append(AndroidElement.create(f"elem_{i}", ((x, y), (x + 60, y + 40)), attribs[i % 3]))
+    return elements
+
+
+def test_batched_labels_match_per_label_rendering(tmp_path):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(520, 500, 3), dtype=np.uint8)
+    # 最后一行的标注超出图像右下边界，验证裁剪行为一致
+    elements = spaced_elements(16) + [AndroidElement.create("edge", ((440, 480), (500, 520)), "")]
+    for record_mode, dark_mode in [(False, False), (False, True), (True, False)]:
+        expected = draw_bbox_multi(image, str(tmp_path / "legacy.png"), elements, record_mode=record_mode,
+                                   dark_mode=dark_mode, save=False, batched=False)
+        actual = draw_bbox_multi(image, str(tmp_path / "batched.png"), elements, record_mode=record_mode,
+                                 dark_mode=dark_mode, save=False)
+        assert np.array_equal(actual, expected)
+
+
+def test_batched_labels_skip_boxes_outside_the_image(tmp_path):
+    image = np.full((100, 100, 3), 128, dtype=np.uint8)
+    element = AndroidElement.create("corner", ((-20, -20), (-10, -14)), "")
+
+    labeled = draw_bbox_multi(image, str(tmp_path / "corner.png"), [element], save=False)
+
+    assert np.array_equal(labeled, image)
@@ -1,12 +1,32 @@
-from .utils import print_with_color, draw_bbox_multi, encode_image, show_graph
+from .utils import print_with_color, draw_bbox_multi, encode_image, encode_image_url, show_graph
 from .utils import parse_explore_rsp, parse_reflect_rsp, AppLaunchOutputParser
+from .perf import PerfStats, perf_stats
+from .frames import Frame, PathStore, frame_store, save_frame_async, load_image, load_image_bytes, dhash
+from .frames import small_gray, diff_ratio, parse_raw_screencap
+from .frames import upload_scale, encode_for_upload, frame_identity, EncodedImageCache
 
 __all__ = [
     "print_with_color",
     "draw_bbox_multi",
     "encode_image",
+    "encode_image_url",
     "show_graph",
     "parse_explore_rsp",
     "parse_reflect_rsp",
-    "AppLaunchOutputParser"
-]
\ No newline at end of file
+    "AppLaunchOutputParser",
+    "PerfStats",
+    "perf_stats",
+    "Frame",
+    "PathStore",
+    "frame_store",
+    "save_frame_async",
+    "load_image",
+    "load_image_bytes",
+    "dhash",
+    "small_gray",
+    "diff_ratio",
+    "upload_scale",
+    "encode_for_upload",
+    "frame_identity",
+    "EncodedImageCache"
+]
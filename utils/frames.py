@@ -0,0 +1,315 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .perf import perf_stats
+
+
+# screencap pixel formats (android PixelFormat) -> (bytes per pixel, cv2 conversion to BGR)
+RAW_PIXEL_FORMATS = {
+    1: (4, cv2.COLOR_RGBA2BGR),  # RGBA_8888
+    2: (4, cv2.COLOR_RGBA2BGR),  # RGBX_8888
+    3: (3, cv2.COLOR_RGB2BGR),  # RGB_888
+    4: (2, cv2.COLOR_BGR5652BGR),  # RGB_565
+    5: (4, cv2.COLOR_BGRA2BGR),  # BGRA_8888
+}
+
+
+def parse_raw_screencap(data):
+    """
+    Parses the output of `screencap` without `-p`.
+
+    The header holds width, height and pixel format as little-endian uint32, followed on Android 9+ by a
+    uint32 color space. The pixels are wrapped with `np.frombuffer` without copying.
+
+    Returns:
+    - (pixels, conversion): an (h, w, bpp) uint8 view over `data` and the cv2 code converting it to BGR.
+    """
+    if len(data) < 12:
+        raise ValueError("Raw screencap output is too short")
+    width, height, pixel_format = map(int, np.frombuffer(data, dtype="<u4", count=3))
+    if pixel_format not in RAW_PIXEL_FORMATS:
+        raise ValueError(f"Unsupported screencap pixel format: {pixel_format}")
+    bpp, conversion = RAW_PIXEL_FORMATS[pixel_format]
+    size = width * height * bpp
+    header_size = len(data) - size
+    if header_size not in (12, 16):
+        raise ValueError(f"Unexpected raw screencap size {len(data)} for {width}x{height}")
+    pixels = np.frombuffer(data, dtype=np.uint8, count=size, offset=header_size)
+    return pixels.reshape(height, width, bpp), conversion
+
+
+_frame_ids = itertools.count(1)
+
+
+class Frame:
+    """
+    A screenshot held in memory.
+
+    A frame can be created from encoded image bytes or from a decoded BGR array; the other representation
+    is produced lazily on first access and kept, so each frame is decoded or encoded at most once.
+    """
+
+    def __init__(self, data=None, image=None, ext=".png"):
+        if data is None and image is None:
+            raise ValueError("A frame needs encoded data or a decoded image")
+        self._data = data
+        self._image = image
+        self.ext = ext
+        # 进程内唯一的帧标识，同一路径被新帧覆盖时标识随之变化
+        self.uid = next(_frame_ids)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_raw(cls, data):
+        """Builds a frame from raw framebuffer bytes; the PNG is only encoded on the host if needed."""
+        pixels, conversion = parse_raw_screencap(data)
+        return cls(image=cv2.cvtColor(pixels, conversion))
+
+    @property
+    def data(self):
+        with self._lock:
+            if self._data is None:
+                with perf_stats.timer("frame.encode"):
+                    ok, buf = cv2.imencode(self.ext, self._image)
+                if not ok:
+                    raise ValueError("Failed to encode frame")
+                self._data = buf.tobytes()
+            return self._data
+
+    @property
+    def image(self):
+        with self._lock:
+            if self._image is None:
+                with perf_stats.timer("frame.decode"):
+                    self._image = cv2.imdecode(np.frombuffer(self._data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if self._image is None:
+                    raise ValueError("Failed to decode frame")
+                perf_stats.incr("frame.alloc_bytes", self._image.nbytes)
+            return self._image
+
+
+class PathStore:
+    """
+    A bounded, thread-safe LRU mapping from file paths to in-memory artifacts (frames, hierarchy dumps).
+
+    The path stays the handle passed around in ControlState, whether or not the file exists on disk.
+    """
+
+    def __init__(self, max_items=16):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, path, item):
+        key = os.path.normpath(path)
+        with self._lock:
+            self._items[key] = item
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def get(self, path):
+        key = os.path.normpath(path)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+frame_store = PathStore()
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-writer")
+
+
+def _write_frame(path, frame):
+    try:
+        with open(path, "wb") as f:
+            f.write(frame.data)
+    except Exception as e:
+        from .utils import print_with_color
+        print_with_color(f"ERROR: failed to save {path}: {e}", "red")
+
+
+def save_frame_async(path, frame):
+    """Writes `frame.data` to disk on a background thread; returns the pending future."""
+    return _writer.submit(_write_frame, path, frame)
+
+
+def dhash(image, hash_size=8):
+    """Difference hash of a BGR image as a Python int of hash_size * hash_size bits."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def small_gray(image, long_edge=160):
+    """A grayscale copy of a BGR image scaled so its long edge is `long_edge` pixels."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape[:2]
+    scale = long_edge / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+def diff_ratio(small_before, small_after, pixel_delta=16):
+    """The fraction of pixels of two small_gray images whose intensity moved by more than pixel_delta."""
+    if small_before.shape != small_after.shape:
+        return 1.0
+    return float(np.count_nonzero(cv2.absdiff(small_before, small_after) > pixel_delta)) / small_before.size
+
+
+def load_image(path):
+    """
+    Returns the decoded BGR image for `path`, from memory when the frame is cached.
+
+    Images read from disk are cached as frames too, so repeated readers share one decode.
+    """
+    frame = frame_store.get(path)
+    if frame is None:
+        with open(path, "rb") as f:
+            frame = Frame(data=f.read(), ext=os.path.splitext(path)[1] or ".png")
+        frame_store.put(path, frame)
+    return frame.image
+
+
+def frame_identity(path):
+    """
+    A token that changes whenever the image behind `path` changes: the in-memory frame or the file on disk.
+    None when there is neither, e.g. a frame evicted from frame_store that was never written to disk.
+    """
+    frame = frame_store.get(path)
+    if frame is not None:
+        return f"frame:{frame.uid}"
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"file:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def load_image_bytes(path):
+    """Returns the encoded image bytes for `path`, from memory when the frame is cached."""
+    frame = frame_store.get(path)
+    if frame is not None:
+        return frame.data
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# 上传给模型的图像格式 -> (文件扩展名, MIME类型, cv2质量参数)
+UPLOAD_FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", "image/png", None),
+}
+
+
+def upload_scale(width, height, max_long_edge=0, max_pixels=0, min_scale=0.5):
+    """
+    The factor an image is scaled down by before upload: fits both the long-edge and the pixel budget
+    (0 disables either), never enlarges, and never goes below min_scale so labels stay legible.
+    """
+    scale = 1.0
+    if max_long_edge:
+        scale = min(scale, max_long_edge / max(width, height))
+    if max_pixels:
+        scale = min(scale, (max_pixels / (width * height)) ** 0.5)
+    return min(1.0, max(scale, min_scale))
+
+
+def encode_for_upload(path, image_format="jpeg", quality=85, max_long_edge=0, max_pixels=0, min_scale=0.5):
+    """
+    Encodes the image at `path` for a model request within the image budget.
+
+    Returns:
+    - (data, mime_type): the encoded bytes and the matching MIME type.
+    """
+    if image_format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported upload image format: {image_format}")
+    ext, mime_type, quality_flag = UPLOAD_FORMATS[image_format]
+    with perf_stats.timer("upload.encode"):
+        if image_format == "png" and not max_long_edge and not max_pixels and os.path.splitext(path)[1] == ".png":
+            # 不缩放的PNG直接复用已编码的字节
+            data = load_image_bytes(path)
+        else:
+            image = load_image(path)
+            height, width = image.shape[:2]
+            scale = upload_scale(width, height, max_long_edge, max_pixels, min_scale)
+            if scale < 1.0:
+                image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+            params = [quality_flag, int(quality)] if quality_flag is not None else []
+            ok, buf = cv2.imencode(ext, image, params)
+            if not ok:
+                raise ValueError(f"Failed to encode {path} as {image_format}")
+            data = buf.tobytes()
+    perf_stats.incr("upload.images")
+    perf_stats.incr("upload.bytes", len(data))
+    return data, mime_type
+
+
+class EncodedImageCache:
+    """
+    A bounded cache of encoded upload payloads keyed by image identity and encoding parameters.
+
+    A labeled screenshot is sent to explore in one round and to reflection in the next; with the cache it
+    is read and encoded once. Entries are evicted least-recently-used once their total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_encode(self, path, encode, **params):
+        """
+        Returns encode(path, **params) (bytes or str), reusing it while the image behind `path` is unchanged.
+        """
+        identity = frame_identity(path)
+        if identity is None:
+            # 无法确定图像是否变化时不使用缓存，直接重新编码
+            with self._lock:
+                self.misses += 1
+            perf_stats.incr("upload.cache.miss")
+            return encode(path, **params)
+        key = (os.path.normpath(path), identity, tuple(sorted(params.items())))
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                perf_stats.incr("upload.cache.hit")
+                return value
+            self.misses += 1
+        perf_stats.incr("upload.cache.miss")
+        value = encode(path, **params)
+        with self._lock:
+            if key not in self._items and len(value) <= self.max_bytes:
+                self._items[key] = value
+                self._size += len(value)
+                while self._size > self.max_bytes:
+                    _, evicted = self._items.popitem(last=False)
+                    self._size -= len(evicted)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "items": len(self._items), "bytes": self._size}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
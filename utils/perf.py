@@ -0,0 +1,71 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PerfStats:
+    """Thread-safe registry of named timings and counters.
+
+    Timings are aggregated (count/total/max/last) so long runs don't keep every sample.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            item = self._timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+            item["count"] += 1
+            item["total"] += seconds
+            item["max"] = max(item["max"], seconds)
+            item["last"] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def count(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def timing(self, name):
+        with self._lock:
+            item = self._timings.get(name)
+            if item is None:
+                return None
+            return dict(item, avg=item["total"] / item["count"])
+
+    def summary(self, prefix=""):
+        with self._lock:
+            timings = {k: dict(v, avg=v["total"] / v["count"])
+                       for k, v in self._timings.items() if k.startswith(prefix)}
+            counters = {k: v for k, v in self._counters.items() if k.startswith(prefix)}
+        return {"timings": timings, "counters": counters}
+
+    def report(self, prefix=""):
+        from .utils import print_with_color
+        summary = self.summary(prefix)
+        for name, item in sorted(summary["timings"].items()):
+            print_with_color(f"{name}: n={item['count']} avg={item['avg'] * 1000:.1f}ms "
+                             f"max={item['max'] * 1000:.1f}ms total={item['total']:.2f}s", "cyan")
+        for name, value in sorted(summary["counters"].items()):
+            print_with_color(f"{name}: {value}", "cyan")
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+
+
+perf_stats = PerfStats()
@@ -1,5 +1,7 @@
 import base64
+import time
 import cv2
+import numpy as np
 import pyshine as ps
 import io
 from PIL import Image as PILImage
@@ -11,6 +13,9 @@ from langchain_core.output_parsers import BaseOutputParser
 from pydantic import BaseModel, Field
 from colorama import Fore, Style
 
+from .frames import Frame, frame_store, save_frame_async, load_image, load_image_bytes, encode_for_upload
+from .perf import perf_stats
+
 
 def print_with_color(text: str, color=""):
     if color == "red":
@@ -34,8 +39,108 @@ def print_with_color(text: str, color=""):
     print(Style.RESET_ALL)
 
 
-def draw_bbox_multi(img_path, output_path, elem_list, record_mode=False, dark_mode=False):
-    imgcv = cv2.imread(img_path)
+LABEL_FONT = cv2.FONT_HERSHEY_DUPLEX
+# 预渲染的标注数字掩码，按(文字, 字号, 粗细)缓存
+_label_glyphs = {}
+# 标注背景色块，按颜色缓存并原地混合，不再为每个标注分配矩形
+_color_tiles = {}
+
+
+def _label_glyph(label, font_scale, thickness):
+    """
+    Returns (text_width, text_height, pad, mask) for a label, rasterized once with cv2.putText.
+
+    The mask is drawn with the text origin at (pad, pad + text_height), so pasting it at (x - pad, y - pad)
+    reproduces cv2.putText(img, label, (x, y + text_height), ...).
+    """
+    key = (label, font_scale, thickness)
+    glyph = _label_glyphs.get(key)
+    if glyph is None:
+        (text_width, text_height), baseline = cv2.getTextSize(label, LABEL_FONT, fontScale=font_scale,
+                                                              thickness=thickness)
+        pad = baseline + 2 * thickness
+        canvas = np.zeros((text_height + 2 * pad, text_width + 2 * pad), dtype=np.uint8)
+        cv2.putText(canvas, label, (pad, pad + text_height), LABEL_FONT, fontScale=font_scale, color=255,
+                    thickness=thickness)
+        glyph = (text_width, text_height, pad, canvas > 0)
+        _label_glyphs[key] = glyph
+    return glyph
+
+
+def _color_tile(color, height, width, dtype):
+    tile = _color_tiles.get((color, dtype))
+    if tile is None or tile.shape[0] < height or tile.shape[1] < width:
+        tile_height = max(height, 64, 0 if tile is None else tile.shape[0])
+        tile_width = max(width, 128, 0 if tile is None else tile.shape[1])
+        tile = np.empty((tile_height, tile_width, len(color)), dtype=dtype)
+        tile[:] = color
+        _color_tiles[(color, dtype)] = tile
+    return tile[:height, :width]
+
+
+def draw_labels(img, positions, labels, bg_colors, text_colors, vspace=10, hspace=10, font_scale=1, thickness=2,
+                alpha=0.5):
+    """
+    Draws numeric labels in place with the same placement and colours as pyshine.putBText.
+
+    Backgrounds are blended in place against shared colour tiles and the label text is stamped from
+    cached glyph masks afterwards, so no per-label crops, rectangles or text rasterization are needed.
+    Colours are BGR. Labels whose box would start outside the image are skipped, as putBText fails on them.
+    """
+    height, width = img.shape[:2]
+    rects, boxes = [], []
+    for (x, y), label, bg_color in zip(positions, labels, bg_colors):
+        text_width, text_height, pad, glyph = _label_glyph(label, font_scale, thickness)
+        top, left = y - vspace, x - hspace
+        bottom, right = min(y + text_height + vspace, height), min(x + text_width + hspace, width)
+        if top < 0 or left < 0 or top >= bottom or left >= right:
+            boxes.append(None)
+            continue
+        rects.append((top, left, bottom, right, bg_color))
+        boxes.append((x - pad, y - pad, glyph))
+    for top, left, bottom, right, bg_color in rects:
+        roi = img[top:bottom, left:right]
+        cv2.addWeighted(roi, alpha, _color_tile(bg_color, bottom - top, right - left, img.dtype), 1 - alpha, 0,
+                        dst=roi)
+    for box, text_color in zip(boxes, text_colors):
+        if box is None:
+            continue
+        gx, gy, glyph = box
+        x0, y0 = max(gx, 0), max(gy, 0)
+        x1, y1 = min(gx + glyph.shape[1], width), min(gy + glyph.shape[0], height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        img[y0:y1, x0:x1][glyph[y0 - gy:y1 - gy, x0 - gx:x1 - gx]] = text_color
+    return img
+
+
+def _label_positions(elem_list):
+    stores = {id(getattr(elem, "store", None)) for elem in elem_list}
+    if len(stores) == 1 and getattr(elem_list[0], "store", None) is not None:
+        # 同一个ElementStore中的元素直接使用预先计算好的标注位置
+        store = elem_list[0].store
+        return store.label_positions[[elem.row for elem in elem_list]].tolist()
+    return [((elem.bbox[0][0] + elem.bbox[1][0]) // 2 + 10, (elem.bbox[0][1] + elem.bbox[1][1]) // 2 + 10)
+            for elem in elem_list]
+
+
+def draw_bbox_multi(img_path, output_path, elem_list, record_mode=False, dark_mode=False, save=True, batched=True):
+    # img_path可以是路径或已解码的图像；同一截图的多次标注共享一次解码，只复制一次像素
+    image = img_path if isinstance(img_path, np.ndarray) else load_image(img_path)
+    imgcv = image.copy()
+    perf_stats.incr("annotate.alloc_bytes", imgcv.nbytes)
+    draw_start = time.perf_counter()
+    if batched and elem_list:
+        if record_mode:
+            attrib_colors = {"clickable": (0, 0, 250), "focusable": (250, 0, 0)}
+            bg_colors = [attrib_colors.get(elem.attrib, (0, 250, 0)) for elem in elem_list]
+            text_color = (250, 250, 255)
+        else:
+            bg_colors = [(250, 250, 255) if dark_mode else (10, 10, 10)] * len(elem_list)
+            text_color = (10, 10, 10) if dark_mode else (250, 250, 255)
+        draw_labels(imgcv, _label_positions(elem_list), [str(i) for i in range(1, len(elem_list) + 1)],
+                    bg_colors, [text_color] * len(elem_list))
+        elem_list = []
     count = 1
     for elem in elem_list:
         try:
@@ -63,7 +168,12 @@ def draw_bbox_multi(img_path, output_path, elem_list, record_mode=False, dark_mo
         except Exception as e:
             print_with_color(f"ERROR: An exception occurs while labeling the image\n{e}", "red")
         count += 1
-    cv2.imwrite(output_path, imgcv)
+    perf_stats.record("annotate.draw", time.perf_counter() - draw_start)
+    # 标注结果以内存帧的形式交给模型层，落盘为可选的异步操作
+    frame = Frame(image=imgcv)
+    frame_store.put(output_path, frame)
+    if save:
+        save_frame_async(output_path, frame)
     return imgcv
 
 
@@ -103,8 +213,13 @@ def draw_grid(img_path, output_path):
 
 
 def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return base64.b64encode(load_image_bytes(image_path)).decode('utf-8')
+
+
+def encode_image_url(image_path, **budget):
+    """Returns a base64 data URL of the image, resized and re-encoded by encode_for_upload(**budget)."""
+    data, mime_type = encode_for_upload(image_path, **budget)
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
 
 def show_graph(compiled_graph):
     # 获取Mermaid代码